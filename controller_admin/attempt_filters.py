@@ -0,0 +1,74 @@
+"""
+Filtering and keyset pagination for the admin attempt views.
+
+Attempts are always ordered newest first by (start_time, id), and a page is
+fetched by seeking past the last row of the previous one, so every page
+costs the same no matter how deep it is.
+"""
+from datetime import datetime
+
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from exam_user.models import ExamAttempt
+
+PAGE_SIZE = 50
+
+
+def filter_attempts(params):
+    """Apply the attempt list filters found in a QueryDict."""
+    attempts = ExamAttempt.objects.exclude(user__is_superuser=True)
+
+    if params.get('exam', '').isdigit():
+        attempts = attempts.filter(exam_id=params['exam'])
+    if params.get('category', '').isdigit():
+        attempts = attempts.filter(exam__category_id=params['category'])
+    if params.get('user'):
+        attempts = attempts.filter(user__username=params['user'])
+
+    date_from = parse_date(params.get('date_from', ''))
+    if date_from:
+        attempts = attempts.filter(start_time__gte=_start_of_day(date_from))
+    date_to = parse_date(params.get('date_to', ''))
+    if date_to:
+        attempts = attempts.filter(start_time__lt=_start_of_day(date_to) + timezone.timedelta(days=1))
+
+    status = params.get('status')
+    if status == 'passed':
+        attempts = attempts.filter(is_completed=True, percentage__gte=F('exam__pass_percentage'))
+    elif status == 'failed':
+        attempts = attempts.filter(is_completed=True, percentage__lt=F('exam__pass_percentage'))
+    elif status == 'ongoing':
+        attempts = attempts.filter(is_completed=False)
+
+    return attempts.order_by('-start_time', '-id')
+
+
+def _start_of_day(date):
+    return timezone.make_aware(datetime.combine(date, datetime.min.time()))
+
+
+def encode_cursor(attempt):
+    return f'{attempt.start_time.isoformat()}_{attempt.id}'
+
+
+def decode_cursor(cursor):
+    try:
+        start_time, attempt_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(start_time), int(attempt_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def keyset_page(attempts, cursor=None, page_size=PAGE_SIZE):
+    """Return (rows, next cursor) for the page after `cursor`."""
+    position = decode_cursor(cursor)
+    if position:
+        start_time, attempt_id = position
+        attempts = attempts.filter(
+            Q(start_time__lt=start_time) | Q(start_time=start_time, id__lt=attempt_id)
+        )
+    rows = list(attempts[:page_size + 1])
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
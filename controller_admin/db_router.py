@@ -0,0 +1,91 @@
+"""
+Optional routing of admin reporting reads to a "reporting" database.
+
+Reads only go to the reporting alias inside reporting_reads() (or a view
+decorated with reporting_view), and only while the replica is fresher than
+REPORTING_MAX_STALENESS seconds. Everything else, including the whole
+candidate exam flow and every write, stays on the default database.
+
+The replica's age is the time of the last sync, which sync_reporting_db
+records in a marker file next to it (REPORTING_SYNC_MARKER).
+"""
+import functools
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+REPORTING_ALIAS = 'reporting'
+_FRESHNESS_CHECK_INTERVAL = 5
+
+_reporting = ContextVar('reporting_reads', default=False)
+_last_check = [0.0, False]
+
+
+def sync_marker_path():
+    marker = getattr(settings, 'REPORTING_SYNC_MARKER', None)
+    if marker:
+        return marker
+    return f"{settings.DATABASES[REPORTING_ALIAS]['NAME']}.synced"
+
+
+def replica_is_fresh():
+    max_staleness = getattr(settings, 'REPORTING_MAX_STALENESS', None)
+    if max_staleness is None:
+        return True
+    now = time.monotonic()
+    if now - _last_check[0] > _FRESHNESS_CHECK_INTERVAL:
+        try:
+            age = time.time() - os.path.getmtime(sync_marker_path())
+        except OSError:
+            age = float('inf')
+        _last_check[:] = [now, age <= max_staleness]
+    return _last_check[1]
+
+
+def reporting_enabled():
+    return REPORTING_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def reporting_reads():
+    """Send ORM reads made in this block to the reporting database when possible."""
+    token = _reporting.set(True)
+    try:
+        yield
+    finally:
+        _reporting.reset(token)
+
+
+def _stream_with_reporting_reads(content):
+    with reporting_reads():
+        yield from content
+
+
+def reporting_view(view):
+    """Run a read-only view, including any streamed body, under reporting_reads()."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with reporting_reads():
+            response = view(request, *args, **kwargs)
+        if response.streaming:
+            response.streaming_content = _stream_with_reporting_reads(response.streaming_content)
+        return response
+    return wrapper
+
+
+class ReportingRouter:
+    def db_for_read(self, model, **hints):
+        if _reporting.get() and reporting_enabled() and replica_is_fresh():
+            return REPORTING_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._state.db, obj2._state.db} <= {'default', REPORTING_ALIAS}:
+            return True
+        return None
@@ -0,0 +1,85 @@
+"""
+Streaming exports of attempts and answers.
+
+Rows are read with values_list().iterator() in chunks and written out one
+line at a time, so memory use does not grow with the size of the export.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from exam_user.models import Answer
+
+CHUNK_SIZE = 2000
+
+ATTEMPT_FIELDS = [
+    ('attempt_id', 'attempt_id'),
+    ('username', 'user__username'),
+    ('exam', 'exam__name'),
+    ('category', 'exam__category__name'),
+    ('start_time', 'start_time'),
+    ('end_time', 'end_time'),
+    ('score', 'score'),
+    ('total_marks', 'total_marks'),
+    ('percentage', 'percentage'),
+    ('is_completed', 'is_completed'),
+    ('pass_percentage', 'exam__pass_percentage'),
+]
+
+ANSWER_FIELDS = [
+    ('question_id', 'question_id'),
+    ('selected_answer', 'selected_answer'),
+    ('is_correct', 'is_correct'),
+    ('marks_obtained', 'marks_obtained'),
+]
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def export_columns(include_answers=False):
+    columns = [name for name, _ in ATTEMPT_FIELDS]
+    if include_answers:
+        columns += [name for name, _ in ANSWER_FIELDS]
+    return columns
+
+
+def iter_rows(attempts, include_answers=False):
+    """Yield one tuple per attempt, or per answer when include_answers is set."""
+    if not include_answers:
+        lookups = [lookup for _, lookup in ATTEMPT_FIELDS]
+        return attempts.values_list(*lookups).iterator(chunk_size=CHUNK_SIZE)
+    lookups = [f'attempt__{lookup}' for _, lookup in ATTEMPT_FIELDS] + [lookup for _, lookup in ANSWER_FIELDS]
+    answers = Answer.objects.filter(attempt__in=attempts.values('id')).order_by('attempt_id', 'question_id')
+    return answers.values_list(*lookups).iterator(chunk_size=CHUNK_SIZE)
+
+
+class _Echo:
+    """File-like object whose write() just returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_export(attempts, export_format='csv', include_answers=False):
+    """Yield the lines of an export in the given format."""
+    columns = export_columns(include_answers)
+    rows = iter_rows(attempts, include_answers)
+    if export_format == 'jsonl':
+        return iter_jsonl(columns, rows)
+    return iter_csv(columns, rows)
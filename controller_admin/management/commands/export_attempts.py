@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+
+from controller_admin.attempt_filters import filter_attempts
+from controller_admin.db_router import reporting_reads
+from controller_admin.exports import FORMATS, iter_export
+
+
+class Command(BaseCommand):
+    help = 'Stream attempts, optionally with their answers, as CSV or JSONL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--answers', action='store_true', help='Write one row per answer instead of per attempt.')
+        parser.add_argument('--output', help='File to write to. Defaults to stdout.')
+        parser.add_argument('--exam', help='Only attempts of this exam id.')
+        parser.add_argument('--category', help='Only attempts of this category id.')
+        parser.add_argument('--user', help='Only attempts of this username.')
+        parser.add_argument('--date-from', help='Attempts started on or after this date (YYYY-MM-DD).')
+        parser.add_argument('--date-to', help='Attempts started on or before this date (YYYY-MM-DD).')
+        parser.add_argument('--status', choices=['passed', 'failed', 'ongoing'])
+
+    def handle(self, *args, **options):
+        params = QueryDict(mutable=True)
+        for name in ['exam', 'category', 'user', 'date_from', 'date_to', 'status']:
+            if options[name]:
+                params[name] = options[name]
+
+        with reporting_reads():
+            lines = iter_export(filter_attempts(params), options['format'], options['answers'])
+            if options['output']:
+                with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                    output.writelines(lines)
+            else:
+                for line in lines:
+                    self.stdout.write(line, ending='')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from controller_admin.question_import import QuestionImportError, import_questions
+from exam_user.models import Exam
+
+
+class Command(BaseCommand):
+    help = 'Import questions for an exam from a CSV or JSON file, with an optional zip of option images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('exam_id', type=int)
+        parser.add_argument('questions', help='Path to a .csv or .json question file.')
+        parser.add_argument('--images', help='Path to a zip file with the option images named in the question file.')
+
+    def handle(self, *args, **options):
+        try:
+            exam = Exam.objects.get(pk=options['exam_id'])
+        except Exam.DoesNotExist:
+            raise CommandError(f"Exam {options['exam_id']} does not exist.")
+
+        with open(options['questions'], 'rb') as questions_file:
+            data = questions_file.read()
+        images = open(options['images'], 'rb') if options['images'] else None
+        try:
+            count = import_questions(exam, data, options['questions'], images)
+        except QuestionImportError as error:
+            raise CommandError(f'Import failed:\n{error}')
+        finally:
+            if images:
+                images.close()
+        self.stdout.write(self.style.SUCCESS(f'Imported {count} questions into "{exam.name}".'))
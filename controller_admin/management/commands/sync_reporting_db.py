@@ -0,0 +1,45 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from controller_admin.db_router import REPORTING_ALIAS, sync_marker_path
+
+
+class Command(BaseCommand):
+    help = 'Copy the default SQLite database into the reporting database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep syncing until interrupted.')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between syncs with --loop.')
+
+    def handle(self, *args, **options):
+        if REPORTING_ALIAS not in settings.DATABASES:
+            raise CommandError('No "reporting" database is configured (set EXAM_REPORTING_DB).')
+        source, target = settings.DATABASES['default'], settings.DATABASES[REPORTING_ALIAS]
+        if not all(db['ENGINE'] == 'django.db.backends.sqlite3' for db in (source, target)):
+            raise CommandError('sync_reporting_db only copies SQLite databases; use native replication otherwise.')
+
+        while True:
+            started = time.monotonic()
+            self.sync(str(source['NAME']), str(target['NAME']))
+            self.stdout.write(f'Synced reporting database in {time.monotonic() - started:.2f}s.')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def sync(self, source_name, target_name):
+        # The backup API copies a consistent snapshot while writers keep going
+        source = sqlite3.connect(source_name)
+        target = sqlite3.connect(target_name)
+        try:
+            source.backup(target, pages=4096)
+        finally:
+            target.close()
+            source.close()
+        marker = sync_marker_path()
+        with open(marker, 'a'):
+            pass
+        os.utime(marker)
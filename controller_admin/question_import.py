@@ -0,0 +1,177 @@
+"""
+Bulk import of questions from a CSV or JSON file, with an optional zip of
+option images.
+
+Every row is validated before anything is written. Questions are then
+inserted with bulk_create in batches and each referenced image is stored
+once, however many rows point at it. Archive members that are not images
+fail the import, and so does an archive whose members would unpack to more
+than QUESTION_IMPORT_MAX_IMAGE_SIZE bytes each or
+QUESTION_IMPORT_MAX_ARCHIVE_SIZE bytes in total. The sizes are taken from
+the zip directory before anything is extracted.
+"""
+import csv
+import io
+import json
+import os
+import zipfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from exam_user.images import InvalidImage, store_option_image
+from exam_user.models import Question
+from exam_user.question_bank import invalidate_question_bank
+
+BATCH_SIZE = 500
+OPTIONS = ['a', 'b', 'c', 'd']
+TEXT_COLUMNS = [f'option_{option}' for option in OPTIONS]
+IMAGE_COLUMNS = [f'option_{option}_image' for option in OPTIONS]
+
+
+class QuestionImportError(Exception):
+    """Raised with the list of row errors when an import file is invalid."""
+
+    def __init__(self, errors):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+def read_rows(data, filename):
+    """Parse the uploaded bytes as JSON (a list of objects) or CSV with a header."""
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise QuestionImportError(['File must be UTF-8 encoded.'])
+    if filename.lower().endswith('.json'):
+        try:
+            rows = json.loads(text)
+        except ValueError as error:
+            raise QuestionImportError([f'Invalid JSON: {error}'])
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise QuestionImportError(['JSON file must contain a list of objects.'])
+        return rows
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def _clean(value):
+    return '' if value is None else str(value).strip()
+
+
+def build_questions(exam, rows, image_names=()):
+    """Validate rows and return unsaved Question objects plus the images they use."""
+    image_names = set(image_names)
+    correct_choices = {choice for choice, _ in Question._meta.get_field('correct_answer').choices}
+    max_text = Question._meta.get_field('option_a').max_length
+    questions, used_images, errors = [], set(), []
+
+    for number, row in enumerate(rows, start=1):
+        row = {key.strip(): _clean(value) for key, value in row.items() if key}
+        row_errors = []
+        option_type = row.get('option_type') or 'text'
+        correct_answer = row.get('correct_answer', '').upper()
+
+        if not row.get('question_text'):
+            row_errors.append('question_text is required')
+        if option_type not in ('text', 'image'):
+            row_errors.append(f'unknown option_type "{option_type}"')
+        if correct_answer not in correct_choices:
+            row_errors.append(f'correct_answer must be one of {", ".join(sorted(correct_choices))}')
+        try:
+            marks = float(row.get('marks') or 1.0)
+        except ValueError:
+            row_errors.append(f'marks "{row["marks"]}" is not a number')
+            marks = 0.0
+
+        question = Question(
+            exam=exam,
+            question_text=row.get('question_text', ''),
+            option_type=option_type,
+            correct_answer=correct_answer,
+            marks=marks,
+        )
+        if option_type == 'text':
+            for column in TEXT_COLUMNS:
+                if len(row.get(column, '')) > max_text:
+                    row_errors.append(f'{column} is longer than {max_text} characters')
+                setattr(question, column, row.get(column, ''))
+        else:
+            for column in IMAGE_COLUMNS:
+                name = row.get(column)
+                if not name:
+                    continue
+                if name not in image_names:
+                    row_errors.append(f'{column} "{name}" is not in the image archive')
+                used_images.add(name)
+                setattr(question, column, name)
+
+        if row_errors:
+            errors.append(f'Row {number}: ' + '; '.join(row_errors))
+        questions.append(question)
+
+    if not rows:
+        errors.append('The file contains no questions.')
+    if errors:
+        raise QuestionImportError(errors)
+    return questions, used_images
+
+
+def store_images(archive, names):
+    """Optimize and store the named archive members, return name -> stored path."""
+    stored, errors = {}, []
+    for name in sorted(names):
+        try:
+            data = archive.read(name)
+        except (zipfile.BadZipFile, NotImplementedError, RuntimeError):
+            # A CRC mismatch, also raised when a member unpacks to more than its declared size
+            errors.append(f'{name} in the image archive cannot be extracted.')
+            continue
+        try:
+            stored[name] = store_option_image(ContentFile(data, name=os.path.basename(name)))
+        except InvalidImage:
+            errors.append(f'{name} in the image archive is not a supported image file.')
+    if errors:
+        raise QuestionImportError(errors)
+    return stored
+
+
+def check_archive_sizes(members):
+    """Reject an archive whose members would unpack to too many bytes."""
+    max_image_size = getattr(settings, 'QUESTION_IMPORT_MAX_IMAGE_SIZE', 5 * 1024 * 1024)
+    max_archive_size = getattr(settings, 'QUESTION_IMPORT_MAX_ARCHIVE_SIZE', 100 * 1024 * 1024)
+    errors = [
+        f'{info.filename} in the image archive is larger than {max_image_size} bytes.'
+        for info in members if info.file_size > max_image_size
+    ]
+    if sum(info.file_size for info in members) > max_archive_size:
+        errors.append(f'The image archive unpacks to more than {max_archive_size} bytes.')
+    if errors:
+        raise QuestionImportError(errors)
+
+
+def import_questions(exam, data, filename, images=None):
+    """Import questions into exam from file bytes and an optional zip file object."""
+    rows = read_rows(data, filename)
+    archive = None
+    if images:
+        try:
+            archive = zipfile.ZipFile(images)
+        except zipfile.BadZipFile:
+            raise QuestionImportError(['The image archive is not a valid zip file.'])
+    members = [info for info in archive.infolist() if not info.is_dir()] if archive else []
+    check_archive_sizes(members)
+    image_names = [info.filename for info in members]
+
+    questions, used_images = build_questions(exam, rows, image_names)
+    stored = store_images(archive, used_images) if used_images else {}
+    for question in questions:
+        for column in IMAGE_COLUMNS:
+            name = getattr(question, column).name
+            if name:
+                setattr(question, column, stored[name])
+
+    with transaction.atomic():
+        Question.objects.bulk_create(questions, batch_size=BATCH_SIZE)
+    invalidate_question_bank(exam.id)
+    return len(questions)
@@ -1,3 +1,761 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from PIL import Image
+
+from exam_user import metrics
+from exam_user.archive import archive_exam
+from exam_user.models import Answer, ArchivedAttempt, Category, Exam, ExamAttempt, ExamStatistics, Question, User
+from exam_user.testing import PerformanceBudgetMixin, build_fixture
+
+from . import db_router
+from .attempt_filters import filter_attempts, keyset_page
+from .db_router import REPORTING_ALIAS, ReportingRouter, reporting_reads, reporting_view
+from .exports import export_columns
+from .question_import import QuestionImportError, import_questions
+
+# Maximum number of queries per view, session and user loading included.
+# Savepoints count, so a transaction costs two extra statements.
+QUERY_BUDGETS = {
+    'admin_login': 1,
+    'admin_logout': 4,
+    'dashboard': 6,
+    'category_list': 3,
+    'category_add': 2,
+    'category_detail': 4,
+    'category_edit': 3,
+    'category_delete': 3,
+    'exam_add': 3,
+    'exam_detail': 5,
+    'exam_regrade': 23,  # in one transaction
+    'exam_leaderboard': 5,
+    'exam_item_analysis': 5,
+    'exam_analyze_items': 17,  # one chunk of attempts
+    'exam_edit': 3,
+    'exam_delete': 4,
+    'question_add': 3,
+    'question_import': 3,
+    'question_edit': 3,
+    'question_delete': 4,
+    'attempt_list': 5,
+    'attempt_export': 3,
+    'metrics': 2,
+}
+
+# Budgets of the form posts that differ from the GET of the same view. The
+# import posts 1000 rows, which SQLite's variable limit splits into ~15 INSERTs.
+POST_QUERY_BUDGETS = {
+    'admin_login': 9,
+    'category_add': 4,
+    'category_edit': 5,
+    'exam_add': 5,
+    'exam_edit': 5,
+    'question_add': 5,
+    'question_import': 20,
+    'question_edit': 8,
+}
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ControllerAdminPerformanceTests(PerformanceBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixture = build_fixture()
+        cls.exam = cls.fixture['exams'][0]
+        cls.category = cls.exam.category
+        cls.question = cls.exam.questions.first()
+        cls.admin = User.objects.create(username='panel', password=make_password('panel-pass'), is_admin=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def exam_form(self, **overrides):
+        now = timezone.now()
+        return dict({
+            'name': 'Budget exam', 'description': '', 'duration_minutes': '30', 'number_of_questions': '10',
+            'start_date': (now - timedelta(days=1)).isoformat(), 'end_date': (now + timedelta(days=1)).isoformat(),
+            'pass_percentage': '40',
+        }, **overrides)
+
+    def question_form(self, **overrides):
+        return dict({
+            'question_text': 'Budget question', 'option_type': 'text', 'option_a': 'a', 'option_b': 'b',
+            'option_c': 'c', 'option_d': 'd', 'correct_answer': 'A', 'marks': '1',
+        }, **overrides)
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in get_resolver('controller_admin.urls').url_patterns}
+        self.assertEqual(names, set(QUERY_BUDGETS))
+
+    def test_admin_login(self):
+        self.client.logout()
+        url = reverse('controller_admin:admin_login')
+        self.assertWithinBudget(QUERY_BUDGETS['admin_login'], self.client.get, url)
+        response = self.assertWithinBudget(
+            POST_QUERY_BUDGETS['admin_login'], self.client.post, url, {'username': 'panel', 'password': 'panel-pass'}
+        )
+        self.assertRedirects(response, reverse('controller_admin:dashboard'))
+
+    def test_admin_logout(self):
+        self.assertWithinBudget(QUERY_BUDGETS['admin_logout'], self.client.get, reverse('controller_admin:admin_logout'))
+
+    def test_dashboard(self):
+        self.assertWithinBudget(QUERY_BUDGETS['dashboard'], self.client.get, reverse('controller_admin:dashboard'))
+
+    def test_category_list(self):
+        self.assertWithinBudget(QUERY_BUDGETS['category_list'], self.client.get, reverse('controller_admin:category_list'))
+
+    def test_category_add(self):
+        url = reverse('controller_admin:category_add')
+        self.assertWithinBudget(QUERY_BUDGETS['category_add'], self.client.get, url)
+        self.assertWithinBudget(POST_QUERY_BUDGETS['category_add'], self.client.post, url, {'name': 'New category'})
+
+    def test_category_detail(self):
+        self.assertWithinBudget(
+            QUERY_BUDGETS['category_detail'], self.client.get,
+            reverse('controller_admin:category_detail', args=[self.category.id]),
+        )
+
+    def test_category_edit(self):
+        url = reverse('controller_admin:category_edit', args=[self.category.id])
+        self.assertWithinBudget(QUERY_BUDGETS['category_edit'], self.client.get, url)
+        self.assertWithinBudget(POST_QUERY_BUDGETS['category_edit'], self.client.post, url, {'name': 'Renamed'})
+
+    def test_category_delete(self):
+        category = Category.objects.create(name='Disposable')
+        url = reverse('controller_admin:category_delete', args=[category.id])
+        self.assertWithinBudget(QUERY_BUDGETS['category_delete'], self.client.get, url)
+
+    def test_exam_add(self):
+        url = reverse('controller_admin:exam_add', args=[self.category.id])
+        self.assertWithinBudget(QUERY_BUDGETS['exam_add'], self.client.get, url)
+        self.assertWithinBudget(POST_QUERY_BUDGETS['exam_add'], self.client.post, url, self.exam_form())
+
+    def test_exam_detail(self):
+        self.assertWithinBudget(
+            QUERY_BUDGETS['exam_detail'], self.client.get, reverse('controller_admin:exam_detail', args=[self.exam.id])
+        )
+
+    def test_exam_regrade(self):
+        self.assertWithinBudget(
+            QUERY_BUDGETS['exam_regrade'], self.client.post, reverse('controller_admin:exam_regrade', args=[self.exam.id])
+        )
+
+    def test_exam_leaderboard(self):
+        response = self.assertWithinBudget(
+            QUERY_BUDGETS['exam_leaderboard'], self.client.get,
+            reverse('controller_admin:exam_leaderboard', args=[self.exam.id]), {'top': 10},
+        )
+        leaderboard = response.context['leaderboard']
+        self.assertEqual(len(leaderboard), 10)
+        scores = [attempt.score for _, attempt in leaderboard]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(leaderboard[0][0], 1)
+
+    def test_exam_item_analysis(self):
+        url = reverse('controller_admin:exam_item_analysis', args=[self.exam.id])
+        response = self.assertWithinBudget(QUERY_BUDGETS['exam_item_analysis'], self.client.get, url)
+        self.assertGreater(response.context['pending'], 0)
+        self.assertWithinBudget(
+            QUERY_BUDGETS['exam_analyze_items'], self.client.post,
+            reverse('controller_admin:exam_analyze_items', args=[self.exam.id]), {'full': '1'},
+        )
+        response = self.assertWithinBudget(QUERY_BUDGETS['exam_item_analysis'], self.client.get, url)
+        self.assertEqual(response.context['pending'], 0)
+        self.assertTrue(all(analysis for _, analysis, _ in response.context['items']))
+
+    def test_exam_edit(self):
+        url = reverse('controller_admin:exam_edit', args=[self.exam.id])
+        self.assertWithinBudget(QUERY_BUDGETS['exam_edit'], self.client.get, url)
+        self.assertWithinBudget(POST_QUERY_BUDGETS['exam_edit'], self.client.post, url, self.exam_form(name='Edited'))
+
+    def test_exam_edit_recounts_passes(self):
+        url = reverse('controller_admin:exam_edit', args=[self.exam.id])
+        self.client.post(url, self.exam_form(pass_percentage='0'))
+        statistics = ExamStatistics.objects.get(exam=self.exam)
+        self.assertEqual(statistics.pass_count, statistics.attempts_count)
+        self.client.post(url, self.exam_form(pass_percentage='100'))
+        self.assertEqual(ExamStatistics.objects.get(exam=self.exam).pass_count, 0)
+
+    def test_exam_delivery_settings_are_validated(self):
+        url = reverse('controller_admin:exam_edit', args=[self.exam.id])
+        self.client.post(url, self.exam_form(delivery_mode=Exam.DELIVERY_PAGED, questions_per_page='0'))
+        self.exam.refresh_from_db()
+        self.assertEqual((self.exam.delivery_mode, self.exam.questions_per_page), (Exam.DELIVERY_PAGED, 1))
+        self.client.post(url, self.exam_form(delivery_mode='scroll', questions_per_page='many'))
+        self.exam.refresh_from_db()
+        self.assertEqual((self.exam.delivery_mode, self.exam.questions_per_page), (Exam.DELIVERY_PAGED, 1))
+
+        self.client.post(
+            reverse('controller_admin:exam_add', args=[self.category.id]),
+            self.exam_form(name='Added', delivery_mode='scroll', questions_per_page='1000'),
+        )
+        added = Exam.objects.get(name='Added')
+        self.assertEqual((added.delivery_mode, added.questions_per_page), (Exam.DELIVERY_SINGLE_PAGE, 100))
+
+    def test_exam_delete(self):
+        self.assertWithinBudget(
+            QUERY_BUDGETS['exam_delete'], self.client.get, reverse('controller_admin:exam_delete', args=[self.exam.id])
+        )
+
+    def test_question_add(self):
+        url = reverse('controller_admin:question_add', args=[self.exam.id])
+        self.assertWithinBudget(QUERY_BUDGETS['question_add'], self.client.get, url)
+        self.assertWithinBudget(POST_QUERY_BUDGETS['question_add'], self.client.post, url, self.question_form())
+
+    def test_question_import(self):
+        url = reverse('controller_admin:question_import', args=[self.exam.id])
+        self.assertWithinBudget(QUERY_BUDGETS['question_import'], self.client.get, url)
+        rows = 'question_text,option_a,option_b,option_c,option_d,correct_answer,marks\n'
+        rows += ''.join(f'Imported {i},a,b,c,d,B,1\n' for i in range(1000))
+        upload = SimpleUploadedFile('questions.csv', rows.encode())
+        self.assertWithinBudget(POST_QUERY_BUDGETS['question_import'], self.client.post, url, {'questions_file': upload})
+        self.assertEqual(Question.objects.filter(question_text__startswith='Imported').count(), 1000)
+
+    def test_question_edit(self):
+        url = reverse('controller_admin:question_edit', args=[self.question.id])
+        self.assertWithinBudget(QUERY_BUDGETS['question_edit'], self.client.get, url)
+        self.assertWithinBudget(
+            POST_QUERY_BUDGETS['question_edit'], self.client.post, url, self.question_form(question_text='Edited')
+        )
+
+    def test_question_delete(self):
+        self.assertWithinBudget(
+            QUERY_BUDGETS['question_delete'], self.client.get,
+            reverse('controller_admin:question_delete', args=[self.question.id]),
+        )
+
+    def test_attempt_list(self):
+        url = reverse('controller_admin:attempt_list')
+        response = self.assertWithinBudget(QUERY_BUDGETS['attempt_list'], self.client.get, url)
+        cursor = response.context['next_cursor']
+        self.assertIsNotNone(cursor)
+        self.assertWithinBudget(QUERY_BUDGETS['attempt_list'], self.client.get, url, {
+            'cursor': cursor, 'category': self.category.id, 'status': 'passed',
+        })
+
+    def test_attempt_export(self):
+        url = reverse('controller_admin:attempt_export')
+        self.assertWithinBudget(QUERY_BUDGETS['attempt_export'], self.client.get, url)
+        # 20000 answer rows
+        self.assertWithinBudget(
+            QUERY_BUDGETS['attempt_export'], self.client.get, url, {'answers': '1', 'format': 'jsonl'},
+            latency_budget_ms=3000,
+        )
+
+    def test_attempt_export_requires_admin(self):
+        url = reverse('controller_admin:attempt_export')
+        self.client.logout()
+        self.assertRedirects(self.client.get(url), f"{reverse('controller_admin:admin_login')}?next={url}")
+        self.client.force_login(User.objects.create(username='not-admin'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_metrics(self):
+        self.assertWithinBudget(QUERY_BUDGETS['metrics'], self.client.get, reverse('controller_admin:metrics'))
+
+
+class AttemptListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.now = now.replace(microsecond=0)
+        cls.exams = [
+            Exam.objects.create(
+                category=Category.objects.create(name=f'List {i}'), name=f'List {i}', duration_minutes=30,
+                number_of_questions=1, start_date=now, end_date=now + timedelta(hours=1), pass_percentage=50.0,
+            )
+            for i in range(2)
+        ]
+        cls.users = [User.objects.create(username=f'lister{i}') for i in range(3)]
+        attempts = []
+        for i, user in enumerate(cls.users):
+            for exam in cls.exams:
+                attempts.append(ExamAttempt.objects.create(
+                    user=user, exam=exam, is_completed=True, end_time=now, percentage=30.0 * i, total_marks=1.0,
+                ))
+        attempts.append(ExamAttempt.objects.create(user=cls.users[0], exam=cls.exams[0]))
+        root = User.objects.create(username='root', is_superuser=True)
+        ExamAttempt.objects.create(user=root, exam=cls.exams[0], is_completed=True, end_time=now)
+        # Many attempts share a start time, as when a whole class starts together
+        ExamAttempt.objects.update(start_time=cls.now)
+        ExamAttempt.objects.filter(pk__in=[a.pk for a in attempts[::3]]).update(start_time=cls.now - timedelta(days=2))
+        cls.attempts = list(ExamAttempt.objects.filter(pk__in=[a.pk for a in attempts]))
+
+    def expected(self, keep=lambda attempt: True):
+        rows = [attempt for attempt in self.attempts if keep(attempt)]
+        return sorted(rows, key=lambda attempt: (attempt.start_time, attempt.id), reverse=True)
+
+    def test_pages_neither_repeat_nor_skip_attempts(self):
+        for page_size in (1, 2, 3, 4, 7, 8):
+            with self.subTest(page_size=page_size):
+                seen = []
+                cursor = None
+                while True:
+                    rows, cursor = keyset_page(filter_attempts({}), cursor, page_size)
+                    self.assertLessEqual(len(rows), page_size)
+                    seen += rows
+                    if cursor is None:
+                        break
+                self.assertEqual(seen, self.expected())
+
+    def test_invalid_cursor_starts_at_the_first_page(self):
+        for cursor in ('', 'garbage', 'not-a-date_12', '2024-01-01T00:00:00_x'):
+            rows, _ = keyset_page(filter_attempts({}), cursor, 3)
+            self.assertEqual(rows, self.expected()[:3])
+
+    def test_filters(self):
+        exam, user = self.exams[1], self.users[2]
+        today = self.now.date()
+        cases = [
+            ({'exam': str(exam.id)}, lambda a: a.exam_id == exam.id),
+            ({'exam': 'x'}, lambda a: True),
+            ({'category': str(exam.category_id)}, lambda a: a.exam_id == exam.id),
+            ({'user': user.username}, lambda a: a.user_id == user.id),
+            ({'user': 'nobody'}, lambda a: False),
+            ({'status': 'passed'}, lambda a: a.is_completed and a.percentage >= 50.0),
+            ({'status': 'failed'}, lambda a: a.is_completed and a.percentage < 50.0),
+            ({'status': 'ongoing'}, lambda a: not a.is_completed),
+            ({'date_from': today.isoformat()}, lambda a: a.start_time == self.now),
+            ({'date_to': (today - timedelta(days=1)).isoformat()}, lambda a: a.start_time < self.now),
+            (
+                {'exam': str(exam.id), 'status': 'failed', 'date_from': today.isoformat()},
+                lambda a: a.exam_id == exam.id and a.is_completed and a.percentage < 50.0 and a.start_time == self.now,
+            ),
+        ]
+        for params, keep in cases:
+            with self.subTest(params=params):
+                self.assertEqual(list(filter_attempts(params)), self.expected(keep))
+
+    def test_view_pages_through_filtered_attempts(self):
+        self.client.force_login(User.objects.create(username='list-admin', is_admin=True))
+        url = reverse('controller_admin:attempt_list')
+        params = {'status': 'failed'}
+        seen = []
+        with mock.patch('controller_admin.views.keyset_page', lambda rows, cursor: keyset_page(rows, cursor, 2)):
+            while True:
+                response = self.client.get(url, params)
+                seen += response.context['attempts']
+                self.assertEqual(response.context['filter_query'], 'status=failed')
+                if response.context['next_cursor'] is None:
+                    break
+                params['cursor'] = response.context['next_cursor']
+        self.assertEqual(seen, self.expected(lambda a: a.is_completed and a.percentage < 50.0))
+
+
+class AttemptExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        category = Category.objects.create(name='Export')
+        cls.exam, closed = [
+            Exam.objects.create(
+                category=category, name=name, duration_minutes=30, number_of_questions=2,
+                start_date=now - timedelta(days=1), end_date=now + timedelta(days=1), pass_percentage=50.0,
+            )
+            for name in ('Export', 'Closed')
+        ]
+        questions = [
+            Question.objects.create(exam=cls.exam, question_text=f'Q{i}', correct_answer='A', marks=1.0)
+            for i in range(2)
+        ]
+        cls.attempts = []
+        for i, selections in enumerate([['A', 'A'], ['A', 'B'], ['C']]):
+            attempt = ExamAttempt.objects.create(
+                user=User.objects.create(username=f'exporter{i}'), exam=cls.exam, is_completed=True, end_time=now,
+                questions_data=[q.id for q in questions], total_marks=2.0,
+            )
+            Answer.bulk_upsert(attempt, questions, dict(zip([q.id for q in questions], selections)))
+            attempt.score = sum(answer.marks_obtained for answer in attempt.answers.all())
+            attempt.percentage = attempt.score * 50.0
+            attempt.save()
+            cls.attempts.append(attempt)
+        ExamAttempt.objects.create(
+            user=User.objects.create(username='root', is_superuser=True), exam=cls.exam, is_completed=True,
+        )
+        ExamAttempt.objects.create(user=cls.attempts[0].user, exam=closed, is_completed=True, end_time=now)
+        archive_exam(closed)
+        # JSON keeps milliseconds only
+        ExamAttempt.objects.update(start_time=now.replace(microsecond=0), end_time=now.replace(microsecond=0))
+        for attempt in cls.attempts:
+            attempt.refresh_from_db()
+
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='export-admin', is_admin=True))
+
+    def export(self, **params):
+        response = self.client.get(reverse('controller_admin:attempt_export'), params)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        return b''.join(response.streaming_content).decode()
+
+    def assertAttemptFields(self, row, attempt):
+        self.assertEqual(row['attempt_id'], attempt.attempt_id)
+        self.assertEqual(row['username'], attempt.user.username)
+        self.assertEqual((row['exam'], row['category']), ('Export', 'Export'))
+        self.assertEqual(parse_datetime(str(row['start_time'])), attempt.start_time)
+        self.assertEqual(parse_datetime(str(row['end_time'])), attempt.end_time)
+        self.assertEqual(
+            [float(row[name]) for name in ('score', 'total_marks', 'percentage', 'pass_percentage')],
+            [attempt.score, 2.0, attempt.percentage, 50.0],
+        )
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export(format='csv'))))
+        self.assertEqual(rows[0], export_columns())
+        # Superusers and archived attempts are left out
+        self.assertEqual(len(rows), 1 + len(self.attempts))
+        exported = {row[0]: dict(zip(rows[0], row)) for row in rows[1:]}
+        for attempt in self.attempts:
+            self.assertAttemptFields(exported[attempt.attempt_id], attempt)
+            self.assertEqual(exported[attempt.attempt_id]['is_completed'], 'True')
+        self.assertNotIn(ArchivedAttempt.objects.get().attempt_id, exported)
+
+    def test_jsonl(self):
+        lines = self.export(format='jsonl').splitlines()
+        self.assertEqual(len(lines), len(self.attempts))
+        exported = {}
+        for line in lines:
+            row = json.loads(line)
+            self.assertEqual(list(row), export_columns())
+            exported[row['attempt_id']] = row
+        for attempt in self.attempts:
+            self.assertAttemptFields(exported[attempt.attempt_id], attempt)
+            self.assertIs(exported[attempt.attempt_id]['is_completed'], True)
+
+    def test_answers(self):
+        for export_format in ('csv', 'jsonl'):
+            with self.subTest(format=export_format):
+                body = self.export(format=export_format, answers='1')
+                if export_format == 'csv':
+                    header, *rows = csv.reader(io.StringIO(body))
+                    self.assertEqual(header, export_columns(include_answers=True))
+                    rows = [dict(zip(header, row)) for row in rows]
+                else:
+                    rows = [json.loads(line) for line in body.splitlines()]
+                    self.assertEqual(list(rows[0]), export_columns(include_answers=True))
+                expected = Answer.objects.filter(attempt__in=self.attempts).order_by('attempt_id', 'question_id')
+                self.assertEqual(len(rows), 5)
+                for row, answer in zip(rows, expected):
+                    self.assertAttemptFields(row, answer.attempt)
+                    self.assertEqual(
+                        (int(row['question_id']), row['selected_answer'], str(row['is_correct'])),
+                        (answer.question_id, answer.selected_answer, str(answer.is_correct)),
+                    )
+                    self.assertEqual(float(row['marks_obtained']), answer.marks_obtained)
+
+    def test_filters_apply_to_the_export(self):
+        user = self.attempts[1].user
+        rows = list(csv.reader(io.StringIO(self.export(format='csv', user=user.username))))
+        self.assertEqual([row[0] for row in rows[1:]], [self.attempts[1].attempt_id])
+        # An unknown format falls back to CSV
+        self.assertEqual(next(csv.reader(io.StringIO(self.export(format='xml')))), export_columns())
+
+
+class QuestionImportTests(TestCase):
+    HEADER = 'question_text,option_type,option_a,option_b,option_c,option_d,correct_answer,marks\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.exam = Exam.objects.create(
+            category=Category.objects.create(name='Import'), name='Import', duration_minutes=30,
+            number_of_questions=2, start_date=now, end_date=now + timedelta(hours=1),
+        )
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+    def images_zip(self, **members):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for name, data in members.items():
+                zip_file.writestr(name, data)
+        archive.seek(0)
+        return archive
+
+    def png(self, color):
+        output = io.BytesIO()
+        Image.new('RGB', (40, 30), color).save(output, 'PNG')
+        return output.getvalue()
+
+    def assertImportErrors(self, errors, data, filename='questions.csv', images=None):
+        with self.assertRaises(QuestionImportError) as raised:
+            import_questions(self.exam, data, filename, images)
+        self.assertEqual(raised.exception.errors, errors)
+        self.assertFalse(Question.objects.filter(exam=self.exam).exists())
+
+    def test_invalid_rows(self):
+        rows = self.HEADER + ',text,a,b,c,d,A,1\nSecond,video,a,b,c,d,E,many\nThird,text,a,b,c,d,b,2\n'
+        self.assertImportErrors([
+            'Row 1: question_text is required',
+            'Row 2: unknown option_type "video"; correct_answer must be one of A, B, C, D; marks "many" is not a number',
+        ], rows.encode())
+        self.assertImportErrors(['The file contains no questions.'], self.HEADER.encode())
+        self.assertImportErrors(['JSON file must contain a list of objects.'], b'{}', 'questions.json')
+
+    def test_file_must_be_utf8(self):
+        rows = self.HEADER + 'Qu\u00e9stion,text,a,b,c,d,A,1\n'
+        self.assertImportErrors(['File must be UTF-8 encoded.'], rows.encode('latin-1'))
+
+    def test_missing_zip_member(self):
+        rows = self.HEADER.replace('option_a,', 'option_a_image,') + 'Pictures,image,a.png,b,c,d,A,1\n'
+        self.assertImportErrors(
+            ['Row 1: option_a_image "a.png" is not in the image archive'],
+            rows.encode(), images=self.images_zip(**{'b.png': self.png('blue')}),
+        )
+
+    def test_zip_member_must_be_an_image(self):
+        rows = self.HEADER.replace('option_a,', 'option_a_image,') + 'Pictures,image,a.png,b,c,d,A,1\n'
+        self.assertImportErrors(
+            ['a.png in the image archive is not a supported image file.'],
+            rows.encode(), images=self.images_zip(**{'a.png': b'#!/bin/sh\n'}),
+        )
+
+    @override_settings(QUESTION_IMPORT_MAX_IMAGE_SIZE=1000, QUESTION_IMPORT_MAX_ARCHIVE_SIZE=1500)
+    def test_zip_member_sizes_are_limited(self):
+        rows = self.HEADER.replace('option_a,', 'option_a_image,') + 'Pictures,image,a.png,b,c,d,A,1\n'
+        with mock.patch('zipfile.ZipFile.read') as read:
+            # Zeros compress to a few bytes, only the unpacked size counts
+            self.assertImportErrors(
+                ['bomb.png in the image archive is larger than 1000 bytes.'],
+                rows.encode(), images=self.images_zip(**{'a.png': b'\0' * 10, 'bomb.png': b'\0' * 1001}),
+            )
+            self.assertImportErrors(
+                ['The image archive unpacks to more than 1500 bytes.'],
+                rows.encode(), images=self.images_zip(**{'a.png': b'\0' * 800, 'b.png': b'\0' * 800}),
+            )
+            read.assert_not_called()
+
+        self.client.force_login(User.objects.create(username='importer', is_admin=True))
+        response = self.client.post(reverse('controller_admin:question_import', args=[self.exam.id]), {
+            'questions_file': SimpleUploadedFile('questions.csv', rows.encode()),
+            'images_zip': SimpleUploadedFile('images.zip', self.images_zip(**{'a.png': b'\0' * 2000}).read()),
+        })
+        self.assertContains(response, 'a.png in the image archive is larger than 1000 bytes.')
+        self.assertFalse(Question.objects.filter(exam=self.exam).exists())
+
+    def test_zip_member_larger_than_declared(self):
+        rows = self.HEADER.replace('option_a,', 'option_a_image,') + 'Pictures,image,a.png,b,c,d,A,1\n'
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr('a.png', self.png('red') + b'\0' * 100000)
+        # Understate the unpacked size in the central directory
+        data = bytearray(archive.getvalue())
+        header = data.index(b'PK\x01\x02')
+        data[header + 24:header + 28] = (100).to_bytes(4, 'little')
+        self.assertImportErrors(
+            ['a.png in the image archive cannot be extracted.'], rows.encode(), images=io.BytesIO(bytes(data)),
+        )
+
+    def test_question_add_rejects_non_images(self):
+        self.client.force_login(User.objects.create(username='importer', is_admin=True))
+        response = self.client.post(reverse('controller_admin:question_add', args=[self.exam.id]), {
+            'question_text': 'Pictures', 'option_type': 'image', 'correct_answer': 'A', 'marks': '1',
+            'option_a_image': SimpleUploadedFile('a.png', b'<html></html>'),
+        })
+        self.assertContains(response, 'is not a supported image file.')
+        self.assertFalse(Question.objects.filter(exam=self.exam).exists())
+
+    def test_import(self):
+        rows = (
+            'question_text,option_type,option_a_image,option_b_image,option_c,option_d,correct_answer,marks\n'
+            'Pictures,image,red.png,blue.png,,,b,2\n'
+            'Same picture,image,red.png,,,,A,\n'
+        )
+        images = self.images_zip(**{'red.png': self.png('red'), 'blue.png': self.png('blue')})
+        self.assertEqual(import_questions(self.exam, rows.encode(), 'questions.csv', images), 2)
+        first, second = Question.objects.filter(exam=self.exam).order_by('id')
+        self.assertEqual((first.correct_answer, first.marks, second.marks), ('B', 2.0, 1.0))
+        self.assertEqual(first.option_a_image.name, second.option_a_image.name)
+        self.assertNotEqual(first.option_a_image.name, first.option_b_image.name)
+        self.assertTrue(first.option_a_image.storage.exists(first.option_a_image.name))
+
+        rows = '[{"question_text": "From JSON", "option_a": "x", "option_b": "y", "correct_answer": "a"}]'
+        self.assertEqual(import_questions(self.exam, rows.encode(), 'questions.json'), 1)
+        self.assertEqual(Question.objects.get(question_text='From JSON').option_b, 'y')
+
+
+@override_settings(METRICS_TOKEN='scrape-token', METRICS_DIR=None)
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='panel', is_admin=True)
+        cls.candidate = User.objects.create(username='candidate')
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_requires_admin_or_token(self):
+        url = reverse('controller_admin:metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.candidate)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 200)
+
+    def test_records_requests_by_url_name(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('controller_admin:category_list'))
+        self.client.get(reverse('controller_admin:category_list'))
+        body = self.client.get(reverse('controller_admin:metrics')).content.decode()
+        self.assertIn(
+            'exam_http_requests_total{method="GET",status="200",view="controller_admin:category_list"} 2', body
+        )
+        self.assertIn('exam_http_request_duration_seconds_count{view="controller_admin:category_list"} 2', body)
+        self.assertIn('exam_db_queries_total{view="controller_admin:category_list"}', body)
+        self.assertIn('exam_attempts_started_total 0', body)
+
+    def test_exited_processes_are_folded_into_one_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        histogram = [0] * (len(metrics.QUERY_BUCKETS) + 1)
+        histogram[0] = 1
+        for filename, value in (('metrics-1-1.json', 2), ('metrics-2-1.json', 3), ('metrics-retired.json', 4)):
+            with open(os.path.join(directory.name, filename), 'w') as snapshot_file:
+                json.dump({
+                    'counters': [['exam_autosaves_total', [], value]],
+                    'histograms': [['exam_db_queries_per_request', [['view', 'v']], histogram, 1.0]],
+                }, snapshot_file)
+        metrics.increment('exam_autosaves_total')
+        expected = {('exam_autosaves_total', ()): 10}
+
+        with override_settings(METRICS_DIR=directory.name), \
+                mock.patch('exam_user.metrics._is_running', lambda pid: pid in (2, os.getpid())):
+            counters, histograms = metrics.collect()
+            self.assertEqual(counters, expected)
+            self.assertEqual(histograms[('exam_db_queries_per_request', (('view', 'v'),))][1], 3.0)
+            snapshots = sorted(name for name in os.listdir(directory.name) if name.endswith('.json'))
+            self.assertEqual(
+                snapshots,
+                sorted(['metrics-2-1.json', f'metrics-{metrics._PROCESS_KEY}.json', 'metrics-retired.json']),
+            )
+            self.assertEqual(metrics.collect()[0], expected)
+
+
+def sqlite_database(name):
+    return {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+
+
+@override_settings(DATABASE_ROUTERS=['controller_admin.db_router.ReportingRouter'], REPORTING_MAX_STALENESS=60)
+class ReportingRouterTests(SimpleTestCase):
+    """Reads through a second SQLite alias, "reporting", set up for this class only.
+
+    The alias is added after the test case's database checks ran and removed
+    before they are undone, so the test runner never has to create it.
+    """
+    databases = {'default'}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        cls.replica = os.path.join(directory.name, 'reporting.sqlite3')
+        cls.marker = f'{cls.replica}.synced'
+        databases = {**settings.DATABASES, REPORTING_ALIAS: sqlite_database(cls.replica)}
+        cls.enterClassContext(mock.patch.dict(settings.DATABASES, {REPORTING_ALIAS: databases[REPORTING_ALIAS]}))
+        connections.settings[REPORTING_ALIAS] = connections.configure_settings(databases)[REPORTING_ALIAS]
+        cls.databases = {'default', REPORTING_ALIAS}
+        with connections[REPORTING_ALIAS].schema_editor() as editor:
+            editor.create_model(Category)
+        # Only in the replica: bulk_create sends no counter signals to default
+        Category.objects.using(REPORTING_ALIAS).bulk_create([Category(name='Replicated')])
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[REPORTING_ALIAS].close()
+        del connections[REPORTING_ALIAS]
+        del connections.settings[REPORTING_ALIAS]
+        cls.databases = {'default'}
+        super().tearDownClass()
+
+    def setUp(self):
+        db_router._last_check[:] = [0.0, False]
+        self.sync(age=0)
+
+    def sync(self, age):
+        with open(self.marker, 'a'):
+            pass
+        os.utime(self.marker, (time.time() - age, time.time() - age))
+        db_router._last_check[:] = [0.0, False]
+
+    def replicated(self):
+        return Category.objects.filter(name='Replicated').exists()
+
+    def test_reads_go_to_the_replica_only_inside_reporting_reads(self):
+        self.assertFalse(self.replicated())
+        with reporting_reads():
+            self.assertTrue(self.replicated())
+        self.assertEqual(ReportingRouter().db_for_write(Category), 'default')
+
+    def test_stale_or_missing_replica_falls_back_to_default(self):
+        self.sync(age=120)
+        with reporting_reads():
+            self.assertFalse(self.replicated())
+        os.remove(self.marker)
+        db_router._last_check[:] = [0.0, False]
+        with reporting_reads():
+            self.assertFalse(self.replicated())
+        with override_settings(REPORTING_MAX_STALENESS=None), reporting_reads():
+            self.assertTrue(self.replicated())
+
+    def test_streamed_bodies_keep_reading_from_the_replica(self):
+        view = reporting_view(lambda request: StreamingHttpResponse(str(self.replicated()) for _ in range(1)))
+        response = view(None)
+        self.assertFalse(self.replicated())
+        self.assertEqual(b''.join(response.streaming_content), b'True')
+
+
+class SyncReportingDbTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.source = os.path.join(directory.name, 'default.sqlite3')
+        self.target = os.path.join(directory.name, 'reporting.sqlite3')
+        with sqlite3.connect(self.source) as source:
+            source.execute('CREATE TABLE exams (name TEXT)')
+            source.executemany('INSERT INTO exams VALUES (?)', [('First',), ('Second',)])
+        source.close()
+
+    def databases_setting(self, **overrides):
+        databases = {'default': sqlite_database(self.source), REPORTING_ALIAS: sqlite_database(self.target)}
+        databases.update(overrides)
+        return mock.patch.dict(settings.DATABASES, databases)
+
+    def test_copies_the_database_and_touches_the_marker(self):
+        with self.databases_setting(), override_settings(REPORTING_SYNC_MARKER=None):
+            call_command('sync_reporting_db', stdout=io.StringIO())
+        target = sqlite3.connect(self.target)
+        self.addCleanup(target.close)
+        self.assertEqual(target.execute('SELECT name FROM exams ORDER BY name').fetchall(), [('First',), ('Second',)])
+        self.assertLess(time.time() - os.path.getmtime(f'{self.target}.synced'), 60)
+
+    def test_requires_sqlite_reporting_database(self):
+        with mock.patch.dict(settings.DATABASES), self.assertRaisesMessage(CommandError, 'No "reporting" database'):
+            settings.DATABASES.pop(REPORTING_ALIAS, None)
+            call_command('sync_reporting_db')
+        other = {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'reporting'}
+        with self.databases_setting(**{REPORTING_ALIAS: other}), self.assertRaisesMessage(CommandError, 'SQLite'):
+            call_command('sync_reporting_db')
@@ -15,9 +15,16 @@ urlpatterns = [
     path('exam/add/<int:category_id>/', views.exam_add, name='exam_add'),
     path('exam/<int:pk>/', views.exam_detail, name='exam_detail'),
     path('exam/<int:pk>/edit/', views.exam_edit, name='exam_edit'),
+    path('exam/<int:pk>/regrade/', views.exam_regrade, name='exam_regrade'),
+    path('exam/<int:pk>/leaderboard/', views.exam_leaderboard, name='exam_leaderboard'),
+    path('exam/<int:pk>/items/', views.exam_item_analysis, name='exam_item_analysis'),
+    path('exam/<int:pk>/items/analyze/', views.exam_analyze_items, name='exam_analyze_items'),
     path('exam/<int:pk>/delete/', views.exam_delete, name='exam_delete'),
     path('question/add/<int:exam_id>/', views.question_add, name='question_add'),
+    path('question/import/<int:exam_id>/', views.question_import, name='question_import'),
     path('question/<int:pk>/edit/', views.question_edit, name='question_edit'),
     path('question/<int:pk>/delete/', views.question_delete, name='question_delete'),
     path('attempts/', views.attempt_list, name='attempt_list'),
+    path('attempts/export/', views.attempt_export, name='attempt_export'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
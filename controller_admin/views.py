@@ -1,7 +1,24 @@
+from django.db.models import Count
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.utils import timezone
-from exam_user.models import Category, Exam, Question, ExamAttempt
+from exam_user.models import AttemptActivity, Category, Exam, Question, ExamAttempt, ExamStatistics
+from exam_user.counters import activity_series, get_counts
+from exam_user.exam_catalog import invalidate_catalog
+from exam_user.leaderboard import top_attempts
+from exam_user.item_analysis import analyze_exam
+from exam_user.grading import regrade_exam, regrade_question
+from exam_user.statistics import rebuild_exam_statistics
+from exam_user.images import InvalidImage, store_option_image
+from exam_user import metrics as exam_metrics
+from exam_user.question_fragments import invalidate_question_fragments
+from .attempt_filters import filter_attempts, keyset_page
+from .db_router import reporting_reads, reporting_view
+from .exports import FORMATS, iter_export
+from .question_import import QuestionImportError, import_questions
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib import messages
@@ -31,21 +48,35 @@ def admin_required(user):
     return user.is_authenticated and user.is_admin
 
 
+def activity_chart(series):
+    """Add bar heights (percent of the busiest bucket) to an activity series, for templates."""
+    peak = max((max(started, submitted) for _, started, submitted in series), default=0) or 1
+    return [
+        (bucket, started, submitted, started * 100 // peak, submitted * 100 // peak)
+        for bucket, started, submitted in series
+    ]
+
+
+@reporting_view
 def dashboard(request):
-    categories_count = Category.objects.count()
-    exams_count = Exam.objects.count()
-    attempts_count = ExamAttempt.objects.count()
+    counts = get_counts()
+    exam_statistics = ExamStatistics.objects.select_related('exam').order_by('-updated_at')[:10]
 
     context = {
-        'categories_count': categories_count,
-        'exams_count': exams_count,
-        'attempts_count': attempts_count,
+        'categories_count': counts['categories'],
+        'exams_count': counts['exams'],
+        'attempts_count': counts['attempts'],
+        'exam_statistics': exam_statistics,
+        'activity_charts': [
+            ('Last Hour', activity_chart(activity_series(AttemptActivity.RESOLUTION_MINUTE, 60)), 'H:i'),
+            ('Last 24 Hours', activity_chart(activity_series(AttemptActivity.RESOLUTION_HOUR, 24)), 'M j, H:i'),
+        ],
     }
     return render(request, 'controller_admin/dashboard.html', context)
 
 
 def category_list(request):
-    categories = Category.objects.all()
+    categories = Category.objects.annotate(exam_count=Count('exams'))
     return render(request, 'controller_admin/category_list.html', {'categories': categories})
 
 
@@ -55,6 +86,7 @@ def category_add(request):
             name=request.POST['name'],
             description=request.POST.get('description', '')
         )
+        invalidate_catalog()
         return redirect('controller_admin:category_list')
     return render(request, 'controller_admin/category_add.html')
 
@@ -70,6 +102,7 @@ def category_edit(request, pk):
         category.name = request.POST['name']
         category.description = request.POST.get('description', '')
         category.save()
+        invalidate_catalog(category.id)
         messages.success(request, f'Category "{category.name}" updated successfully!')
         return redirect('controller_admin:category_detail', pk=category.id)
     return render(request, 'controller_admin/category_edit.html', {'category': category})
@@ -80,6 +113,7 @@ def category_delete(request, pk):
     if request.method == 'POST':
         category_name = category.name
         category.delete()
+        invalidate_catalog(pk)
         messages.success(request, f'Category "{category_name}" deleted successfully!')
         return redirect('controller_admin:category_list')
     return render(request, 'controller_admin/category_delete.html', {'category': category})
@@ -88,9 +122,25 @@ def category_delete(request, pk):
 
 
 
+def _delivery_settings(request, delivery_mode, questions_per_page):
+    """The posted delivery mode and page size, falling back to the given ones when invalid.
+
+    The page size is clamped to the 1-100 the form allows; 0 would break pagination.
+    """
+    posted_mode = request.POST.get('delivery_mode')
+    if posted_mode in dict(Exam.DELIVERY_MODE_CHOICES):
+        delivery_mode = posted_mode
+    try:
+        questions_per_page = min(max(int(request.POST.get('questions_per_page') or questions_per_page), 1), 100)
+    except ValueError:
+        pass
+    return delivery_mode, questions_per_page
+
+
 def exam_add(request, category_id):
     category = get_object_or_404(Category, id=category_id)
     if request.method == 'POST':
+        delivery_mode, questions_per_page = _delivery_settings(request, Exam.DELIVERY_SINGLE_PAGE, 10)
         Exam.objects.create(
             category=category,
             name=request.POST['name'],
@@ -99,16 +149,65 @@ def exam_add(request, category_id):
             number_of_questions=request.POST['number_of_questions'],
             start_date=request.POST['start_date'],
             end_date=request.POST['end_date'],
-            pass_percentage=request.POST.get('pass_percentage', 40.0)
+            pass_percentage=request.POST.get('pass_percentage', 40.0),
+            delivery_mode=delivery_mode,
+            questions_per_page=questions_per_page,
         )
+        invalidate_catalog(category_id)
         return redirect('controller_admin:category_detail', pk=category_id)
-    return render(request, 'controller_admin/exam_add.html', {'category': category})
+    return render(request, 'controller_admin/exam_add.html', {
+        'category': category,
+        'delivery_modes': Exam.DELIVERY_MODE_CHOICES,
+    })
 
 
 def exam_detail(request, pk):
     exam = get_object_or_404(Exam, pk=pk)
     questions = exam.questions.all()
-    return render(request, 'controller_admin/exam_detail.html', {'exam': exam, 'questions': questions})
+    with reporting_reads():
+        statistics = ExamStatistics.objects.filter(exam=exam).first()
+    return render(request, 'controller_admin/exam_detail.html', {
+        'exam': exam,
+        'questions': questions,
+        'statistics': statistics,
+    })
+
+
+@reporting_view
+def exam_leaderboard(request, pk):
+    exam = get_object_or_404(Exam, pk=pk)
+    try:
+        limit = min(max(int(request.GET.get('top', 50)), 1), 500)
+    except ValueError:
+        limit = 50
+    return render(request, 'controller_admin/exam_leaderboard.html', {
+        'exam': exam,
+        'leaderboard': top_attempts(exam, limit),
+        'statistics': ExamStatistics.objects.filter(exam=exam).first(),
+        'limit': limit,
+    })
+
+
+@reporting_view
+def exam_item_analysis(request, pk):
+    exam = get_object_or_404(Exam, pk=pk)
+    items = []
+    for question in exam.questions.select_related('analysis'):
+        analysis = getattr(question, 'analysis', None)
+        items.append((question, analysis, analysis.option_rows(question.correct_answer) if analysis else []))
+    return render(request, 'controller_admin/exam_item_analysis.html', {
+        'exam': exam,
+        'items': items,
+        'pending': ExamAttempt.objects.filter(exam=exam, is_completed=True, item_analyzed=False).count(),
+    })
+
+
+def exam_analyze_items(request, pk):
+    exam = get_object_or_404(Exam, pk=pk)
+    if request.method == 'POST':
+        added = analyze_exam(exam, full='full' in request.POST)
+        messages.success(request, f'Added {added} completed attempts to the item analysis.')
+    return redirect('controller_admin:exam_item_analysis', pk=exam.id)
 
 
 def exam_edit(request, pk):
@@ -120,11 +219,30 @@ def exam_edit(request, pk):
         exam.number_of_questions = request.POST['number_of_questions']
         exam.start_date = request.POST['start_date']
         exam.end_date = request.POST['end_date']
-        exam.pass_percentage = request.POST.get('pass_percentage', 40.0)
+        old_pass_percentage = exam.pass_percentage
+        exam.pass_percentage = float(request.POST.get('pass_percentage', 40.0))
+        exam.delivery_mode, exam.questions_per_page = _delivery_settings(
+            request, exam.delivery_mode, exam.questions_per_page
+        )
         exam.save()
+        if exam.pass_percentage != old_pass_percentage:
+            # pass_count was counted against the old threshold
+            rebuild_exam_statistics(exam)
+        invalidate_catalog(exam.category_id)
         messages.success(request, f'Exam "{exam.name}" updated successfully!')
         return redirect('controller_admin:exam_detail', pk=exam.id)
-    return render(request, 'controller_admin/exam_edit.html', {'exam': exam})
+    return render(request, 'controller_admin/exam_edit.html', {
+        'exam': exam,
+        'delivery_modes': Exam.DELIVERY_MODE_CHOICES,
+    })
+
+
+def exam_regrade(request, pk):
+    exam = get_object_or_404(Exam, pk=pk)
+    if request.method == 'POST':
+        answers, attempts = regrade_exam(exam)
+        messages.success(request, f'Regraded {answers} answers across {attempts} completed attempts.')
+    return redirect('controller_admin:exam_detail', pk=exam.id)
 
 
 def exam_delete(request, pk):
@@ -133,6 +251,7 @@ def exam_delete(request, pk):
     if request.method == 'POST':
         exam_name = exam.name
         exam.delete()
+        invalidate_catalog(category_id)
         messages.success(request, f'Exam "{exam_name}" deleted successfully!')
         return redirect('controller_admin:category_detail', pk=category_id)
     return render(request, 'controller_admin/exam_delete.html', {'exam': exam, 'category_id': category_id})
@@ -154,20 +273,39 @@ def question_add(request, exam_id):
             q.option_c = request.POST['option_c']
             q.option_d = request.POST['option_d']
         else:
-            q.option_a_image = request.FILES.get('option_a_image')
-            q.option_b_image = request.FILES.get('option_b_image')
-            q.option_c_image = request.FILES.get('option_c_image')
-            q.option_d_image = request.FILES.get('option_d_image')
+            try:
+                q.option_a_image = store_option_image(request.FILES.get('option_a_image'))
+                q.option_b_image = store_option_image(request.FILES.get('option_b_image'))
+                q.option_c_image = store_option_image(request.FILES.get('option_c_image'))
+                q.option_d_image = store_option_image(request.FILES.get('option_d_image'))
+            except InvalidImage as error:
+                return render(request, 'controller_admin/question_add.html', {'exam': exam, 'error': error})
         q.save()
         return redirect('controller_admin:exam_detail', pk=exam_id)
     return render(request, 'controller_admin/question_add.html', {'exam': exam})
 
 
+def question_import(request, exam_id):
+    exam = get_object_or_404(Exam, id=exam_id)
+    errors = []
+    if request.method == 'POST' and request.FILES.get('questions_file'):
+        questions_file = request.FILES['questions_file']
+        try:
+            count = import_questions(exam, questions_file.read(), questions_file.name, request.FILES.get('images_zip'))
+        except QuestionImportError as error:
+            errors = error.errors
+        else:
+            messages.success(request, f'{count} questions imported successfully!')
+            return redirect('controller_admin:exam_detail', pk=exam_id)
+    return render(request, 'controller_admin/question_import.html', {'exam': exam, 'errors': errors})
+
+
 def question_edit(request, pk):
     question = get_object_or_404(Question, pk=pk)
     exam_id = question.exam.id
     
     if request.method == 'POST':
+        old_correct_answer, old_marks = question.correct_answer, question.marks
         question.question_text = request.POST['question_text']
         question.option_type = request.POST['option_type']
         question.correct_answer = request.POST['correct_answer']
@@ -184,10 +322,17 @@ def question_edit(request, pk):
             question.option_c_image = None
             question.option_d_image = None
         else:
-            question.option_a_image = request.FILES.get('option_a_image', question.option_a_image)
-            question.option_b_image = request.FILES.get('option_b_image', question.option_b_image)
-            question.option_c_image = request.FILES.get('option_c_image', question.option_c_image)
-            question.option_d_image = request.FILES.get('option_d_image', question.option_d_image)
+            try:
+                question.option_a_image = store_option_image(request.FILES.get('option_a_image')) or question.option_a_image
+                question.option_b_image = store_option_image(request.FILES.get('option_b_image')) or question.option_b_image
+                question.option_c_image = store_option_image(request.FILES.get('option_c_image')) or question.option_c_image
+                question.option_d_image = store_option_image(request.FILES.get('option_d_image')) or question.option_d_image
+            except InvalidImage as error:
+                return render(request, 'controller_admin/question_edit.html', {
+                    'question': get_object_or_404(Question, pk=pk),
+                    'exam_id': exam_id,
+                    'error': error,
+                })
             # Clear text fields
             question.option_a = ''
             question.option_b = ''
@@ -195,6 +340,11 @@ def question_edit(request, pk):
             question.option_d = ''
         
         question.save()
+        invalidate_question_fragments([question.pk])
+        question.refresh_from_db(fields=['correct_answer', 'marks'])
+        marks_changed = question.marks != old_marks
+        if marks_changed or question.correct_answer != old_correct_answer:
+            regrade_question(question, marks_changed=marks_changed)
         messages.success(request, 'Question updated successfully!')
         return redirect('controller_admin:exam_detail', pk=exam_id)
     
@@ -209,6 +359,7 @@ def question_delete(request, pk):
     exam_id = question.exam.id
     
     if request.method == 'POST':
+        invalidate_question_fragments([question.pk])
         question.delete()
         messages.success(request, 'Question deleted successfully!')
         return redirect('controller_admin:exam_detail', pk=exam_id)
@@ -220,7 +371,44 @@ def question_delete(request, pk):
 
 
 
+@reporting_view
 def attempt_list(request):
-    # Exclude superusers from the list
-    attempts = ExamAttempt.objects.select_related('user', 'exam').exclude(user__is_superuser=True)
-    return render(request, 'controller_admin/attempt_list.html', {'attempts': attempts})
\ No newline at end of file
+    # Superusers are excluded by filter_attempts
+    attempts = filter_attempts(request.GET).select_related('user', 'exam__category')
+    page, next_cursor = keyset_page(attempts, request.GET.get('cursor'))
+
+    filters = request.GET.copy()
+    filters.pop('cursor', None)
+    return render(request, 'controller_admin/attempt_list.html', {
+        'attempts': page,
+        'next_cursor': next_cursor,
+        'filters': filters,
+        'filter_query': filters.urlencode(),
+        'exams': Exam.objects.only('id', 'name').order_by('name'),
+        'categories': Category.objects.only('id', 'name'),
+    })
+
+
+@user_passes_test(admin_required, login_url='controller_admin:admin_login')
+@reporting_view
+def attempt_export(request):
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in FORMATS:
+        export_format = 'csv'
+    include_answers = request.GET.get('answers') == '1'
+
+    lines = iter_export(filter_attempts(request.GET), export_format, include_answers)
+    response = StreamingHttpResponse(lines, content_type=FORMATS[export_format])
+    filename = f"{'answers' if include_answers else 'attempts'}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def metrics(request):
+    """Prometheus scrape endpoint, for admins or a bearer METRICS_TOKEN."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorization = request.headers.get('Authorization', '')
+    has_token = token and constant_time_compare(authorization, f'Bearer {token}')
+    if not (has_token or admin_required(request.user)):
+        return HttpResponseForbidden()
+    return HttpResponse(exam_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'exam_user.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,12 +79,119 @@ WSGI_APPLICATION = 'exam_pjt.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('EXAM_DB_NAME', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# Set EXAM_DB_PROFILE=production to tune SQLite for many concurrent
+# candidates: WAL lets readers run alongside the autosave writer, writers
+# wait on a busy lock instead of failing with "database is locked", and
+# connections are kept open between requests.
+# Compare profiles with scripts/benchmark_sqlite.py.
+DB_PROFILE = os.environ.get('EXAM_DB_PROFILE', 'development')
+
+SQLITE_PRODUCTION_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA busy_timeout=20000',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY',
+]
+
+if DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': '; '.join(SQLITE_PRODUCTION_PRAGMAS),
+            # Take the write lock at BEGIN so read-then-write transactions
+            # queue on busy_timeout instead of failing to upgrade their lock.
+            'transaction_mode': 'IMMEDIATE',
+        },
+    })
+
+# Optional reporting replica for the admin panel. Set EXAM_REPORTING_DB to
+# the path of a second SQLite file and keep it current with
+# "manage.py sync_reporting_db --loop". Reporting views fall back to the
+# default database when the last sync is older than REPORTING_MAX_STALENESS
+# seconds (None, from an empty EXAM_REPORTING_MAX_STALENESS: always use the
+# replica).
+REPORTING_DB_NAME = os.environ.get('EXAM_REPORTING_DB')
+REPORTING_MAX_STALENESS = os.environ.get('EXAM_REPORTING_MAX_STALENESS', '300')
+REPORTING_MAX_STALENESS = int(REPORTING_MAX_STALENESS) if REPORTING_MAX_STALENESS.strip() else None
+
+if REPORTING_DB_NAME:
+    DATABASES['reporting'] = {
+        **DATABASES['default'],
+        'NAME': REPORTING_DB_NAME,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['controller_admin.db_router.ReportingRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds a per-exam question index may be kept. Every use checks it against
+# the exam's questions_version, so edits made in other workers are picked up
+# at once.
+QUESTION_BANK_CACHE_TIMEOUT = 300
+
+# Upper bound in seconds on how long the candidate category and active-exam
+# lists are cached. They are also rebuilt whenever an exam opens or closes.
+CATALOG_CACHE_TIMEOUT = 60
+
+# Seconds a rendered take_exam question may stay cached. Entries carry the
+# question's updated_at, so an edit made in another process is never served.
+QUESTION_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Limits in bytes on the unpacked size of each image in a question import
+# zip and of the whole archive, checked before anything is extracted.
+QUESTION_IMPORT_MAX_IMAGE_SIZE = 5 * 1024 * 1024
+QUESTION_IMPORT_MAX_ARCHIVE_SIZE = 100 * 1024 * 1024
+
+# Days after an exam closes before archive_attempts moves its completed
+# attempts out of the attempt and answer tables (see exam_user.archive).
+ATTEMPT_ARCHIVE_AFTER_DAYS = 180
+
+# Metrics served at /panel/metrics to admins, or to scrapers sending
+# "Authorization: Bearer <EXAM_METRICS_TOKEN>". With several worker
+# processes set EXAM_METRICS_DIR to a directory they all share so the
+# endpoint reports the totals of every worker (see exam_user.metrics). The
+# files of exited workers are merged into metrics-retired.json there.
+METRICS_TOKEN = os.environ.get('EXAM_METRICS_TOKEN')
+METRICS_DIR = os.environ.get('EXAM_METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+
 # Custom User Model
 AUTH_USER_MODEL = 'exam_user.User'
+
+# Sessions and user loading. EXAM_SESSION_MODE picks where sessions live:
+#   db             - one session table read per request (Django default)
+#   cache          - cached_db, reads hit the cache and writes go through to the DB
+#   signed_cookies - no server-side session reads or writes at all
+# EXAM_USER_CACHE_TIMEOUT > 0 additionally keeps candidate User rows in a
+# per-process cache for that many seconds (see exam_user.auth_backends).
+SESSION_MODE = os.environ.get('EXAM_SESSION_MODE', 'db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cache': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_MODE]
+
+USER_CACHE_TIMEOUT = int(os.environ.get('EXAM_USER_CACHE_TIMEOUT', 0))
+if USER_CACHE_TIMEOUT > 0:
+    # ModelBackend stays listed so sessions created before the switch remain valid
+    AUTHENTICATION_BACKENDS = [
+        'exam_user.auth_backends.CachedModelBackend',
+        'django.contrib.auth.backends.ModelBackend',
+    ]
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
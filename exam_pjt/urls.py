@@ -15,12 +15,20 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path,include
+from django.urls import path,include,re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from exam_user.views import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('exam_user.urls')),
     path('panel/', include('controller_admin.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+# Like static(), media is only served by Django in DEBUG. In production the
+# web server should send "Cache-Control: public, max-age=31536000, immutable"
+# for media/options/<hash>.<ext> files.
+if settings.DEBUG:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serve_media),
+    ]
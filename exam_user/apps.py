@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ExamUserConfig(AppConfig):
     name = 'exam_user'
+
+    def ready(self):
+        from . import counters  # noqa: F401 (connects the dashboard counter signals)
+        from . import question_bank  # noqa: F401 (connects the question version signals)
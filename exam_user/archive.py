@@ -0,0 +1,84 @@
+"""
+Archival of completed attempts of long-closed exams.
+
+Once an exam has been closed for ATTEMPT_ARCHIVE_AFTER_DAYS, its completed
+attempts and their answers are moved, in chunks, from ExamAttempt and
+Answer into ArchivedAttempt: one row per attempt, with the paper and the
+answers as a zlib-compressed JSON payload. The hot tables and their
+indexes then only hold current and recent sessions.
+
+Archived attempts keep counting in the exam's statistics, ranking,
+leaderboard and dashboard total, and search_result finds them by
+attempt_id. They are frozen: regrading and exports only see attempts still
+in ExamAttempt. They are added to the item analysis before they leave, and
+a reset of the analysis (a full run or a regrade) can no longer count them.
+"""
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .counters import archiving_attempts
+from .item_analysis import analyze_exam
+from .models import Answer, ArchivedAttempt, Exam, ExamAttempt
+
+CHUNK_SIZE = 500
+
+
+def pack_payload(questions_data, answers):
+    """Compress a paper and its (question id, selected, is_correct, marks) answers."""
+    document = {'questions': questions_data, 'answers': [list(answer) for answer in answers]}
+    return zlib.compress(json.dumps(document, separators=(',', ':')).encode(), 9)
+
+
+def unpack_payload(payload):
+    """The {'questions': [...], 'answers': [[question id, selected, is_correct, marks], ...]} of a payload."""
+    return json.loads(zlib.decompress(bytes(payload)))
+
+
+def archive_cutoff(now=None):
+    """Exams that ended before this moment are archived."""
+    return (now or timezone.now()) - timedelta(days=getattr(settings, 'ATTEMPT_ARCHIVE_AFTER_DAYS', 180))
+
+
+def archivable_exams(now=None):
+    return Exam.objects.filter(end_date__lt=archive_cutoff(now))
+
+
+def archive_exam(exam):
+    """Move all completed attempts of an exam to the archive, return how many were moved."""
+    analyze_exam(exam)
+    moved = 0
+    completed = ExamAttempt.objects.filter(exam=exam, is_completed=True).order_by('id')
+    while True:
+        with transaction.atomic():
+            attempts = list(completed.select_for_update()[:CHUNK_SIZE])
+            if not attempts:
+                return moved
+            answers = {}
+            rows = Answer.objects.filter(attempt__in=attempts).values_list(
+                'attempt_id', 'question_id', 'selected_answer', 'is_correct', 'marks_obtained'
+            )
+            for attempt_id, *answer in rows:
+                answers.setdefault(attempt_id, []).append(answer)
+            ArchivedAttempt.objects.bulk_create([
+                ArchivedAttempt(
+                    attempt_id=attempt.attempt_id, user_id=attempt.user_id, exam_id=attempt.exam_id,
+                    start_time=attempt.start_time, end_time=attempt.end_time, score=attempt.score,
+                    total_marks=attempt.total_marks, percentage=attempt.percentage,
+                    payload=pack_payload(attempt.questions_data, answers.get(attempt.id, [])),
+                )
+                for attempt in attempts
+            ])
+            # The answers go with their attempts in one cascading DELETE
+            with archiving_attempts():
+                ExamAttempt.objects.filter(id__in=[attempt.id for attempt in attempts]).delete()
+        moved += len(attempts)
+
+
+def archive_attempts(now=None):
+    """Archive every exam past the cutoff, return {exam id: attempts moved}."""
+    return {exam.id: archive_exam(exam) for exam in archivable_exams(now).iterator()}
@@ -0,0 +1,115 @@
+"""
+Attempt ID generation without a lookup per attempt.
+
+Numbers come from the shared "attempt_id" Sequence row: each generator
+reserves BLOCK_SIZE of them with one UPDATE and hands them out from
+memory, so no two processes (or hosts sharing the database) ever get the
+same number. A keyed Feistel permutation turns the numbers into 8-character
+codes over the same A-Z0-9 alphabet used before. Distinct numbers always
+give distinct codes, so no exists() check is needed.
+
+Legacy random codes can still equal a generated one. Live attempts are
+covered by the unique constraint; the codes of archived attempts, which are
+outside it, are looked up once per block and their numbers skipped.
+
+A block is reserved in its own transaction when none is open, which is
+how ExamAttempt.save calls it. Inside a transaction that later rolls back,
+the reservation is undone with it; the save's retry then discards the
+block on the first clash and reserves a fresh one.
+"""
+import hashlib
+import string
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 8
+HALF_SPACE = len(ALPHABET) ** (CODE_LENGTH // 2)
+SPACE = HALF_SPACE * HALF_SPACE
+
+SEQUENCE_NAME = 'attempt_id'
+BLOCK_SIZE = 100
+
+ROUNDS = 4
+
+
+def archived_numbers(first, size):
+    """The numbers in [first, first + size) whose codes archived attempts already use."""
+    from .models import ArchivedAttempt
+
+    codes = {encode(permute(number % SPACE)): number for number in range(first, first + size)}
+    archived = ArchivedAttempt.objects.filter(attempt_id__in=codes).values_list('attempt_id', flat=True)
+    return {codes[code] for code in archived}
+
+
+def reserve_block(size=BLOCK_SIZE):
+    """Reserve `size` numbers from the shared sequence, return the first one."""
+    from .models import Sequence  # models imports this module
+
+    with transaction.atomic():
+        if not Sequence.objects.filter(name=SEQUENCE_NAME).update(value=F('value') + size):
+            try:
+                with transaction.atomic():
+                    Sequence.objects.create(name=SEQUENCE_NAME, value=size)
+                return 0
+            except IntegrityError:
+                Sequence.objects.filter(name=SEQUENCE_NAME).update(value=F('value') + size)
+        return Sequence.objects.values_list('value', flat=True).get(name=SEQUENCE_NAME) - size
+
+
+class AttemptIdGenerator:
+    """Hands out codes from blocks of numbers reserved from the shared sequence."""
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._skip = set()
+
+    def discard(self):
+        """Forget the rest of the current block; the next code reserves a new one."""
+        with self._lock:
+            self._next = self._end = 0
+
+    def next_number(self):
+        with self._lock:
+            while True:
+                if self._next >= self._end:
+                    self._next = reserve_block(self.block_size)
+                    self._end = self._next + self.block_size
+                    self._skip = archived_numbers(self._next, self.block_size)
+                number = self._next
+                self._next += 1
+                if number not in self._skip:
+                    return number % SPACE
+
+    def __call__(self):
+        return encode(permute(self.next_number()))
+
+
+def _round(value, round_number):
+    key = settings.SECRET_KEY.encode()
+    digest = hashlib.blake2b(f'{round_number}:{value}'.encode(), key=key[:64], digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % HALF_SPACE
+
+
+def permute(number):
+    """Map a number in [0, 36^8) onto another one, one-to-one."""
+    left, right = divmod(number, HALF_SPACE)
+    for round_number in range(ROUNDS):
+        left, right = right, (left + _round(right, round_number)) % HALF_SPACE
+    return left * HALF_SPACE + right
+
+
+def encode(number):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, index = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+generate_attempt_id = AttemptIdGenerator()
@@ -0,0 +1,55 @@
+"""
+Authentication backend with a short-lived per-process user cache.
+
+Without it every authenticated request fetches its User row. Only plain
+candidates are cached; admins, staff and superusers are always loaded
+fresh, so a revoked privilege is never served from the cache. Saving a
+user drops its entry in the saving process.
+"""
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+
+MAX_ENTRIES = 10000
+
+_lock = threading.Lock()
+_users = {}
+
+
+def _timeout():
+    return getattr(settings, 'USER_CACHE_TIMEOUT', 30)
+
+
+def forget_user(user_id):
+    with _lock:
+        _users.pop(user_id, None)
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        now = time.monotonic()
+        with _lock:
+            entry = _users.get(user_id)
+        if entry and entry[0] > now:
+            return copy.copy(entry[1])
+
+        user = super().get_user(user_id)
+        if user is not None and not (user.is_admin or user.is_staff or user.is_superuser):
+            with _lock:
+                if len(_users) >= MAX_ENTRIES:
+                    _users.clear()
+                _users[user.pk] = (now + _timeout(), copy.copy(user))
+        return user
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _drop_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
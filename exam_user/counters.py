@@ -0,0 +1,182 @@
+"""
+Running totals and attempt activity for the admin dashboard.
+
+SiteCounter rows hold the number of categories, exams and attempts, so the
+dashboard never runs COUNT(*) over a growing table. Model signals adjust
+them inside the transaction that creates or deletes a row. An exam delete
+counts its attempts once up front instead of adjusting the counter per
+cascaded attempt. Bulk inserts and queryset updates bypass signals, so
+reconcile_counters(), run by the reconcile_dashboard_counters command,
+recounts the tables periodically. Archived attempts stay in the attempts
+total: archiving them (exam_user.archive) does not decrement it.
+
+AttemptActivity holds the attempts started and submitted per minute and
+per hour, so a live session can be charted without scanning ExamAttempt.
+rebuild_activity() recomputes recent buckets from the attempts themselves.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncHour, TruncMinute
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ArchivedAttempt, AttemptActivity, Category, Exam, ExamAttempt, SiteCounter
+
+COUNTED_MODELS = {'categories': Category, 'exams': Exam, 'attempts': ExamAttempt}
+# Rows counted together with those of COUNTED_MODELS
+ARCHIVED_MODELS = {'attempts': ArchivedAttempt}
+
+MINUTE = AttemptActivity.RESOLUTION_MINUTE
+HOUR = AttemptActivity.RESOLUTION_HOUR
+
+# Minute buckets older than this are removed by prune_activity()
+MINUTE_RETENTION = timedelta(days=2)
+
+_archiving = ContextVar('archiving_attempts', default=False)
+
+
+def _reset_counter(name):
+    value = COUNTED_MODELS[name].objects.count()
+    if name in ARCHIVED_MODELS:
+        value += ARCHIVED_MODELS[name].objects.count()
+    SiteCounter.objects.update_or_create(name=name, defaults={'value': value})
+    return value
+
+
+def adjust_counter(name, delta):
+    if SiteCounter.objects.filter(name=name).update(value=F('value') + delta):
+        return
+    # First event since the counter was dropped: start from a fresh count
+    try:
+        with transaction.atomic():
+            _reset_counter(name)
+    except IntegrityError:
+        SiteCounter.objects.filter(name=name).update(value=F('value') + delta)
+
+
+def get_counts():
+    """Return {'categories': n, 'exams': n, 'attempts': n}."""
+    counts = dict(SiteCounter.objects.filter(name__in=COUNTED_MODELS).values_list('name', 'value'))
+    for name in COUNTED_MODELS.keys() - counts.keys():
+        counts[name] = _reset_counter(name)
+    return counts
+
+
+def reconcile_counters():
+    """Recount every counted table, return {name: (old value, new value)} for counters that drifted."""
+    drifted = {}
+    for name in COUNTED_MODELS:
+        old = SiteCounter.objects.filter(name=name).values_list('value', flat=True).first()
+        new = _reset_counter(name)
+        if old != new:
+            drifted[name] = (old, new)
+    return drifted
+
+
+@contextmanager
+def archiving_attempts():
+    """Attempts deleted in this block are moving to the archive and stay counted."""
+    token = _archiving.set(True)
+    try:
+        yield
+    finally:
+        _archiving.reset(token)
+
+
+def _buckets(when):
+    minute = when.replace(second=0, microsecond=0)
+    return [(MINUTE, minute), (HOUR, minute.replace(minute=0))]
+
+
+def record_activity(started=0, submitted=0, when=None):
+    """Add attempts started and submitted at `when` (default now) to its minute and hour buckets."""
+    buckets = _buckets(when or timezone.now())
+    rows = AttemptActivity.objects.filter(
+        Q(resolution=buckets[0][0], bucket=buckets[0][1]) | Q(resolution=buckets[1][0], bucket=buckets[1][1])
+    )
+    if rows.update(started=F('started') + started, submitted=F('submitted') + submitted) < len(buckets):
+        # First event of a minute (or hour). Rows that already existed were
+        # just incremented and are skipped by the insert.
+        AttemptActivity.objects.bulk_create([
+            AttemptActivity(resolution=resolution, bucket=bucket, started=started, submitted=submitted)
+            for resolution, bucket in buckets
+        ], ignore_conflicts=True)
+
+
+def activity_series(resolution, count, now=None):
+    """The last `count` buckets of a resolution as [(bucket start, started, submitted)], oldest first."""
+    step = timedelta(minutes=1) if resolution == MINUTE else timedelta(hours=1)
+    latest = dict(_buckets(now or timezone.now()))[resolution]
+    first = latest - step * (count - 1)
+    rows = {
+        bucket: (started, submitted)
+        for bucket, started, submitted in AttemptActivity.objects.filter(
+            resolution=resolution, bucket__gte=first
+        ).values_list('bucket', 'started', 'submitted')
+    }
+    return [(first + step * i, *rows.get(first + step * i, (0, 0))) for i in range(count)]
+
+
+def rebuild_activity(since):
+    """Recompute every bucket from `since` on from the attempts' start and end times."""
+    since = _buckets(since)[1][1]
+    totals = {}
+    for resolution, trunc in ((MINUTE, TruncMinute), (HOUR, TruncHour)):
+        started = ExamAttempt.objects.filter(start_time__gte=since).order_by()
+        for bucket, count in started.values_list(trunc('start_time')).annotate(count=Count('id')):
+            totals.setdefault((resolution, bucket), [0, 0])[0] = count
+        submitted = ExamAttempt.objects.filter(is_completed=True, end_time__gte=since).order_by()
+        for bucket, count in submitted.values_list(trunc('end_time')).annotate(count=Count('id')):
+            totals.setdefault((resolution, bucket), [0, 0])[1] = count
+    with transaction.atomic():
+        AttemptActivity.objects.filter(bucket__gte=since).delete()
+        AttemptActivity.objects.bulk_create([
+            AttemptActivity(resolution=resolution, bucket=bucket, started=started, submitted=submitted)
+            for (resolution, bucket), (started, submitted) in totals.items()
+        ])
+    return len(totals)
+
+
+def prune_activity(now=None):
+    cutoff = (now or timezone.now()) - MINUTE_RETENTION
+    return AttemptActivity.objects.filter(resolution=MINUTE, bucket__lt=cutoff).delete()[0]
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Exam)
+@receiver(post_save, sender=ExamAttempt)
+def _count_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        adjust_counter(_counter_name(sender), 1)
+
+
+@receiver(pre_delete, sender=Exam)
+def _count_cascaded_attempts(sender, instance, **kwargs):
+    instance._cascaded_attempts = instance.attempts.count() + instance.archived_attempts.count()
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Exam)
+@receiver(post_delete, sender=ExamAttempt)
+@receiver(post_delete, sender=ArchivedAttempt)
+def _count_deleted(sender, instance, origin=None, **kwargs):
+    if sender in (ExamAttempt, ArchivedAttempt):
+        if getattr(origin, 'model', type(origin)) in (Exam, Category):
+            return  # counted by the exam's delete
+        if _archiving.get():
+            return
+    adjust_counter(_counter_name(sender), -1)
+    if sender is Exam and instance._cascaded_attempts:
+        adjust_counter('attempts', -instance._cascaded_attempts)
+
+
+def _counter_name(model):
+    return next(
+        name for counted_models in (COUNTED_MODELS, ARCHIVED_MODELS)
+        for name, counted in counted_models.items() if counted is model
+    )
@@ -0,0 +1,65 @@
+"""
+Cached category list and per-category active exams for the candidate pages.
+
+An exam is active while start_date <= now <= end_date, so a category's
+active list can only change when one of its exams opens or closes. The
+cached list remembers the earliest such boundary and is rebuilt as soon as
+it is reached, so exams still appear and disappear on time. Admin edits
+drop the entries of the process that made them; CATALOG_CACHE_TIMEOUT
+bounds how long other processes may keep serving an edited list.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Category, Exam
+
+CATEGORIES_KEY = 'exam_user:categories'
+
+
+def _category_key(category_id):
+    return f'exam_user:category_exams:{category_id}'
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60)
+
+
+def get_categories():
+    categories = cache.get(CATEGORIES_KEY)
+    if categories is None:
+        categories = list(Category.objects.all())
+        cache.set(CATEGORIES_KEY, categories, _timeout())
+    return categories
+
+
+def get_category_exams(category_id):
+    """Return (category, active exams) or None for an unknown category."""
+    now = timezone.now()
+    entry = cache.get(_category_key(category_id))
+    if entry is not None and (entry['valid_until'] is None or now < entry['valid_until']):
+        return entry['listing']
+
+    category = Category.objects.filter(id=category_id).first()
+    if category is None:
+        return None
+    exams = list(Exam.objects.filter(category=category, end_date__gte=now))
+    active = [exam for exam in exams if exam.start_date <= now]
+    # The next moment an exam opens or closes
+    boundaries = [exam.start_date for exam in exams if exam.start_date > now] + [exam.end_date for exam in active]
+    valid_until = min(boundaries, default=None)
+
+    timeout = _timeout()
+    if valid_until is not None:
+        timeout = min(timeout, max(1, int((valid_until - now).total_seconds()) + 1))
+    listing = (category, active)
+    cache.set(_category_key(category_id), {'listing': listing, 'valid_until': valid_until}, timeout)
+    return listing
+
+
+def invalidate_catalog(category_id=None):
+    """Drop the category list and, if given, one category's exam list."""
+    keys = [CATEGORIES_KEY]
+    if category_id is not None:
+        keys.append(_category_key(category_id))
+    cache.delete_many(keys)
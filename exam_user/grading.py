@@ -0,0 +1,96 @@
+"""
+Set-based grading helpers.
+
+Everything here runs as a handful of UPDATE statements over the answers and
+attempts involved, so regrading does not load rows into Python except for
+the total_marks fix-up when question marks change. A regrade runs in one
+transaction, so a submission never sees answers regraded but scores or
+statistics not yet refreshed.
+"""
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .item_analysis import reset_item_analysis
+from .models import Answer, ExamAttempt, Question
+from .statistics import rebuild_exam_statistics
+
+
+def attempt_score_expression():
+    """Sum of marks_obtained over an attempt's answers, for use in updates."""
+    return Coalesce(
+        Subquery(
+            Answer.objects.filter(attempt=OuterRef('pk'))
+            .values('attempt')
+            .annotate(total=Sum('marks_obtained'))
+            .values('total')
+        ),
+        Value(0.0),
+    )
+
+
+def percentage_expression():
+    return Case(
+        When(total_marks__gt=0, then=F('score') * 100.0 / F('total_marks')),
+        default=Value(0.0),
+    )
+
+
+def regrade_answers(answers):
+    """Recompute is_correct/marks_obtained for a queryset of answers."""
+    correct = Question.objects.filter(pk=OuterRef('question_id'), correct_answer=OuterRef('selected_answer'))
+    return answers.update(
+        is_correct=Exists(correct),
+        marks_obtained=Coalesce(Subquery(correct.values('marks')), Value(0.0)),
+    )
+
+
+def refresh_total_marks(exam_id, question_ids):
+    """Recompute total_marks of the exam's attempts that include any of question_ids."""
+    marks = dict(Question.objects.filter(exam_id=exam_id).values_list('id', 'marks'))
+    question_ids = set(question_ids)
+    changed = []
+    attempts = ExamAttempt.objects.filter(exam_id=exam_id).only('id', 'questions_data', 'total_marks')
+    for attempt in attempts.iterator(chunk_size=2000):
+        if question_ids.isdisjoint(attempt.questions_data):
+            continue
+        total_marks = sum(marks.get(question_id, 0.0) for question_id in attempt.questions_data)
+        if total_marks != attempt.total_marks:
+            attempt.total_marks = total_marks
+            changed.append(attempt)
+    ExamAttempt.objects.bulk_update(changed, ['total_marks'], batch_size=500)
+    return len(changed)
+
+
+def refresh_attempt_scores(attempts):
+    """Recompute score and percentage of a queryset of completed attempts."""
+    attempts = attempts.filter(is_completed=True)
+    updated = attempts.update(score=attempt_score_expression())
+    attempts.update(percentage=percentage_expression())
+    return updated
+
+
+def regrade_question(question, marks_changed=False):
+    """Regrade every answer to one question and refresh the affected attempts."""
+    with transaction.atomic():
+        answers = regrade_answers(Answer.objects.filter(question=question))
+        if marks_changed:
+            refresh_total_marks(question.exam_id, [question.id])
+            affected = ExamAttempt.objects.filter(exam_id=question.exam_id)
+        else:
+            affected = ExamAttempt.objects.filter(id__in=Answer.objects.filter(question=question).values('attempt_id'))
+        attempts = refresh_attempt_scores(affected)
+        rebuild_exam_statistics(question.exam)
+        reset_item_analysis(question.exam)
+    return answers, attempts
+
+
+def regrade_exam(exam):
+    """Regrade all answers of an exam and refresh all of its attempts."""
+    with transaction.atomic():
+        answers = regrade_answers(Answer.objects.filter(question__exam=exam))
+        refresh_total_marks(exam.id, exam.questions.values_list('id', flat=True))
+        attempts = refresh_attempt_scores(ExamAttempt.objects.filter(exam=exam))
+        rebuild_exam_statistics(exam)
+        reset_item_analysis(exam)
+    return answers, attempts
@@ -0,0 +1,74 @@
+"""
+Option image pipeline.
+
+Uploaded option images are downscaled to a bounded size, re-encoded as WebP
+(or PNG when Pillow has no WebP support) and stored under a name derived
+from a hash of the result. Identical images therefore share one file, and
+since a name never changes content it can be cached forever by browsers.
+Files Pillow cannot decode are rejected with InvalidImage, never stored.
+"""
+import hashlib
+import io
+import os
+import re
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+MAX_SIZE = (1200, 900)
+WEBP_QUALITY = 80
+UPLOAD_DIR = 'options'
+HASH_LENGTH = 32
+
+HASHED_NAME_RE = re.compile(rf'^{UPLOAD_DIR}/[0-9a-f]{{{HASH_LENGTH}}}\.[a-z0-9]+$')
+
+
+class InvalidImage(Exception):
+    """Raised when an uploaded option image is not an image Pillow can decode."""
+
+
+def optimize_image(data):
+    """Return (bytes, extension) of the optimized rendition of an image.
+
+    Raises InvalidImage for data that Pillow cannot decode.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, Image.DecompressionBombError) as error:
+        raise InvalidImage(str(error)) from error
+
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(MAX_SIZE)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    output = io.BytesIO()
+    if features.check('webp'):
+        image.save(output, 'WEBP', quality=WEBP_QUALITY, method=4)
+        return output.getvalue(), 'webp'
+    image.save(output, 'PNG', optimize=True)
+    return output.getvalue(), 'png'
+
+
+def store_option_image(uploaded):
+    """Optimize an uploaded file and store it under its content hash, return the stored name.
+
+    Raises InvalidImage, naming the file, when it is not an image.
+    """
+    if not uploaded:
+        return None
+    try:
+        data, extension = optimize_image(uploaded.read())
+    except InvalidImage as error:
+        raise InvalidImage(f'"{os.path.basename(uploaded.name or "")}" is not a supported image file.') from error
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    name = f'{UPLOAD_DIR}/{digest}.{extension}'
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def is_immutable(name):
+    return bool(HASHED_NAME_RE.match(name))
@@ -0,0 +1,236 @@
+"""
+Item analysis: difficulty, discrimination and option frequencies per question.
+
+For every question of an exam, over the completed attempts whose paper
+contained it:
+
+- difficulty is the share of candidates who answered it correctly,
+- discrimination is the point-biserial correlation between answering it
+  correctly and the rest score (the attempt's score without this item),
+- option_counts is how many candidates chose each option; candidates who
+  left it blank make up the rest of presented_count.
+
+Attempts are read in chunks of CHUNK_SIZE as plain columns (ids, scores,
+papers, answers) and reduced with NumPy: papers and answers become arrays
+of question positions, and every per-question sum is one bincount over
+them. QuestionAnalysis keeps the sums, not just the results, so a run only
+reads attempts not yet counted (ExamAttempt.item_analyzed) and adds them.
+Regrading changes old scores and marks, so it resets the exam's analysis
+and the next run starts over.
+"""
+from itertools import chain
+
+import numpy as np
+from django.db import connections, transaction
+
+from .models import Answer, ExamAttempt, Question, QuestionAnalysis
+
+CHUNK_SIZE = 2000
+
+# Sums kept per question, as (QuestionAnalysis field, column of _Totals)
+_SUM_FIELDS = [
+    ('presented_count', 'presented'),
+    ('correct_count', 'correct'),
+    ('rest_score_sum', 'rest_sum'),
+    ('rest_score_sq_sum', 'rest_sq_sum'),
+    ('rest_score_correct_sum', 'rest_correct_sum'),
+]
+OPTION_COUNT = len(QuestionAnalysis.OPTIONS)
+# Option index by selected_answer byte, OPTION_COUNT for anything else
+_OPTION_INDEX = np.full(256, OPTION_COUNT, dtype=np.int64)
+_OPTION_INDEX[np.frombuffer(QuestionAnalysis.OPTIONS.encode(), dtype=np.uint8)] = np.arange(OPTION_COUNT)
+
+# Columns read for each answer
+ANSWER_COLUMNS = np.dtype([
+    ('attempt_id', np.int64),
+    ('question_id', np.int64),
+    ('selected_answer', 'S1'),
+    ('is_correct', np.bool_),
+    ('marks_obtained', np.float64),
+])
+
+
+class _Totals:
+    """The sums of every question of an exam, one array element per question."""
+
+    COLUMNS = ('presented', 'correct', 'options', 'rest_sum', 'rest_sq_sum', 'rest_correct_sum')
+
+    def __init__(self, size):
+        self.presented = np.zeros(size, dtype=np.int64)
+        self.correct = np.zeros(size, dtype=np.int64)
+        self.options = np.zeros((size, OPTION_COUNT), dtype=np.int64)
+        self.rest_sum = np.zeros(size)
+        self.rest_sq_sum = np.zeros(size)
+        self.rest_correct_sum = np.zeros(size)
+
+    def add(self, other):
+        for name in self.COLUMNS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+def _positions(question_ids, ids):
+    """Index of each of `ids` in the sorted question_ids, and a mask of the ids found there."""
+    positions = np.searchsorted(question_ids, ids)
+    found = positions < len(question_ids)
+    found[found] = question_ids[positions[found]] == ids[found]
+    return positions, found
+
+
+def chunk_totals(question_ids, attempts, answers):
+    """Reduce one chunk of attempts to per-question sums.
+
+    `question_ids` is the sorted array of the exam's question ids,
+    `attempts` the (id, score, questions_data) rows of the chunk sorted by
+    id, and `answers` their rows as an ANSWER_COLUMNS array in any order.
+    """
+    size = len(question_ids)
+    totals = _Totals(size)
+    if not attempts:
+        return totals
+    attempt_ids, scores, papers = zip(*attempts)
+    attempt_ids = np.array(attempt_ids, dtype=np.int64)
+    scores = np.array(scores, dtype=np.float64)
+
+    # One element per (attempt, question on its paper)
+    paper_sizes = np.fromiter(map(len, papers), dtype=np.int64, count=len(papers))
+    paper_questions = np.fromiter(chain.from_iterable(papers), dtype=np.int64, count=paper_sizes.sum())
+    paper_scores = np.repeat(scores, paper_sizes)
+    positions, found = _positions(question_ids, paper_questions)
+    positions, paper_scores = positions[found], paper_scores[found]
+    totals.presented = np.bincount(positions, minlength=size)
+    totals.rest_sum = np.bincount(positions, weights=paper_scores, minlength=size)
+    totals.rest_sq_sum = np.bincount(positions, weights=paper_scores * paper_scores, minlength=size)
+
+    if len(answers):
+        rows, in_chunk = _positions(attempt_ids, answers['attempt_id'])
+        positions, found = _positions(question_ids, answers['question_id'])
+        options = _OPTION_INDEX[answers['selected_answer'].view(np.uint8)]
+        keep = in_chunk & found & (options < OPTION_COUNT)
+        positions, options = positions[keep], options[keep]
+        scores = scores[rows[keep]]
+        marks = answers['marks_obtained'][keep]
+        correct = answers['is_correct'][keep]
+
+        # Take the item's own marks out of the score: (s - m)^2 = s^2 - 2sm + m^2
+        totals.rest_sum -= np.bincount(positions, weights=marks, minlength=size)
+        totals.rest_sq_sum += np.bincount(positions, weights=marks * (marks - 2 * scores), minlength=size)
+        totals.correct = np.bincount(positions[correct], minlength=size)
+        totals.rest_correct_sum = np.bincount(
+            positions[correct], weights=(scores - marks)[correct], minlength=size
+        )
+        totals.options = np.bincount(
+            positions * OPTION_COUNT + options, minlength=size * OPTION_COUNT
+        ).reshape(size, OPTION_COUNT)
+    return totals
+
+
+def item_statistics(totals):
+    """Difficulty and discrimination arrays from the sums, NaN where undefined."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        presented = totals.presented.astype(np.float64)
+        correct = totals.correct.astype(np.float64)
+        difficulty = correct / presented
+        mean = totals.rest_sum / presented
+        stddev = np.sqrt(np.maximum(totals.rest_sq_sum / presented - mean * mean, 0.0))
+        mean_correct = totals.rest_correct_sum / correct
+        mean_wrong = (totals.rest_sum - totals.rest_correct_sum) / (presented - correct)
+        discrimination = (mean_correct - mean_wrong) / stddev * np.sqrt(difficulty * (1 - difficulty))
+    # Undefined when everyone (or no one) got the item right or all rest scores are equal
+    defined = (correct > 0) & (correct < presented) & (stddev > 1e-9)
+    return difficulty, np.where(defined, discrimination, np.nan)
+
+
+def _fetch_columns(queryset, dtype):
+    """The rows of a values_list() queryset as a structured array of `dtype`.
+
+    The driver's tuples go straight into the array: Django's per-row value
+    converters would cost more than the analysis itself at millions of rows.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        return np.fromiter(cursor.fetchall(), dtype=dtype)
+
+
+def _stored_totals(exam, question_ids):
+    totals = _Totals(len(question_ids))
+    rows = QuestionAnalysis.objects.filter(question__exam=exam).values_list(
+        'question_id', 'option_counts', *(field for field, _ in _SUM_FIELDS)
+    )
+    columns = list(zip(*rows))
+    if not columns:
+        return totals
+    positions, found = _positions(question_ids, np.array(columns[0], dtype=np.int64))
+    positions = positions[found]
+    option_counts = np.array([counts or [0] * OPTION_COUNT for counts in columns[1]], dtype=np.int64)
+    totals.options[positions] = option_counts[found]
+    for (_, column), values in zip(_SUM_FIELDS, columns[2:]):
+        getattr(totals, column)[positions] = np.array(values)[found]
+    return totals
+
+
+def _save_totals(question_ids, totals):
+    difficulty, discrimination = item_statistics(totals)
+    rows = []
+    for position, question_id in enumerate(question_ids.tolist()):
+        row = QuestionAnalysis(
+            question_id=question_id,
+            option_counts=totals.options[position].tolist(),
+            difficulty=None if np.isnan(difficulty[position]) else float(difficulty[position]),
+            discrimination=None if np.isnan(discrimination[position]) else float(discrimination[position]),
+        )
+        for field, column in _SUM_FIELDS:
+            setattr(row, field, getattr(totals, column)[position].item())
+        rows.append(row)
+    QuestionAnalysis.objects.bulk_create(
+        rows, batch_size=500, update_conflicts=True, unique_fields=['question'],
+        update_fields=['option_counts', 'difficulty', 'discrimination', 'updated_at']
+        + [field for field, _ in _SUM_FIELDS],
+    )
+
+
+def reset_item_analysis(exam):
+    """Forget an exam's analysis; the next run recounts all of its completed attempts.
+
+    Attempts already moved to the archive (exam_user.archive) are not recounted.
+    """
+    with transaction.atomic():
+        QuestionAnalysis.objects.filter(question__exam=exam).delete()
+        ExamAttempt.objects.filter(exam=exam, item_analyzed=True).update(item_analyzed=False)
+
+
+def analyze_exam(exam, full=False):
+    """Add the exam's completed attempts not counted yet to its item analysis.
+
+    With `full` the analysis is reset first. Returns the number of attempts
+    added. Each chunk is saved in its own transaction together with the
+    attempts' item_analyzed flags, so an interrupted run loses nothing.
+    """
+    if full:
+        reset_item_analysis(exam)
+    question_ids = np.array(
+        sorted(Question.objects.filter(exam=exam).values_list('id', flat=True)), dtype=np.int64
+    )
+    pending = ExamAttempt.objects.filter(exam=exam, is_completed=True, item_analyzed=False).order_by('id')
+    added = 0
+    after = 0
+    while True:
+        attempts = list(pending.filter(id__gt=after).values_list('id', 'score', 'questions_data')[:CHUNK_SIZE])
+        if not attempts:
+            return added
+        attempt_ids = [attempt_id for attempt_id, _, _ in attempts]
+        answers = Answer.objects.filter(attempt_id__in=attempt_ids).values_list(*ANSWER_COLUMNS.names)
+        chunk = chunk_totals(question_ids, attempts, _fetch_columns(answers, ANSWER_COLUMNS))
+
+        with transaction.atomic():
+            claimed = ExamAttempt.objects.filter(id__in=attempt_ids, item_analyzed=False).update(item_analyzed=True)
+            if claimed != len(attempt_ids):
+                # Another run counted some of them first: drop the chunk and
+                # read what is still pending again.
+                transaction.set_rollback(True)
+                continue
+            totals = _stored_totals(exam, question_ids)
+            totals.add(chunk)
+            _save_totals(question_ids, totals)
+        added += len(attempts)
+        after = attempt_ids[-1]
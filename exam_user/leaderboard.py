@@ -0,0 +1,81 @@
+"""
+Rank and percentile of completed attempts within their exam.
+
+ExamStatistics.score_counts holds how many completed attempts reached each
+distinct score, as [score, count] pairs sorted by score, and is maintained
+with the rest of the statistics (see exam_user.statistics). Ranking an
+attempt reads that one row and bisects it, so the cost depends on the
+number of distinct scores, which the exam's total marks bound, and not on
+the number of attempts. The top of the leaderboard is read from the
+partial (exam, -score) index on completed attempts and the matching index
+on archived ones.
+"""
+from bisect import bisect_left
+from collections import namedtuple
+from heapq import merge
+from itertools import accumulate, islice
+
+from .models import ArchivedAttempt, ExamAttempt, ExamStatistics
+
+# Scores are sums of float marks; rounding keeps 0.1 + 0.2 and 0.3 together
+SCORE_PRECISION = 4
+
+Ranking = namedtuple('Ranking', 'rank total percentile')
+
+
+def score_key(score):
+    return round(score, SCORE_PRECISION)
+
+
+def merge_score_counts(score_counts, added):
+    """Return score_counts plus the (score, attempts) pairs in `added`."""
+    counts = {score: count for score, count in score_counts or []}
+    for score, count in added:
+        key = score_key(score)
+        counts[key] = counts.get(key, 0) + count
+    return [[score, counts[score]] for score in sorted(counts)]
+
+
+def rank_score(score_counts, score):
+    """Rank `score` among score_counts: equal scores share a rank, 1 is the best.
+
+    The percentile is the share of attempts that scored strictly lower.
+    Returns None when there are no attempts.
+    """
+    if not score_counts:
+        return None
+    scores = [value for value, _ in score_counts]
+    cumulative = list(accumulate(count for _, count in score_counts))
+    total = cumulative[-1]
+    key = score_key(score)
+    index = bisect_left(scores, key)
+    below = cumulative[index - 1] if index else 0
+    at_or_below = cumulative[index] if index < len(scores) and scores[index] == key else below
+    return Ranking(rank=total - at_or_below + 1, total=total, percentile=below * 100 / total)
+
+
+def rank_attempt(attempt, stats=None):
+    """The Ranking of a completed attempt in its exam, or None."""
+    if not attempt.is_completed:
+        return None
+    if stats is None:
+        stats = ExamStatistics.objects.filter(exam_id=attempt.exam_id).only('score_counts').first()
+    return rank_score(stats.score_counts, attempt.score) if stats else None
+
+
+def top_attempts(exam, limit=50):
+    """The best completed attempts of an exam as [(rank, attempt)], earlier finishers first on ties.
+
+    Archived attempts take part as ArchivedAttempt rows.
+    """
+    live = ExamAttempt.objects.filter(exam=exam, is_completed=True)
+    archived = ArchivedAttempt.objects.filter(exam=exam)
+    attempts = merge(
+        *(attempts.select_related('user').order_by('-score', 'end_time', 'id')[:limit] for attempts in (live, archived)),
+        key=lambda attempt: (-attempt.score, attempt.end_time),
+    )
+    leaderboard = []
+    for position, attempt in enumerate(islice(attempts, limit), start=1):
+        tied = leaderboard and score_key(leaderboard[-1][1].score) == score_key(attempt.score)
+        leaderboard.append((leaderboard[-1][0] if tied else position, attempt))
+    return leaderboard
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from exam_user.item_analysis import analyze_exam
+from exam_user.models import Exam
+
+
+class Command(BaseCommand):
+    help = 'Add newly completed attempts to the per-question item analysis.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exam', type=int, action='append', help='Exam id to analyze (repeatable). Defaults to all exams.')
+        parser.add_argument('--full', action='store_true', help='Recount all completed attempts instead of only new ones.')
+
+    def handle(self, *args, **options):
+        exams = Exam.objects.all()
+        if options['exam']:
+            exams = exams.filter(pk__in=options['exam'])
+        for exam in exams.iterator():
+            started = time.monotonic()
+            added = analyze_exam(exam, full=options['full'])
+            self.stdout.write(f'{exam.pk}: {added} attempts added in {time.monotonic() - started:.2f}s')
+        self.stdout.write(self.style.SUCCESS('Done.'))
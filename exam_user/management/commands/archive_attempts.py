@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from exam_user.archive import archivable_exams, archive_exam
+
+
+class Command(BaseCommand):
+    help = 'Move completed attempts of long-closed exams to the compressed archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exam', type=int, action='append', help='Exam id to archive (repeatable). Defaults to every exam past the cutoff.')
+
+    def handle(self, *args, **options):
+        exams = archivable_exams()
+        if options['exam']:
+            exams = exams.filter(pk__in=options['exam'])
+        for exam in exams.iterator():
+            moved = archive_exam(exam)
+            if moved:
+                self.stdout.write(f'{exam.pk}: {moved} attempts archived')
+        self.stdout.write(self.style.SUCCESS('Done.'))
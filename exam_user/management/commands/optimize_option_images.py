@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from exam_user.images import InvalidImage, is_immutable, store_option_image
+from exam_user.models import Question
+from exam_user.question_bank import invalidate_question_bank
+from exam_user.question_fragments import invalidate_question_fragments
+
+IMAGE_FIELDS = ['option_a_image', 'option_b_image', 'option_c_image', 'option_d_image']
+
+
+class Command(BaseCommand):
+    help = 'Convert existing option images to optimized, content-hashed renditions.'
+
+    def handle(self, *args, **options):
+        has_image = Q()
+        for field in IMAGE_FIELDS:
+            has_image |= Q(**{f'{field}__gt': ''})
+        questions = Question.objects.filter(has_image).only('id', 'exam_id', *IMAGE_FIELDS)
+
+        changed = []
+        converted = {}
+        for question in questions.iterator(chunk_size=500):
+            updated = False
+            for field in IMAGE_FIELDS:
+                image = getattr(question, field)
+                if not image or is_immutable(image.name):
+                    continue
+                if image.name not in converted:
+                    try:
+                        with image.open('rb'):
+                            converted[image.name] = store_option_image(image)
+                    except FileNotFoundError:
+                        self.stderr.write(f'Missing file {image.name} for question {question.id}')
+                        continue
+                    except InvalidImage:
+                        self.stderr.write(f'{image.name} of question {question.id} is not an image, left as is')
+                        continue
+                setattr(question, field, converted[image.name])
+                updated = True
+            if updated:
+                changed.append(question)
+
+        # bulk_update skips auto_now: bump updated_at by hand so cached
+        # fragments in every process see a new version
+        now = timezone.now()
+        for question in changed:
+            question.updated_at = now
+        Question.objects.bulk_update(changed, [*IMAGE_FIELDS, 'updated_at'], batch_size=500)
+        invalidate_question_fragments([question.id for question in changed])
+        for exam_id in {question.exam_id for question in changed}:
+            invalidate_question_bank(exam_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Optimized {len(converted)} images used by {len(changed)} questions.'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from exam_user.models import Exam
+from exam_user.statistics import rebuild_exam_statistics
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-exam statistics from completed attempts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exam', type=int, action='append', help='Exam id to rebuild (repeatable). Defaults to all exams.')
+
+    def handle(self, *args, **options):
+        exams = Exam.objects.all()
+        if options['exam']:
+            exams = exams.filter(pk__in=options['exam'])
+        for exam in exams.iterator():
+            stats = rebuild_exam_statistics(exam)
+            self.stdout.write(f'{exam.pk}: {stats.attempts_count} attempts')
+        self.stdout.write(self.style.SUCCESS('Done.'))
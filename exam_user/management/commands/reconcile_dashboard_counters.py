@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from exam_user.counters import prune_activity, rebuild_activity, reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount the dashboard totals and rebuild recent attempt activity from the attempts table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=2, help='Hours of activity to rebuild (0 to skip).')
+
+    def handle(self, *args, **options):
+        for name, (old, new) in reconcile_counters().items():
+            self.stdout.write(f'{name}: {old} -> {new}')
+        if options['hours']:
+            buckets = rebuild_activity(timezone.now() - timedelta(hours=options['hours']))
+            self.stdout.write(f'Rebuilt {buckets} activity buckets.')
+        self.stdout.write(f'Pruned {prune_activity()} old minute buckets.')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from exam_user.grading import regrade_exam, regrade_question
+from exam_user.models import Exam, Question
+
+
+class Command(BaseCommand):
+    help = 'Regrade answers and refresh attempt scores after an answer key change.'
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--exam', type=int, help='Regrade every question of this exam id.')
+        target.add_argument('--question', type=int, help='Regrade a single question id.')
+
+    def handle(self, *args, **options):
+        if options['exam']:
+            try:
+                exam = Exam.objects.get(pk=options['exam'])
+            except Exam.DoesNotExist:
+                raise CommandError(f"Exam {options['exam']} does not exist.")
+            answers, attempts = regrade_exam(exam)
+        else:
+            try:
+                question = Question.objects.get(pk=options['question'])
+            except Question.DoesNotExist:
+                raise CommandError(f"Question {options['question']} does not exist.")
+            answers, attempts = regrade_question(question, marks_changed=True)
+        self.stdout.write(self.style.SUCCESS(f'Regraded {answers} answers and {attempts} attempts.'))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from exam_user.sweeper import BATCH_SIZE, close_expired_attempts
+
+
+class Command(BaseCommand):
+    help = 'Grade and close attempts whose exam time has run out.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping until interrupted.')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between sweeps with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            closed = close_expired_attempts(batch_size=options['batch_size'])
+            if closed or not options['loop']:
+                self.stdout.write(f'Closed {closed} expired attempts.')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,296 @@
+"""
+Request and exam-flow metrics in the Prometheus text format.
+
+MetricsMiddleware records, per resolved URL name, the request count, a
+latency histogram and the number and duration of database queries. Views
+add domain counters with increment(). Everything is kept in memory per
+process, so the cost per request is a few dictionary updates. Queries
+run while a streamed body is sent are not included.
+
+With several worker processes set METRICS_DIR to a directory shared by
+them: each process then writes its totals there (at most every
+METRICS_FLUSH_INTERVAL seconds) and render() adds up the files of all
+processes, past and present, so counters never go backwards when a worker
+is recycled. The files of processes that have exited are folded into one
+cumulative file as they are collected, so the directory holds one file per
+live worker plus that one. The workers must share a host, as liveness is
+checked by pid. Without METRICS_DIR only the serving process is reported.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'exam_http_requests_total': ('counter', 'Requests by URL name, method and status code.', None),
+    'exam_http_request_duration_seconds': ('histogram', 'Request latency by URL name.', LATENCY_BUCKETS),
+    'exam_db_queries_per_request': ('histogram', 'Database queries per request by URL name.', QUERY_BUCKETS),
+    'exam_db_queries_total': ('counter', 'Database queries by URL name.', None),
+    'exam_db_query_seconds_total': ('counter', 'Time spent in database queries by URL name.', None),
+    'exam_attempts_started_total': ('counter', 'Exam attempts started.', None),
+    'exam_attempts_submitted_total': ('counter', 'Exam attempts completed by submission.', None),
+    'exam_autosaves_total': ('counter', 'Accepted autosave requests.', None),
+    'exam_answers_written_total': ('counter', 'Answers inserted or updated.', None),
+}
+
+# Unlabelled counters, reported as 0 before their first increment
+DOMAIN_COUNTERS = {
+    'exam_attempts_started_total', 'exam_attempts_submitted_total',
+    'exam_autosaves_total', 'exam_answers_written_total',
+}
+
+try:
+    import fcntl
+except ImportError:  # Windows: exited processes' files are kept
+    fcntl = None
+
+_PROCESS_KEY = f'{os.getpid()}-{time.time_ns()}'
+# Snapshot files of single processes, and the totals of exited ones
+_SNAPSHOT_RE = re.compile(r'^metrics-(\d+)-\d+\.json$')
+RETIRED_FILE = 'metrics-retired.json'
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_last_flush = [0.0]
+
+
+def increment(name, value=1, **labels):
+    """Add value to the counter name with the given labels."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record value in the histogram name with the given labels."""
+    buckets = METRICS[name][2]
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+        index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+        entry[0][index] += 1
+        entry[1] += value
+
+
+def snapshot():
+    with _lock:
+        return {
+            'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, labels, list(counts), total] for (name, labels), (counts, total) in _histograms.items()],
+        }
+
+
+def reset():
+    """Forget this process's metrics (for tests)."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path, data):
+    directory = os.path.dirname(path)
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as snapshot_file:
+        json.dump(data, snapshot_file)
+    os.replace(snapshot_file.name, path)
+
+
+def flush():
+    """Write this process's totals to METRICS_DIR, if set."""
+    directory = _metrics_dir()
+    if not directory:
+        return
+    _last_flush[0] = time.monotonic()
+    os.makedirs(directory, exist_ok=True)
+    _write_snapshot(os.path.join(directory, f'metrics-{_PROCESS_KEY}.json'), snapshot())
+
+
+def _maybe_flush():
+    if _metrics_dir() and time.monotonic() - _last_flush[0] > getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+        flush()
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _directory_lock(directory):
+    """Serialize collections, so only one merges the files of exited processes."""
+    if fcntl is None:
+        yield False
+        return
+    with open(os.path.join(directory, 'metrics.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _merge(snapshots):
+    """Add up snapshots into (counters, histograms) keyed by (name, labels)."""
+    counters, histograms = {}, {}
+    for data in snapshots:
+        for name, labels, value in data['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total in data['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+    return counters, histograms
+
+
+def _as_snapshot(counters, histograms):
+    return {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, counts, total] for (name, labels), (counts, total) in histograms.items()],
+    }
+
+
+def collect():
+    """Totals of all processes, as (counters, histograms) keyed by (name, labels)."""
+    directory = _metrics_dir()
+    if not directory:
+        return _merge([snapshot()])
+
+    flush()
+    with _directory_lock(directory) as locked:
+        snapshots, retired, exited = [], None, []
+        for filename in os.listdir(directory):
+            if filename == RETIRED_FILE:
+                retired = _read_snapshot(os.path.join(directory, filename))
+                continue
+            match = _SNAPSHOT_RE.match(filename)
+            if not match:
+                continue
+            data = _read_snapshot(os.path.join(directory, filename))
+            if data is None:
+                continue
+            snapshots.append(data)
+            if locked and not _is_running(int(match.group(1))):
+                exited.append((filename, data))
+
+        if exited:
+            # Written before the files it replaces are removed: a crash in
+            # between counts them twice instead of losing them.
+            retired_totals = _merge([data for _, data in exited] + ([retired] if retired else []))
+            _write_snapshot(os.path.join(directory, RETIRED_FILE), _as_snapshot(*retired_totals))
+            for filename, _ in exited:
+                os.remove(os.path.join(directory, filename))
+    return _merge(snapshots + ([retired] if retired else []))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """The text exposition of all metrics."""
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            series = sorted((labels, value) for (metric, labels), value in counters.items() if metric == name)
+            if not series and name in DOMAIN_COUNTERS:
+                series = [((), 0)]
+            for labels, value in series:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        else:
+            for labels, (counts, total) in sorted(
+                (labels, entry) for (metric, labels), entry in histograms.items() if metric == name
+            ):
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class _QueryTimer:
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Time each request and count its database queries, by URL name."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        increment('exam_http_requests_total', view=view, method=request.method, status=response.status_code)
+        observe('exam_http_request_duration_seconds', elapsed, view=view)
+        observe('exam_db_queries_per_request', timer.count, view=view)
+        increment('exam_db_queries_total', timer.count, view=view)
+        increment('exam_db_query_seconds_total', timer.seconds, view=view)
+        _maybe_flush()
+        return response
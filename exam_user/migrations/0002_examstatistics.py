@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-18 18:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExamStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts_count', models.IntegerField(default=0)),
+                ('pass_count', models.IntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0.0)),
+                ('score_sq_sum', models.FloatField(default=0.0)),
+                ('histogram', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('exam', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='exam_user.exam')),
+            ],
+            options={
+                'verbose_name_plural': 'Exam statistics',
+            },
+        ),
+    ]
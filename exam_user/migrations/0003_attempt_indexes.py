@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0002_examstatistics'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='examattempt',
+            index=models.Index(fields=['-start_time', '-id'], name='attempt_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='examattempt',
+            index=models.Index(fields=['exam', '-start_time', '-id'], name='attempt_exam_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='examattempt',
+            index=models.Index(fields=['user', '-start_time'], name='attempt_user_recent_idx'),
+        ),
+    ]
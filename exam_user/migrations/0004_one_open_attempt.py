@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-18 18:36
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+
+def close_duplicate_open_attempts(apps, schema_editor):
+    """Keep only the newest open attempt per user and exam, grading and closing the rest."""
+    ExamAttempt = apps.get_model('exam_user', 'ExamAttempt')
+    duplicates = (
+        ExamAttempt.objects.filter(is_completed=False)
+        .values('user_id', 'exam_id').annotate(open_count=Count('id')).filter(open_count__gt=1)
+    )
+    for pair in duplicates:
+        open_attempts = ExamAttempt.objects.filter(
+            user_id=pair['user_id'], exam_id=pair['exam_id'], is_completed=False
+        ).order_by('-start_time', '-id')
+        for attempt in open_attempts[1:]:
+            attempt.score = attempt.answers.aggregate(total=Sum('marks_obtained'))['total'] or 0.0
+            attempt.percentage = (attempt.score / attempt.total_marks * 100) if attempt.total_marks > 0 else 0
+            attempt.is_completed = True
+            attempt.end_time = timezone.now()
+            attempt.save(update_fields=['score', 'percentage', 'is_completed', 'end_time'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0003_attempt_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_open_attempts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='examattempt',
+            index=models.Index(fields=['user', 'exam', 'is_completed'], name='attempt_user_exam_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='examattempt',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_completed', False)), fields=('user', 'exam'), name='one_open_attempt_per_user_exam'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0004_one_open_attempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
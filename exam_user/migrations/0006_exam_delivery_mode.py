@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0005_question_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exam',
+            name='delivery_mode',
+            field=models.CharField(choices=[('single', 'All questions on one page'), ('paged', 'A few questions per page')], default='single', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='exam',
+            name='questions_per_page',
+            field=models.PositiveSmallIntegerField(default=10, help_text='Questions per page in paged mode'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 6.0 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+def seed_counters(apps, schema_editor):
+    SiteCounter = apps.get_model('exam_user', 'SiteCounter')
+    for name, model in [('categories', 'Category'), ('exams', 'Exam'), ('attempts', 'ExamAttempt')]:
+        SiteCounter.objects.create(name=name, value=apps.get_model('exam_user', model).objects.count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0006_exam_delivery_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AttemptActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour')], max_length=6)),
+                ('bucket', models.DateTimeField()),
+                ('started', models.PositiveIntegerField(default=0)),
+                ('submitted', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Attempt activity',
+                'ordering': ['resolution', 'bucket'],
+                'constraints': [models.UniqueConstraint(fields=('resolution', 'bucket'), name='attempt_activity_bucket')],
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-18 18:54
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_score_counts(apps, schema_editor):
+    ExamStatistics = apps.get_model('exam_user', 'ExamStatistics')
+    ExamAttempt = apps.get_model('exam_user', 'ExamAttempt')
+    for stats in ExamStatistics.objects.all():
+        counts = {}
+        completed = ExamAttempt.objects.filter(exam_id=stats.exam_id, is_completed=True).order_by()
+        for score, count in completed.values_list('score').annotate(count=Count('id')):
+            counts[round(score, 4)] = counts.get(round(score, 4), 0) + count
+        stats.score_counts = [[score, counts[score]] for score in sorted(counts)]
+        stats.save(update_fields=['score_counts'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0007_dashboard_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='examstatistics',
+            name='score_counts',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddIndex(
+            model_name='examattempt',
+            index=models.Index(condition=models.Q(('is_completed', True)), fields=['exam', '-score', 'end_time', 'id'], name='attempt_exam_score_idx'),
+        ),
+        migrations.RunPython(fill_score_counts, migrations.RunPython.noop),
+    ]
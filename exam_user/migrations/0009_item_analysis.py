@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-18 18:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0008_exam_leaderboard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionAnalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('presented_count', models.IntegerField(default=0)),
+                ('correct_count', models.IntegerField(default=0)),
+                ('option_counts', models.JSONField(default=list)),
+                ('rest_score_sum', models.FloatField(default=0.0)),
+                ('rest_score_sq_sum', models.FloatField(default=0.0)),
+                ('rest_score_correct_sum', models.FloatField(default=0.0)),
+                ('difficulty', models.FloatField(blank=True, null=True)),
+                ('discrimination', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Question analyses',
+            },
+        ),
+        migrations.AddField(
+            model_name='examattempt',
+            name='item_analyzed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='examattempt',
+            index=models.Index(condition=models.Q(('is_completed', True), ('item_analyzed', False)), fields=['exam', 'id'], name='attempt_item_pending_idx'),
+        ),
+        migrations.AddField(
+            model_name='questionanalysis',
+            name='question',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analysis', to='exam_user.question'),
+        ),
+    ]
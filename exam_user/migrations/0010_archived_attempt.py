@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 19:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0009_item_analysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt_id', models.CharField(max_length=10, unique=True)),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField(blank=True, null=True)),
+                ('score', models.FloatField(default=0.0)),
+                ('total_marks', models.FloatField(default=0.0)),
+                ('percentage', models.FloatField(default=0.0)),
+                ('payload', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('exam', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_attempts', to='exam_user.exam')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_attempts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['exam', '-score', 'end_time', 'id'], name='archived_exam_score_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 6.0 on 2026-10-18 19:45
+
+from django.db import migrations
+from django.db.models import Count, F, Q, Sum
+
+# As in ExamStatistics and exam_user.leaderboard when this was written
+HISTOGRAM_BUCKETS = 10
+SCORE_PRECISION = 4
+
+
+def rebuild_statistics(apps, schema_editor):
+    """Recount the statistics of every exam with completed attempts.
+
+    0002 created the table empty and 0008 filled score_counts only on the
+    rows that existed, so exams whose attempts were all completed before
+    then had no row, or a partial one, to add later submissions to.
+    """
+    Exam = apps.get_model('exam_user', 'Exam')
+    ExamAttempt = apps.get_model('exam_user', 'ExamAttempt')
+    ArchivedAttempt = apps.get_model('exam_user', 'ArchivedAttempt')
+    ExamStatistics = apps.get_model('exam_user', 'ExamStatistics')
+    exams = Exam.objects.filter(
+        Q(attempts__is_completed=True) | Q(archived_attempts__isnull=False)
+    ).distinct()
+    for exam in exams.iterator():
+        totals = dict.fromkeys(['attempts_count', 'pass_count', 'score_sum', 'score_sq_sum'], 0)
+        histogram = [0] * HISTOGRAM_BUCKETS
+        score_counts = {}
+        for completed in (
+            ExamAttempt.objects.filter(exam=exam, is_completed=True).order_by(),
+            ArchivedAttempt.objects.filter(exam=exam).order_by(),
+        ):
+            aggregates = completed.aggregate(
+                attempts_count=Count('id'),
+                pass_count=Count('id', filter=Q(percentage__gte=exam.pass_percentage)),
+                score_sum=Sum('score'),
+                score_sq_sum=Sum(F('score') * F('score')),
+            )
+            for name, value in aggregates.items():
+                totals[name] += value or 0
+            for percentage, count in completed.values_list('percentage').annotate(count=Count('id')):
+                bucket = min(max(int(percentage // (100 / HISTOGRAM_BUCKETS)), 0), HISTOGRAM_BUCKETS - 1)
+                histogram[bucket] += count
+            for score, count in completed.values_list('score').annotate(count=Count('id')):
+                key = round(score, SCORE_PRECISION)
+                score_counts[key] = score_counts.get(key, 0) + count
+        ExamStatistics.objects.update_or_create(
+            exam=exam,
+            defaults={
+                'attempts_count': totals['attempts_count'],
+                'pass_count': totals['pass_count'],
+                'score_sum': float(totals['score_sum']),
+                'score_sq_sum': float(totals['score_sq_sum']),
+                'histogram': histogram,
+                'score_counts': [[score, score_counts[score]] for score in sorted(score_counts)],
+            },
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0011_attempt_id_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_statistics, migrations.RunPython.noop),
+    ]
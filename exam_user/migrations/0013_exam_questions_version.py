@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam_user', '0012_backfill_exam_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exam',
+            name='questions_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
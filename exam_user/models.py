@@ -2,10 +2,9 @@ from django.db import models
 
 # Create your models here.
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.utils import timezone
-import random
-import string
+from .attempt_ids import generate_attempt_id
 
 class User(AbstractUser):
     is_admin = models.BooleanField(default=False)
@@ -29,6 +28,13 @@ class Category(models.Model):
         return self.name
 
 class Exam(models.Model):
+    DELIVERY_SINGLE_PAGE = 'single'
+    DELIVERY_PAGED = 'paged'
+    DELIVERY_MODE_CHOICES = [
+        (DELIVERY_SINGLE_PAGE, 'All questions on one page'),
+        (DELIVERY_PAGED, 'A few questions per page'),
+    ]
+
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='exams')
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
@@ -37,6 +43,9 @@ class Exam(models.Model):
     start_date = models.DateTimeField()
     end_date = models.DateTimeField()
     pass_percentage = models.FloatField(default=40.0)
+    delivery_mode = models.CharField(max_length=10, choices=DELIVERY_MODE_CHOICES, default=DELIVERY_SINGLE_PAGE)
+    questions_per_page = models.PositiveSmallIntegerField(default=10, help_text="Questions per page in paged mode")
+    questions_version = models.PositiveIntegerField(default=0, editable=False)  # see exam_user.question_bank
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -66,6 +75,7 @@ class Question(models.Model):
     correct_answer = models.CharField(max_length=1, choices=[('A', 'A'), ('B', 'B'), ('C', 'C'), ('D', 'D')])
     marks = models.FloatField(default=1.0)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # version of cached question fragments
 
     class Meta:
         ordering = ['id']
@@ -84,20 +94,52 @@ class ExamAttempt(models.Model):
     percentage = models.FloatField(default=0.0)
     is_completed = models.BooleanField(default=False)
     questions_data = models.JSONField(default=list)  # list of question IDs
+    item_analyzed = models.BooleanField(default=False)  # counted in QuestionAnalysis, see exam_user.item_analysis
 
     class Meta:
         ordering = ['-start_time']
+        indexes = [
+            models.Index(fields=['-start_time', '-id'], name='attempt_recent_idx'),
+            models.Index(fields=['exam', '-start_time', '-id'], name='attempt_exam_recent_idx'),
+            models.Index(
+                fields=['exam', '-score', 'end_time', 'id'], name='attempt_exam_score_idx',
+                condition=models.Q(is_completed=True),
+            ),
+            models.Index(
+                fields=['exam', 'id'], name='attempt_item_pending_idx',
+                condition=models.Q(is_completed=True, item_analyzed=False),
+            ),
+            models.Index(fields=['user', '-start_time'], name='attempt_user_recent_idx'),
+            models.Index(fields=['user', 'exam', 'is_completed'], name='attempt_user_exam_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'exam'],
+                condition=models.Q(is_completed=False),
+                name='one_open_attempt_per_user_exam',
+            ),
+        ]
 
     def save(self, *args, **kwargs):
-        if not self.attempt_id:  # Changed here
-            self.attempt_id = self.generate_exam_id()  # Changed here
-        super().save(*args, **kwargs)
+        if self.attempt_id:
+            return super().save(*args, **kwargs)
+        # Generated codes never repeat; the retry only covers a clash with a
+        # legacy random code, or with a block whose reservation was rolled
+        # back, and moves on to a freshly reserved block. Codes of archived
+        # attempts are skipped by the generator.
+        for _ in range(3):
+            self.attempt_id = self.generate_exam_id()
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if not ExamAttempt.objects.filter(attempt_id=self.attempt_id).exists():
+                    raise
+                generate_attempt_id.discard()
+        raise IntegrityError('Could not generate a unique attempt ID.')
 
     def generate_exam_id(self):
-        while True:
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            if not ExamAttempt.objects.filter(attempt_id=code).exists():  # Changed here
-                return code
+        return generate_attempt_id()
 
     def __str__(self):
         return f"{self.attempt_id} - {self.user.username}"  # Changed here
@@ -113,6 +155,210 @@ class Answer(models.Model):
         unique_together = ['attempt', 'question']
 
     def save(self, *args, **kwargs):
-        self.is_correct = self.selected_answer == self.question.correct_answer
-        self.marks_obtained = self.question.marks if self.is_correct else 0.0
-        super().save(*args, **kwargs)
\ No newline at end of file
+        self.grade(self.question)
+        super().save(*args, **kwargs)
+
+    def grade(self, question):
+        self.is_correct = self.selected_answer == question.correct_answer
+        self.marks_obtained = question.marks if self.is_correct else 0.0
+
+    @classmethod
+    def bulk_upsert(cls, attempt, questions, selections):
+        """Save many answers for one attempt in a single INSERT ... ON CONFLICT.
+
+        `questions` are the already loaded Question rows of the paper and
+        `selections` maps question id -> selected option letter. Grading is
+        done here against those rows, so no per-answer queries are issued.
+        """
+        valid = {choice for choice, _ in cls._meta.get_field('selected_answer').choices}
+        answers = []
+        for question in questions:
+            selected = selections.get(question.id)
+            if not isinstance(selected, str) or selected not in valid:
+                continue
+            answer = cls(attempt=attempt, question=question, selected_answer=selected)
+            answer.grade(question)
+            answers.append(answer)
+        if answers:
+            cls.objects.bulk_create(
+                answers,
+                update_conflicts=True,
+                unique_fields=['attempt', 'question'],
+                update_fields=['selected_answer', 'is_correct', 'marks_obtained'],
+            )
+        return answers
+
+
+class ArchivedAttempt(models.Model):
+    """A completed attempt moved out of ExamAttempt and Answer, see exam_user.archive.
+
+    The paper and the answers are kept in `payload` as one zlib-compressed
+    JSON document, so an archived attempt is a single row.
+    """
+    is_completed = True  # only completed attempts are archived
+
+    attempt_id = models.CharField(max_length=10, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_attempts')
+    exam = models.ForeignKey(Exam, on_delete=models.CASCADE, related_name='archived_attempts')
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField(null=True, blank=True)
+    score = models.FloatField(default=0.0)
+    total_marks = models.FloatField(default=0.0)
+    percentage = models.FloatField(default=0.0)
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['exam', '-score', 'end_time', 'id'], name='archived_exam_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.attempt_id} (archived)"
+
+
+class ExamStatistics(models.Model):
+    """Running totals over the completed attempts of one exam.
+
+    Kept up to date by submit_exam so reports never have to scan ExamAttempt.
+    `histogram` counts attempts per 10% band of percentage, the last band
+    also holding 100%. `score_counts` counts attempts per exact score, for
+    ranking.
+    """
+    HISTOGRAM_BUCKETS = 10
+
+    exam = models.OneToOneField(Exam, on_delete=models.CASCADE, related_name='statistics')
+    attempts_count = models.IntegerField(default=0)
+    pass_count = models.IntegerField(default=0)
+    score_sum = models.FloatField(default=0.0)
+    score_sq_sum = models.FloatField(default=0.0)
+    histogram = models.JSONField(default=list)
+    score_counts = models.JSONField(default=list)  # [[score, attempts], ...] by score, see exam_user.leaderboard
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Exam statistics'
+
+    def __str__(self):
+        return f"Statistics for {self.exam_id}"
+
+    @classmethod
+    def bucket_for(cls, percentage):
+        return min(max(int(percentage // (100 / cls.HISTOGRAM_BUCKETS)), 0), cls.HISTOGRAM_BUCKETS - 1)
+
+    @property
+    def mean_score(self):
+        return self.score_sum / self.attempts_count if self.attempts_count else 0.0
+
+    @property
+    def score_stddev(self):
+        if not self.attempts_count:
+            return 0.0
+        variance = self.score_sq_sum / self.attempts_count - self.mean_score ** 2
+        return max(variance, 0.0) ** 0.5
+
+    @property
+    def pass_rate(self):
+        return self.pass_count * 100 / self.attempts_count if self.attempts_count else 0.0
+
+    @property
+    def histogram_rows(self):
+        """(label, count, share of attempts) per band, for templates."""
+        width = 100 // self.HISTOGRAM_BUCKETS
+        counts = self.histogram or [0] * self.HISTOGRAM_BUCKETS
+        return [
+            (f'{i * width}-{(i + 1) * width}%', count,
+             count * 100 / self.attempts_count if self.attempts_count else 0)
+            for i, count in enumerate(counts)
+        ]
+
+
+class QuestionAnalysis(models.Model):
+    """Item statistics of one question over the completed attempts it appeared in.
+
+    The sums are kept so that newly completed attempts can be added without
+    rereading old ones, see exam_user.item_analysis. The rest score of an
+    attempt is its score without the marks obtained on this question.
+    """
+    OPTIONS = 'ABCD'
+    # Items outside these bounds are flagged for review
+    DIFFICULTY_RANGE = (0.2, 0.9)
+    MIN_DISCRIMINATION = 0.2
+
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, related_name='analysis')
+    presented_count = models.IntegerField(default=0)
+    correct_count = models.IntegerField(default=0)
+    option_counts = models.JSONField(default=list)  # answers per option, in OPTIONS order
+    rest_score_sum = models.FloatField(default=0.0)
+    rest_score_sq_sum = models.FloatField(default=0.0)
+    rest_score_correct_sum = models.FloatField(default=0.0)
+    difficulty = models.FloatField(null=True, blank=True)  # share of candidates answering correctly
+    discrimination = models.FloatField(null=True, blank=True)  # point-biserial against the rest score
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Question analyses'
+
+    def __str__(self):
+        return f"Analysis of {self.question_id}"
+
+    @property
+    def omitted_count(self):
+        return self.presented_count - sum(self.option_counts or [])
+
+    @property
+    def needs_review(self):
+        low, high = self.DIFFICULTY_RANGE
+        if self.difficulty is not None and not low <= self.difficulty <= high:
+            return True
+        return self.discrimination is not None and self.discrimination < self.MIN_DISCRIMINATION
+
+    def option_rows(self, correct_answer):
+        """(option, answers, share of candidates, is the key) per option, for templates."""
+        counts = self.option_counts or [0] * len(self.OPTIONS)
+        return [
+            (option, count, count * 100 / self.presented_count if self.presented_count else 0,
+             option == correct_answer)
+            for option, count in zip(self.OPTIONS, counts)
+        ]
+
+
+class Sequence(models.Model):
+    """A named counter handing out blocks of numbers, see exam_user.attempt_ids."""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)  # first number not reserved yet
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class SiteCounter(models.Model):
+    """A running total shown on the admin dashboard, see exam_user.counters."""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class AttemptActivity(models.Model):
+    """Attempts started and submitted in one minute or one hour, see exam_user.counters."""
+    RESOLUTION_MINUTE = 'minute'
+    RESOLUTION_HOUR = 'hour'
+    RESOLUTION_CHOICES = [(RESOLUTION_MINUTE, 'Minute'), (RESOLUTION_HOUR, 'Hour')]
+
+    resolution = models.CharField(max_length=6, choices=RESOLUTION_CHOICES)
+    bucket = models.DateTimeField()
+    started = models.PositiveIntegerField(default=0)
+    submitted = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['resolution', 'bucket']
+        verbose_name_plural = 'Attempt activity'
+        constraints = [
+            models.UniqueConstraint(fields=['resolution', 'bucket'], name='attempt_activity_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.resolution} {self.bucket:%Y-%m-%d %H:%M}: {self.started} started, {self.submitted} submitted"
@@ -0,0 +1,56 @@
+"""
+Cached per-exam question index for sampling papers.
+
+The cache may be local to each process, so an entry carries the
+Exam.questions_version it was built from. Saving or deleting a question
+bumps that version (a signal receiver here), and so do the bulk paths
+that bypass signals by calling invalidate_question_bank(). Every process
+then rebuilds its index at the next start instead of sampling deleted
+questions or old marks. start_exam has the exam loaded already, so a
+cache hit costs no query at all.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, Exam, Question
+
+
+def _cache_key(exam_id):
+    return f'exam_user:question_bank:{exam_id}'
+
+
+def get_question_bank(exam):
+    """Return the cached [(question_id, marks), ...] index of an exam."""
+    key = _cache_key(exam.id)
+    entry = cache.get(key)
+    if entry is not None and entry[0] == exam.questions_version:
+        return entry[1]
+    bank = list(Question.objects.filter(exam=exam).values_list('id', 'marks'))
+    cache.set(key, (exam.questions_version, bank), getattr(settings, 'QUESTION_BANK_CACHE_TIMEOUT', 300))
+    return bank
+
+
+def invalidate_question_bank(exam_id):
+    """Make every process rebuild the exam's index, after changes that send no signals."""
+    Exam.objects.filter(id=exam_id).update(questions_version=F('questions_version') + 1)
+    cache.delete(_cache_key(exam_id))
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def _question_changed(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or getattr(origin, 'model', type(origin)) in (Exam, Category):
+        return  # loading fixtures, or the exam itself is being deleted
+    invalidate_question_bank(instance.exam_id)
+
+
+def sample_paper(exam):
+    """Pick a random paper for an exam, returns (question ids, total marks)."""
+    bank = get_question_bank(exam)
+    selected = random.sample(bank, min(len(bank), exam.number_of_questions))
+    return [question_id for question_id, _ in selected], sum(marks for _, marks in selected)
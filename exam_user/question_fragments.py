@@ -0,0 +1,82 @@
+"""
+Pre-rendered take_exam.html markup for each question.
+
+The markup of a question is the same for every candidate except for which
+option is checked, so it is rendered once, split around the checked
+markers and cached by question id together with the question's updated_at
+version. A version mismatch (an edit made in another process) re-renders
+the question like a cache miss. Marking a candidate's saved answer is then
+a join of a few strings.
+"""
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Question
+
+OPTIONS = 'ABCD'
+
+# Fields used to decide whether a cached fragment can be reused
+VERSION_FIELDS = ('id', 'updated_at')
+
+_MARKER = '\x00checked:'
+_MARKERS = {letter: mark_safe(f'{_MARKER}{letter}\x00') for letter in OPTIONS}
+_SPLIT_RE = re.compile(f'{_MARKER}([{OPTIONS}])\x00')
+
+
+def _cache_key(question_id):
+    return f'exam_user:question_fragment:{question_id}'
+
+
+def _version(question):
+    return question.updated_at.isoformat()
+
+
+def render_question(question):
+    """Render a question and split it into [markup, letter, markup, letter, ..., markup]."""
+    html = render_to_string('exam_user/question_fragment.html', {'question': question, 'checked': _MARKERS})
+    return _SPLIT_RE.split(html)
+
+
+def get_fragments(questions):
+    """Return {question id: parts} for questions loaded with at least VERSION_FIELDS."""
+    keys = {question.id: _cache_key(question.id) for question in questions}
+    cached = cache.get_many(keys.values())
+
+    fragments, missing = {}, {}
+    for question in questions:
+        entry = cached.get(keys[question.id])
+        if entry and entry[0] == _version(question):
+            fragments[question.id] = entry[1]
+        else:
+            missing[question.id] = question
+
+    if missing:
+        rendered = {}
+        partial = {question_id for question_id, question in missing.items() if question.get_deferred_fields()}
+        if partial:
+            # Questions deleted since the caller loaded them drop out here
+            missing = {question_id: question for question_id, question in missing.items() if question_id not in partial}
+            missing.update(Question.objects.in_bulk(partial))
+        for question in missing.values():
+            parts = render_question(question)
+            fragments[question.id] = parts
+            rendered[keys[question.id]] = (_version(question), parts)
+        cache.set_many(rendered, getattr(settings, 'QUESTION_FRAGMENT_CACHE_TIMEOUT', 3600))
+    return fragments
+
+
+def apply_answer(parts, selected):
+    """The HTML of a fragment with the option `selected` (or none) checked."""
+    html = [parts[0]]
+    for index in range(1, len(parts), 2):
+        html.append('checked' if parts[index] == selected else '')
+        html.append(parts[index + 1])
+    return mark_safe(''.join(html))
+
+
+def invalidate_question_fragments(question_ids):
+    cache.delete_many([_cache_key(question_id) for question_id in question_ids])
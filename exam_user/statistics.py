@@ -0,0 +1,80 @@
+"""
+Maintenance of the per-exam ExamStatistics rows.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .leaderboard import merge_score_counts
+from .models import ArchivedAttempt, ExamAttempt, ExamStatistics
+
+
+def record_completed_attempt(attempt):
+    """Add one freshly completed attempt to its exam's statistics."""
+    return record_completed_attempts(attempt.exam, [(attempt.score, attempt.percentage)])
+
+
+def record_completed_attempts(exam, results):
+    """Add freshly completed attempts, given as (score, percentage) pairs, to an exam's statistics.
+
+    The attempts must already be saved as completed: an exam without a
+    statistics row yet is counted from scratch, them included.
+    """
+    if not results:
+        return None
+    histogram_increments = [0] * ExamStatistics.HISTOGRAM_BUCKETS
+    for _, percentage in results:
+        histogram_increments[ExamStatistics.bucket_for(percentage)] += 1
+    increments = dict(
+        attempts_count=F('attempts_count') + len(results),
+        pass_count=F('pass_count') + sum(percentage >= exam.pass_percentage for _, percentage in results),
+        score_sum=F('score_sum') + sum(score for score, _ in results),
+        score_sq_sum=F('score_sq_sum') + sum(score * score for score, _ in results),
+    )
+    with transaction.atomic():
+        # The UPDATE comes first so the row is write-locked before the
+        # histogram is read back and modified.
+        stats_rows = ExamStatistics.objects.filter(exam_id=exam.id)
+        if not stats_rows.update(**increments):
+            # Attempts completed before the row existed would be missed by
+            # counting from zero
+            return rebuild_exam_statistics(exam)
+        stats = ExamStatistics.objects.get(exam_id=exam.id)
+        histogram = stats.histogram or [0] * ExamStatistics.HISTOGRAM_BUCKETS
+        stats.histogram = [count + added for count, added in zip(histogram, histogram_increments)]
+        stats.score_counts = merge_score_counts(stats.score_counts, [(score, 1) for score, _ in results])
+        stats.save(update_fields=['histogram', 'score_counts', 'updated_at'])
+    return stats
+
+
+def rebuild_exam_statistics(exam):
+    """Recompute an exam's statistics from its completed attempts, archived ones included."""
+    totals = dict.fromkeys(['attempts_count', 'pass_count', 'score_sum', 'score_sq_sum'], 0)
+    histogram = [0] * ExamStatistics.HISTOGRAM_BUCKETS
+    scores = []
+    for completed in (
+        ExamAttempt.objects.filter(exam=exam, is_completed=True).order_by(),
+        ArchivedAttempt.objects.filter(exam=exam).order_by(),
+    ):
+        aggregates = completed.aggregate(
+            attempts_count=Count('id'),
+            pass_count=Count('id', filter=Q(percentage__gte=exam.pass_percentage)),
+            score_sum=Sum('score'),
+            score_sq_sum=Sum(F('score') * F('score')),
+        )
+        for name, value in aggregates.items():
+            totals[name] += value or 0
+        for percentage, count in completed.values_list('percentage').annotate(count=Count('id')):
+            histogram[ExamStatistics.bucket_for(percentage)] += count
+        scores.extend(completed.values_list('score').annotate(count=Count('id')))
+    stats, _ = ExamStatistics.objects.update_or_create(
+        exam=exam,
+        defaults={
+            'attempts_count': totals['attempts_count'],
+            'pass_count': totals['pass_count'],
+            'score_sum': float(totals['score_sum']),
+            'score_sq_sum': float(totals['score_sq_sum']),
+            'histogram': histogram,
+            'score_counts': merge_score_counts([], scores),
+        },
+    )
+    return stats
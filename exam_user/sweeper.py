@@ -0,0 +1,50 @@
+"""
+Closing of attempts whose time ran out without the candidate submitting.
+
+Expired attempts are graded and completed in batches, each in its own short
+transaction made of a few set-based UPDATEs, so a large end-of-session
+sweep never holds the database lock for long.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F
+from django.utils import timezone
+
+from .grading import attempt_score_expression, percentage_expression
+from .models import Exam, ExamAttempt
+from .counters import record_activity
+from .statistics import record_completed_attempts
+
+BATCH_SIZE = 500
+
+
+def close_expired_attempts(now=None, batch_size=BATCH_SIZE):
+    """Grade and complete every attempt past its exam's duration, return how many were closed."""
+    now = now or timezone.now()
+    closed = 0
+    exams = Exam.objects.filter(attempts__is_completed=False).distinct()
+    for exam in exams:
+        duration = timedelta(minutes=exam.duration_minutes)
+        expired = ExamAttempt.objects.filter(exam=exam, is_completed=False, start_time__lt=now - duration)
+        while True:
+            batch = list(expired.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not batch:
+                break
+            closed += _close_batch(exam, batch, duration)
+    return closed
+
+
+def _close_batch(exam, ids, duration):
+    with transaction.atomic():
+        attempts = ExamAttempt.objects.filter(id__in=ids, is_completed=False)
+        attempts.update(
+            score=attempt_score_expression(),
+            end_time=ExpressionWrapper(F('start_time') + duration, output_field=DateTimeField()),
+        )
+        attempts.update(percentage=percentage_expression())
+        results = list(attempts.values_list('score', 'percentage'))
+        attempts.update(is_completed=True)
+        record_completed_attempts(exam, results)
+        record_activity(submitted=len(results))
+    return len(results)
@@ -0,0 +1,130 @@
+"""
+Helpers for the per-view performance budget tests.
+
+build_fixture() creates a realistically sized data set with bulk inserts,
+and PerformanceBudgetMixin.assertWithinBudget() runs a request while
+counting queries and timing it. When a budget is exceeded the failure
+lists every executed statement, marks the ones over budget with "+", and
+names statements repeated with different parameters, which is how N+1
+queries show up.
+"""
+import random
+import re
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import Answer, Category, Exam, ExamAttempt, Question, User
+from .statistics import rebuild_exam_statistics
+
+CATEGORIES = 3
+EXAMS_PER_CATEGORY = 2
+QUESTIONS_PER_EXAM = 300
+PAPER_SIZE = 100
+ATTEMPTS = 200
+
+DEFAULT_LATENCY_BUDGET_MS = 1000
+
+_LITERALS = re.compile(r"'[^']*'|\b\d+(\.\d+)?\b")
+
+
+def build_fixture():
+    """Create categories, exams, a question bank, candidates and graded attempts."""
+    now = timezone.now()
+    categories = Category.objects.bulk_create([
+        Category(name=f'Category {i}', description='Fixture category') for i in range(CATEGORIES)
+    ])
+    exams = Exam.objects.bulk_create([
+        Exam(
+            category=category, name=f'Exam {category.id}-{i}', duration_minutes=60,
+            number_of_questions=PAPER_SIZE, start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+        )
+        for category in categories for i in range(EXAMS_PER_CATEGORY)
+    ])
+    questions = Question.objects.bulk_create([
+        Question(
+            exam=exam, question_text=f'Question {i} of {exam.name}', option_a='Alpha', option_b='Beta',
+            option_c='Gamma', option_d='Delta', correct_answer='ABCD'[i % 4], marks=1.0,
+        )
+        for exam in exams for i in range(QUESTIONS_PER_EXAM)
+    ])
+    users = User.objects.bulk_create([User(username=f'candidate{i}') for i in range(ATTEMPTS)])
+
+    bank = {}
+    for question in questions:
+        bank.setdefault(question.exam_id, []).append(question)
+    rng = random.Random(0)
+    attempts = []
+    papers = []
+    for i, user in enumerate(users):
+        exam = exams[i % len(exams)]
+        paper = rng.sample(bank[exam.id], PAPER_SIZE)
+        papers.append(paper)
+        attempts.append(ExamAttempt(
+            attempt_id=f'FX{i:06d}', user=user, exam=exam, questions_data=[q.id for q in paper],
+            total_marks=float(PAPER_SIZE), is_completed=True, end_time=now,
+        ))
+    attempts = ExamAttempt.objects.bulk_create(attempts)
+
+    answers = []
+    for attempt, paper in zip(attempts, papers):
+        for question in paper:
+            answer = Answer(attempt=attempt, question=question, selected_answer=rng.choice('ABCD'))
+            answer.grade(question)
+            answers.append(answer)
+    Answer.objects.bulk_create(answers, batch_size=2000)
+    scores = Counter()
+    for answer in answers:
+        scores[answer.attempt_id] += answer.marks_obtained
+    for attempt in attempts:
+        attempt.score = scores[attempt.id]
+        attempt.percentage = attempt.score * 100 / attempt.total_marks
+    ExamAttempt.objects.bulk_update(attempts, ['score', 'percentage'])
+    for exam in exams:
+        rebuild_exam_statistics(exam)
+    return {'categories': categories, 'exams': exams, 'questions': questions, 'users': users, 'attempts': attempts}
+
+
+def _normalize(sql):
+    return _LITERALS.sub('?', sql)
+
+
+def format_queries(queries, budget):
+    lines = []
+    for number, query in enumerate(queries, start=1):
+        marker = '+' if number > budget else ' '
+        lines.append(f'{marker} {number:3d}. {query["sql"]}')
+    repeated = [(sql, count) for sql, count in Counter(_normalize(q['sql']) for q in queries).items() if count > 1]
+    if repeated:
+        lines.append('')
+        lines.append('Repeated statements (possible N+1):')
+        lines.extend(f'  x{count}: {sql}' for sql, count in sorted(repeated, key=lambda item: -item[1]))
+    return '\n'.join(lines)
+
+
+class PerformanceBudgetMixin:
+    latency_budget_ms = DEFAULT_LATENCY_BUDGET_MS
+
+    def assertWithinBudget(self, max_queries, request, *args, latency_budget_ms=None, **kwargs):
+        """Call request(*args, **kwargs), e.g. self.client.get, and check its query and time budget."""
+        latency_budget_ms = latency_budget_ms or self.latency_budget_ms
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = request(*args, **kwargs)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+        queries = captured.captured_queries
+        if len(queries) > max_queries:
+            self.fail(
+                f'{args[0] if args else request}: {len(queries)} queries executed, budget is {max_queries}.\n'
+                + format_queries(queries, max_queries)
+            )
+        if elapsed_ms > latency_budget_ms:
+            self.fail(f'{args[0] if args else request}: took {elapsed_ms:.0f} ms, budget is {latency_budget_ms} ms.')
+        return response
@@ -1,3 +1,961 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+from datetime import timedelta
+from statistics import pstdev
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import auth_backends, sweeper
+from .archive import archive_attempts, unpack_payload
+from .exam_catalog import invalidate_catalog
+from .attempt_ids import AttemptIdGenerator, encode, permute
+from .counters import activity_series, get_counts, reconcile_counters, record_activity
+from .grading import regrade_exam, regrade_question
+from .item_analysis import analyze_exam
+from .leaderboard import Ranking, merge_score_counts, rank_score, top_attempts
+from .models import (
+    Answer, ArchivedAttempt, AttemptActivity, Category, Exam, ExamAttempt, ExamStatistics, Question, QuestionAnalysis,
+    Sequence, User,
+)
+from .question_bank import get_question_bank, invalidate_question_bank
+from .question_fragments import VERSION_FIELDS, get_fragments
+from .statistics import rebuild_exam_statistics, record_completed_attempt
+from .testing import PAPER_SIZE, PerformanceBudgetMixin, build_fixture
+
+# Maximum number of queries per view, session and user loading included.
+# Savepoints count, so a transaction costs two extra statements. Starting and
+# submitting also update the dashboard counters and activity buckets.
+QUERY_BUDGETS = {
+    'register': 4,
+    'login': 4,
+    'logout': 4,
+    'index': 2,
+    'category_detail': 3,
+    'start_exam': 11,
+    'take_exam': 5,
+    'autosave_answers': 5,
+    'submit_exam': 12,
+    'search_result': 5,
+}
+
+# Budgets of the form posts that differ from the GET of the same view
+POST_QUERY_BUDGETS = {
+    'register': 10,
+    'login': 9,
+    'take_exam': 6,
+}
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ExamUserPerformanceTests(PerformanceBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixture = build_fixture()
+        cls.exam = cls.fixture['exams'][0]
+        cls.category = cls.exam.category
+        cls.candidate = User.objects.create(username='budget', password=make_password('budget-pass'))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.candidate)
+
+    def start_attempt(self):
+        response = self.client.get(reverse('exam_user:start_exam', args=[self.exam.id]))
+        return ExamAttempt.objects.get(user=self.candidate, exam=self.exam, is_completed=False), response
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in get_resolver('exam_user.urls').url_patterns}
+        self.assertEqual(names, set(QUERY_BUDGETS))
+
+    def test_register(self):
+        self.client.logout()
+        self.assertWithinBudget(QUERY_BUDGETS['register'], self.client.get, reverse('exam_user:register'))
+        response = self.assertWithinBudget(POST_QUERY_BUDGETS['register'], self.client.post, reverse('exam_user:register'), {
+            'username': 'newcomer', 'password': 'newcomer-pass', 'confirm_password': 'newcomer-pass',
+        })
+        self.assertRedirects(response, reverse('exam_user:index'))
+
+    def test_login(self):
+        self.client.logout()
+        self.assertWithinBudget(QUERY_BUDGETS['login'], self.client.get, reverse('exam_user:login'))
+        response = self.assertWithinBudget(POST_QUERY_BUDGETS['login'], self.client.post, reverse('exam_user:login'), {
+            'username': 'budget', 'password': 'budget-pass',
+        })
+        self.assertRedirects(response, reverse('exam_user:index'))
+
+    def test_logout(self):
+        self.assertWithinBudget(QUERY_BUDGETS['logout'], self.client.get, reverse('exam_user:logout'))
+
+    def test_index(self):
+        url = reverse('exam_user:index')
+        self.assertWithinBudget(QUERY_BUDGETS['index'] + 1, self.client.get, url)
+        self.assertWithinBudget(QUERY_BUDGETS['index'], self.client.get, url)
+
+    def test_category_detail(self):
+        url = reverse('exam_user:category_detail', args=[self.category.id])
+        # A cold cache also loads the category and its exams
+        self.assertWithinBudget(QUERY_BUDGETS['category_detail'] + 2, self.client.get, url)
+        response = self.assertWithinBudget(QUERY_BUDGETS['category_detail'], self.client.get, url)
+        self.assertContains(response, self.exam.name)
+
+    def test_category_detail_follows_exam_windows(self):
+        url = reverse('exam_user:category_detail', args=[self.category.id])
+        opening = Exam.objects.create(
+            category=self.category, name='Opens shortly', duration_minutes=30, number_of_questions=10,
+            start_date=timezone.now() + timedelta(seconds=1), end_date=timezone.now() + timedelta(days=1),
+        )
+        self.assertNotContains(self.client.get(url), opening.name)
+        cached = cache.get(f'exam_user:category_exams:{self.category.id}')
+        self.assertEqual(cached['valid_until'], opening.start_date)
+        with mock.patch('exam_user.exam_catalog.timezone.now', return_value=opening.start_date):
+            self.assertContains(self.client.get(url), opening.name)
+
+    def test_start_exam(self):
+        self.assertWithinBudget(
+            QUERY_BUDGETS['start_exam'], self.client.get, reverse('exam_user:start_exam', args=[self.exam.id])
+        )
+        attempt = ExamAttempt.objects.get(user=self.candidate, exam=self.exam)
+        self.assertEqual(len(attempt.questions_data), PAPER_SIZE)
+
+    def test_take_exam(self):
+        attempt, _ = self.start_attempt()
+        url = reverse('exam_user:take_exam', args=[attempt.attempt_id])
+        # The first render of a paper also loads its questions in full
+        self.assertWithinBudget(QUERY_BUDGETS['take_exam'] + 1, self.client.get, url)
+        self.assertWithinBudget(QUERY_BUDGETS['take_exam'], self.client.get, url)
+        answers = {f'question_{question_id}': 'A' for question_id in attempt.questions_data}
+        response = self.assertWithinBudget(POST_QUERY_BUDGETS['take_exam'], self.client.post, url, answers)
+        self.assertEqual(attempt.answers.count(), PAPER_SIZE)
+        self.assertContains(response, 'value="A"\n                       checked>', count=PAPER_SIZE)
+
+    def test_take_exam_rerenders_edited_questions(self):
+        attempt, _ = self.start_attempt()
+        url = reverse('exam_user:take_exam', args=[attempt.attempt_id])
+        self.client.get(url)
+        question = Question.objects.get(id=attempt.questions_data[0])
+        question.option_a = 'Edited option'
+        question.save()
+        self.assertContains(self.client.get(url), 'Edited option')
+
+    def test_take_exam_paged(self):
+        Exam.objects.filter(pk=self.exam.pk).update(delivery_mode=Exam.DELIVERY_PAGED, questions_per_page=10)
+        attempt, _ = self.start_attempt()
+        url = reverse('exam_user:take_exam', args=[attempt.attempt_id])
+        page_ids = sorted(attempt.questions_data)[10:20]
+
+        response = self.assertWithinBudget(QUERY_BUDGETS['take_exam'] + 1, self.client.get, url, {'page': 2})
+        self.assertEqual([question.id for question, _ in response.context['paper']], page_ids)
+        self.assertContains(response, 'Question 11 of 100')
+
+        response = self.client.get(url, {'page': 3, 'partial': 1})
+        self.assertTemplateNotUsed(response, 'exam_user/take_exam.html')
+        self.assertContains(response, 'name="goto" value="4"')
+
+        answers = {f'question_{question_id}': 'C' for question_id in attempt.questions_data}
+        response = self.assertWithinBudget(
+            POST_QUERY_BUDGETS['take_exam'], self.client.post, url, dict(answers, page=2, goto=3)
+        )
+        self.assertRedirects(response, f'{url}?page=3')
+        self.assertEqual(sorted(attempt.answers.values_list('question_id', flat=True)), page_ids)
+
+    def test_autosave_answers(self):
+        attempt, _ = self.start_attempt()
+        body = json.dumps({'answers': {str(question_id): 'B' for question_id in attempt.questions_data[:5]}})
+        response = self.assertWithinBudget(
+            QUERY_BUDGETS['autosave_answers'], self.client.post,
+            reverse('exam_user:autosave_answers', args=[attempt.attempt_id]), body, content_type='application/json',
+        )
+        self.assertEqual(response.json()['saved'], 5)
+
+    def test_autosave_rejects_invalid_requests(self):
+        attempt, _ = self.start_attempt()
+        url = reverse('exam_user:autosave_answers', args=[attempt.attempt_id])
+        question_id = str(attempt.questions_data[0])
+        foreign_id = str(Question.objects.exclude(id__in=attempt.questions_data).values_list('id', flat=True)[0])
+        for body in (
+            'not json', '[]', '{"answers": ["A"]}', '{"answers": {"x": "A"}}',
+            json.dumps({'answers': {foreign_id: 'A'}}),
+            json.dumps({'answers': {question_id: ['A']}}),
+            json.dumps({'answers': {question_id: 'Z'}}),
+            json.dumps({'answers': {question_id: None}}),
+            json.dumps({'answers': {question_id: 1}}),
+        ):
+            with self.subTest(body=body):
+                response = self.client.post(url, body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+        self.assertFalse(attempt.answers.exists())
+
+        ExamAttempt.objects.filter(id=attempt.id).update(
+            start_time=timezone.now() - timedelta(minutes=self.exam.duration_minutes + 1)
+        )
+        response = self.client.post(url, json.dumps({'answers': {question_id: 'A'}}), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['redirect'], reverse('exam_user:submit_exam', args=[attempt.attempt_id]))
+        self.assertFalse(attempt.answers.exists())
+
+    def test_submit_exam(self):
+        attempt, _ = self.start_attempt()
+        self.client.post(
+            reverse('exam_user:take_exam', args=[attempt.attempt_id]),
+            {f'question_{question_id}': 'A' for question_id in attempt.questions_data},
+        )
+        self.assertWithinBudget(
+            QUERY_BUDGETS['submit_exam'], self.client.get, reverse('exam_user:submit_exam', args=[attempt.attempt_id])
+        )
+
+    def test_search_result(self):
+        attempt, _ = self.start_attempt()
+        self.client.get(reverse('exam_user:submit_exam', args=[attempt.attempt_id]))
+        self.assertWithinBudget(
+            QUERY_BUDGETS['search_result'], self.client.get, reverse('exam_user:search_result'),
+            {'exam_id': attempt.attempt_id},
+        )
+
+
+class DashboardCounterTests(TestCase):
+    def test_counters_follow_creates_and_cascading_deletes(self):
+        category = Category.objects.create(name='Counted')
+        now = timezone.now()
+        exam = Exam.objects.create(
+            category=category, name='Counted exam', duration_minutes=30, number_of_questions=5,
+            start_date=now, end_date=now + timedelta(hours=1),
+        )
+        for i in range(3):
+            ExamAttempt.objects.create(user=User.objects.create(username=f'counted{i}'), exam=exam)
+        self.assertEqual(get_counts(), {'categories': 1, 'exams': 1, 'attempts': 3})
+
+        with self.assertNumQueries(11):
+            # The cascade, a COUNT of live and of archived attempts and two
+            # counter UPDATEs, however many attempts there are
+            exam.delete()
+        self.assertEqual(get_counts(), {'categories': 1, 'exams': 0, 'attempts': 0})
+        category.delete()
+        self.assertEqual(get_counts(), {'categories': 0, 'exams': 0, 'attempts': 0})
+
+    def test_reconcile_counters(self):
+        Category.objects.bulk_create([Category(name='Bulk 1'), Category(name='Bulk 2')])
+        self.assertEqual(get_counts()['categories'], 0)
+        self.assertEqual(reconcile_counters(), {'categories': (0, 2)})
+        self.assertEqual(get_counts()['categories'], 2)
+
+    def test_activity_series(self):
+        now = timezone.now().replace(minute=30)
+        record_activity(started=2, when=now - timedelta(minutes=1))
+        record_activity(started=1, when=now)
+        record_activity(submitted=1, when=now)
+
+        minutes = activity_series(AttemptActivity.RESOLUTION_MINUTE, 3, now=now)
+        self.assertEqual([(started, submitted) for _, started, submitted in minutes], [(0, 0), (2, 0), (1, 1)])
+        hours = activity_series(AttemptActivity.RESOLUTION_HOUR, 2, now=now)
+        self.assertEqual([(started, submitted) for _, started, submitted in hours], [(0, 0), (3, 1)])
+
+
+class LeaderboardTests(TestCase):
+    def test_rank_score(self):
+        score_counts = merge_score_counts([], [(5.0, 2), (7.5, 1), (0.1 + 0.2, 1)])
+        self.assertEqual(score_counts, [[0.3, 1], [5.0, 2], [7.5, 1]])
+        self.assertEqual(rank_score(score_counts, 7.5), Ranking(rank=1, total=4, percentile=75.0))
+        self.assertEqual(rank_score(score_counts, 5.0), Ranking(rank=2, total=4, percentile=25.0))
+        self.assertEqual(rank_score(score_counts, 0.3), Ranking(rank=4, total=4, percentile=0.0))
+        self.assertIsNone(rank_score([], 1.0))
+
+    def test_results_show_rank(self):
+        build_fixture()
+        attempt = ExamAttempt.objects.filter(is_completed=True).order_by('-score').first()
+        self.client.force_login(attempt.user)
+        response = self.client.get(reverse('exam_user:search_result'), {'exam_id': attempt.attempt_id})
+        ranking = response.context['ranking']
+        self.assertEqual(ranking.rank, 1)
+        self.assertEqual(ranking.total, ExamAttempt.objects.filter(exam=attempt.exam, is_completed=True).count())
+        self.assertContains(response, f'of {ranking.total}')
+
+
+class ItemAnalysisTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        fixture = build_fixture()
+        cls.exam = fixture['exams'][0]
+        # Leave some questions blank
+        attempt = ExamAttempt.objects.filter(exam=cls.exam).first()
+        Answer.objects.filter(id__in=list(attempt.answers.values_list('id', flat=True)[:30])).delete()
+
+    def expected(self, question):
+        """Item statistics of one question, computed attempt by attempt."""
+        answers = {
+            answer.attempt_id: answer for answer in
+            Answer.objects.filter(question=question, attempt__is_completed=True)
+        }
+        correct, rest, options = [], [], [0, 0, 0, 0]
+        for attempt in ExamAttempt.objects.filter(exam=self.exam, is_completed=True):
+            if question.id not in attempt.questions_data:
+                continue
+            answer = answers.get(attempt.id)
+            correct.append(bool(answer and answer.is_correct))
+            rest.append(attempt.score - (answer.marks_obtained if answer else 0.0))
+            if answer:
+                options['ABCD'.index(answer.selected_answer)] += 1
+        if not correct:
+            return 0, None, None, options
+        p = sum(correct) / len(correct)
+        right = [score for score, ok in zip(rest, correct) if ok]
+        wrong = [score for score, ok in zip(rest, correct) if not ok]
+        if not right or not wrong:
+            return len(correct), p, None, options
+        r = (sum(right) / len(right) - sum(wrong) / len(wrong)) / pstdev(rest) * (p * (1 - p)) ** 0.5
+        return len(correct), p, r, options
+
+    def assertAlmostEqualOrNone(self, value, expected):
+        if expected is None:
+            self.assertIsNone(value)
+        else:
+            self.assertAlmostEqual(value, expected)
+
+    def assertMatchesAttempts(self):
+        for analysis in QuestionAnalysis.objects.filter(question__exam=self.exam).select_related('question'):
+            presented, difficulty, discrimination, options = self.expected(analysis.question)
+            self.assertEqual(analysis.presented_count, presented)
+            self.assertAlmostEqualOrNone(analysis.difficulty, difficulty)
+            self.assertAlmostEqualOrNone(analysis.discrimination, discrimination)
+            self.assertEqual(analysis.option_counts, options)
+            self.assertEqual(analysis.omitted_count, presented - sum(options))
+
+    def test_full_analysis(self):
+        with mock.patch('exam_user.item_analysis.CHUNK_SIZE', 7):
+            added = analyze_exam(self.exam)
+        self.assertEqual(added, ExamAttempt.objects.filter(exam=self.exam, is_completed=True).count())
+        self.assertEqual(QuestionAnalysis.objects.filter(question__exam=self.exam).count(), self.exam.questions.count())
+        self.assertMatchesAttempts()
+        self.assertEqual(analyze_exam(self.exam), 0)
+
+    def test_incremental_analysis(self):
+        later = list(ExamAttempt.objects.filter(exam=self.exam).values_list('id', flat=True)[::3])
+        ExamAttempt.objects.filter(id__in=later).update(is_completed=False)
+        analyze_exam(self.exam)
+        ExamAttempt.objects.filter(id__in=later).update(is_completed=True)
+        self.assertEqual(analyze_exam(self.exam), len(later))
+        self.assertMatchesAttempts()
+
+
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        fixture = build_fixture()
+        cls.exam, cls.other_exam = fixture['exams'][:2]
+        Exam.objects.filter(id=cls.exam.id).update(
+            end_date=timezone.now() - timedelta(days=400), start_date=timezone.now() - timedelta(days=401)
+        )
+
+    def test_archive_moves_attempts_and_answers(self):
+        attempt = ExamAttempt.objects.filter(exam=self.exam).first()
+        answers = sorted(attempt.answers.values_list('question_id', 'selected_answer', 'is_correct', 'marks_obtained'))
+        attempts = ExamAttempt.objects.filter(exam=self.exam).count()
+        other_attempts = ExamAttempt.objects.filter(exam=self.other_exam).count()
+        reconcile_counters()  # the fixture is bulk inserted
+        counts = get_counts()
+        statistics = ExamStatistics.objects.get(exam=self.exam)
+
+        self.assertEqual(archive_attempts(), {self.exam.id: attempts})
+        self.assertFalse(ExamAttempt.objects.filter(exam=self.exam).exists())
+        self.assertFalse(Answer.objects.filter(attempt__exam=self.exam).exists())
+        self.assertEqual(ExamAttempt.objects.filter(exam=self.other_exam).count(), other_attempts)
+        self.assertEqual(get_counts(), counts)
+        self.assertEqual(reconcile_counters(), {})
+
+        archived = ArchivedAttempt.objects.get(attempt_id=attempt.attempt_id)
+        self.assertEqual((archived.score, archived.end_time), (attempt.score, attempt.end_time))
+        payload = unpack_payload(archived.payload)
+        self.assertEqual(payload['questions'], attempt.questions_data)
+        self.assertEqual(sorted(map(tuple, payload['answers'])), answers)
+
+        rebuilt = rebuild_exam_statistics(self.exam)
+        self.assertEqual(
+            (rebuilt.attempts_count, rebuilt.score_sum, rebuilt.histogram, rebuilt.score_counts),
+            (statistics.attempts_count, statistics.score_sum, statistics.histogram, statistics.score_counts),
+        )
+        self.assertEqual(len(top_attempts(self.exam, 10)), 10)
+        self.assertEqual(QuestionAnalysis.objects.filter(question__exam=self.exam).count(), self.exam.questions.count())
+
+    def test_search_result_finds_archived_attempts(self):
+        archive_attempts()
+        archived = ArchivedAttempt.objects.order_by('-score').first()
+        self.client.force_login(archived.user)
+        response = self.client.get(reverse('exam_user:search_result'), {'exam_id': archived.attempt_id})
+        self.assertEqual(response.context['attempt'], archived)
+        self.assertEqual(response.context['ranking'].rank, 1)
+        self.assertContains(response, archived.attempt_id)
+
+    def test_reopened_exam_cannot_be_retaken(self):
+        archive_attempts()
+        Exam.objects.filter(id=self.exam.id).update(
+            start_date=timezone.now() - timedelta(days=1), end_date=timezone.now() + timedelta(days=1)
+        )
+        invalidate_catalog(self.exam.category_id)
+        archived = ArchivedAttempt.objects.filter(exam=self.exam).first()
+        self.client.force_login(archived.user)
+
+        response = self.client.get(reverse('exam_user:category_detail', args=[self.exam.category_id]))
+        self.assertIn(self.exam.id, response.context['completed_exam_ids'])
+        response = self.client.get(reverse('exam_user:start_exam', args=[self.exam.id]))
+        self.assertRedirects(response, reverse('exam_user:index'), fetch_redirect_response=False)
+        self.assertFalse(ExamAttempt.objects.filter(exam=self.exam, user=archived.user).exists())
+
+
+class AttemptIdTests(TestCase):
+    def test_generators_sharing_the_sequence_never_repeat(self):
+        first, second = AttemptIdGenerator(block_size=10), AttemptIdGenerator(block_size=10)
+        codes = [generate() for _ in range(1000) for generate in (first, second)]
+        self.assertEqual(len(set(codes)), 2000)
+        self.assertTrue(all(len(code) == 8 and code.isalnum() for code in codes))
+
+    def test_clash_moves_to_a_fresh_block(self):
+        now = timezone.now()
+        exam = Exam.objects.create(
+            category=Category.objects.create(name='Clash'), name='Clash', duration_minutes=30,
+            number_of_questions=5, start_date=now, end_date=now + timedelta(hours=1),
+        )
+        with mock.patch('exam_user.models.generate_attempt_id', AttemptIdGenerator()):
+            taken = ExamAttempt.objects.create(user=User.objects.create(username='first'), exam=exam)
+        # As if that reservation had been rolled back: the next block starts at the same number
+        Sequence.objects.filter(name='attempt_id').update(value=0)
+        with mock.patch('exam_user.models.generate_attempt_id', AttemptIdGenerator()):
+            attempt = ExamAttempt.objects.create(user=User.objects.create(username='second'), exam=exam)
+        self.assertNotEqual(attempt.attempt_id, taken.attempt_id)
+
+    def test_codes_of_archived_attempts_are_skipped(self):
+        now = timezone.now()
+        exam = Exam.objects.create(
+            category=Category.objects.create(name='Archived'), name='Archived', duration_minutes=30,
+            number_of_questions=5, start_date=now, end_date=now + timedelta(hours=1),
+        )
+        # Legacy codes that happen to be the next two the sequence gives
+        user = User.objects.create(username='legacy')
+        ArchivedAttempt.objects.bulk_create([
+            ArchivedAttempt(attempt_id=encode(permute(number)), user=user, exam=exam, start_time=now, payload=b'')
+            for number in (0, 1)
+        ])
+        codes = [AttemptIdGenerator(block_size=5)() for _ in range(3)]
+        self.assertEqual(codes[0], encode(permute(2)))
+        self.assertEqual(codes[1:], [encode(permute(5)), encode(permute(10))])
+
+
+class QuestionBankTests(TestCase):
+    def test_edits_from_other_processes_rebuild_the_index(self):
+        now = timezone.now()
+        exam = Exam.objects.create(
+            category=Category.objects.create(name='Bank'), name='Bank', duration_minutes=30,
+            number_of_questions=2, start_date=now, end_date=now + timedelta(hours=1),
+        )
+        first, second, third = (
+            Question.objects.create(exam=exam, question_text=f'Q{i}', correct_answer='A') for i in range(3)
+        )
+        exam.refresh_from_db()
+        self.assertEqual(get_question_bank(exam), [(first.id, 1.0), (second.id, 1.0), (third.id, 1.0)])
+        with self.assertNumQueries(0):
+            get_question_bank(exam)
+
+        # The versions other processes see, with this process's cache kept
+        with mock.patch('exam_user.question_bank.cache.delete'):
+            third.delete()
+            second.marks = 2.0
+            second.save()
+        exam.refresh_from_db()
+        self.assertEqual(get_question_bank(exam), [(first.id, 1.0), (second.id, 2.0)])
+
+        Question.objects.bulk_create([Question(exam=exam, question_text='Imported', correct_answer='A')])
+        invalidate_question_bank(exam.id)
+        exam.refresh_from_db()
+        self.assertEqual(len(get_question_bank(exam)), 3)
+
+
+class RegradeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.exam = Exam.objects.create(
+            category=Category.objects.create(name='Regrade'), name='Regrade', duration_minutes=30,
+            number_of_questions=2, start_date=now, end_date=now + timedelta(hours=1), pass_percentage=50.0,
+        )
+        cls.first, cls.second = Question.objects.bulk_create([
+            Question(exam=cls.exam, question_text=f'Q{i}', correct_answer='A', marks=1.0) for i in range(2)
+        ])
+        # Both got the first question; only `cls.right` the second
+        cls.right, cls.wrong = (
+            ExamAttempt.objects.create(
+                user=User.objects.create(username=name), exam=cls.exam, is_completed=True, end_time=now,
+                questions_data=[cls.first.id, cls.second.id], total_marks=2.0,
+            )
+            for name in ('right', 'wrong')
+        )
+        for attempt, second_answer in ((cls.right, 'A'), (cls.wrong, 'B')):
+            Answer.objects.create(attempt=attempt, question=cls.first, selected_answer='A')
+            Answer.objects.create(attempt=attempt, question=cls.second, selected_answer=second_answer)
+        regrade_exam(cls.exam)
+
+    def assertGraded(self, attempt, score, total_marks, percentage):
+        attempt.refresh_from_db()
+        self.assertEqual((attempt.score, attempt.total_marks), (score, total_marks))
+        self.assertAlmostEqual(attempt.percentage, percentage)
+
+    def test_answer_key_change(self):
+        self.second.correct_answer = 'B'
+        self.second.save()
+        regrade_question(self.second)
+
+        answer = Answer.objects.get(attempt=self.wrong, question=self.second)
+        self.assertEqual((answer.is_correct, answer.marks_obtained), (True, 1.0))
+        self.assertFalse(Answer.objects.get(attempt=self.right, question=self.second).is_correct)
+        self.assertGraded(self.right, 1.0, 2.0, 50.0)
+        self.assertGraded(self.wrong, 2.0, 2.0, 100.0)
+        statistics = ExamStatistics.objects.get(exam=self.exam)
+        self.assertEqual((statistics.attempts_count, statistics.pass_count, statistics.score_sum), (2, 2, 3.0))
+        self.assertEqual(statistics.score_counts, [[1.0, 1], [2.0, 1]])
+
+    def test_marks_change(self):
+        self.second.marks = 3.0
+        self.second.save()
+        regrade_question(self.second, marks_changed=True)
+
+        self.assertEqual(Answer.objects.get(attempt=self.right, question=self.second).marks_obtained, 3.0)
+        self.assertGraded(self.right, 4.0, 4.0, 100.0)
+        self.assertGraded(self.wrong, 1.0, 4.0, 25.0)
+        statistics = ExamStatistics.objects.get(exam=self.exam)
+        self.assertEqual((statistics.attempts_count, statistics.pass_count, statistics.score_sum), (2, 1, 5.0))
+        self.assertEqual(statistics.score_counts, [[1.0, 1], [4.0, 1]])
+
+    def test_failed_regrade_changes_nothing(self):
+        self.second.correct_answer = 'B'
+        self.second.save()
+        with mock.patch('exam_user.grading.rebuild_exam_statistics', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                regrade_question(self.second)
+        self.assertTrue(Answer.objects.get(attempt=self.right, question=self.second).is_correct)
+        self.assertGraded(self.wrong, 1.0, 2.0, 50.0)
+
+
+class SweeperTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.exam = Exam.objects.create(
+            category=Category.objects.create(name='Sweep'), name='Sweep', duration_minutes=30,
+            number_of_questions=2, start_date=now - timedelta(hours=2), end_date=now + timedelta(hours=1),
+            pass_percentage=50.0,
+        )
+        cls.first, cls.second = Question.objects.bulk_create([
+            Question(exam=cls.exam, question_text=f'Q{i}', correct_answer='A', marks=1.0) for i in range(2)
+        ])
+        cls.expired = []
+        for i in range(5):
+            attempt = ExamAttempt.objects.create(
+                user=User.objects.create(username=f'expired{i}'), exam=cls.exam,
+                questions_data=[cls.first.id, cls.second.id], total_marks=2.0,
+            )
+            # One, two or no correct answers
+            Answer.objects.create(attempt=attempt, question=cls.first, selected_answer='A' if i % 3 else 'B')
+            if i % 3 == 2:
+                Answer.objects.create(attempt=attempt, question=cls.second, selected_answer='A')
+            cls.expired.append(attempt)
+        cls.current = ExamAttempt.objects.create(
+            user=User.objects.create(username='current'), exam=cls.exam,
+            questions_data=[cls.first.id, cls.second.id], total_marks=2.0,
+        )
+        for minutes, attempt in enumerate(cls.expired, start=31):
+            ExamAttempt.objects.filter(id=attempt.id).update(start_time=now - timedelta(minutes=minutes))
+        ExamAttempt.objects.filter(id=cls.current.id).update(start_time=now - timedelta(minutes=10))
+
+    def test_closes_expired_attempts_in_batches(self):
+        with mock.patch('exam_user.sweeper._close_batch', wraps=sweeper._close_batch) as close_batch:
+            self.assertEqual(sweeper.close_expired_attempts(batch_size=2), 5)
+        self.assertEqual([len(call.args[1]) for call in close_batch.call_args_list], [2, 2, 1])
+        self.assertEqual(sweeper.close_expired_attempts(batch_size=2), 0)
+
+        for i, attempt in enumerate(self.expired):
+            attempt.refresh_from_db()
+            score = {0: 0.0, 1: 1.0, 2: 2.0}[i % 3]
+            self.assertTrue(attempt.is_completed)
+            self.assertEqual(attempt.end_time, attempt.start_time + timedelta(minutes=30))
+            self.assertEqual((attempt.score, attempt.percentage), (score, score * 50.0))
+
+        self.current.refresh_from_db()
+        self.assertFalse(self.current.is_completed)
+        self.assertIsNone(self.current.end_time)
+
+    def test_records_statistics_and_activity(self):
+        sweeper.close_expired_attempts()
+        statistics = ExamStatistics.objects.get(exam=self.exam)
+        # Scores 0, 1, 2, 0, 1 out of 2, passed from 50%
+        self.assertEqual((statistics.attempts_count, statistics.pass_count, statistics.score_sum), (5, 3, 4.0))
+        self.assertEqual(statistics.score_counts, [[0.0, 2], [1.0, 2], [2.0, 1]])
+        rebuilt = rebuild_exam_statistics(self.exam)
+        self.assertEqual((rebuilt.score_sum, rebuilt.histogram), (statistics.score_sum, statistics.histogram))
+        [(_, _, submitted)] = activity_series(AttemptActivity.RESOLUTION_HOUR, 1)
+        self.assertEqual(submitted, 5)
+
+
+CACHED_BACKEND = 'exam_user.auth_backends.CachedModelBackend'
+
+
+@override_settings(
+    AUTHENTICATION_BACKENDS=[CACHED_BACKEND, 'django.contrib.auth.backends.ModelBackend'],
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    USER_CACHE_TIMEOUT=30,
+)
+class UserCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.candidate = User.objects.create(username='cached', password=make_password('secret'))
+        cls.admin = User.objects.create(username='proctor', is_admin=True)
+        now = timezone.now()
+        exam = Exam.objects.create(
+            category=Category.objects.create(name='Cache'), name='Cache', duration_minutes=30,
+            number_of_questions=1, start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1),
+        )
+        cls.attempt = ExamAttempt.objects.create(
+            user=cls.candidate, exam=exam, is_completed=True, end_time=now, total_marks=1.0,
+        )
+
+    def setUp(self):
+        auth_backends._users.clear()
+        self.addCleanup(auth_backends._users.clear)
+        self.backend = auth_backends.CachedModelBackend()
+
+    def test_candidates_are_served_from_the_cache(self):
+        first = self.backend.get_user(self.candidate.pk)
+        with self.assertNumQueries(0):
+            second = self.backend.get_user(self.candidate.pk)
+        self.assertEqual(second, self.candidate)
+        # Each request gets its own copy to modify
+        self.assertIsNot(second, first)
+
+    def test_privileged_users_are_not_cached(self):
+        staff = User.objects.create(username='staff', is_staff=True)
+        for user in (self.admin, staff):
+            self.backend.get_user(user.pk)
+            with self.assertNumQueries(1):
+                self.backend.get_user(user.pk)
+
+    def test_saving_the_user_drops_the_entry(self):
+        self.backend.get_user(self.candidate.pk)
+        user = User.objects.get(pk=self.candidate.pk)
+        user.set_password('changed')
+        user.save()
+        with self.assertNumQueries(1):
+            cached = self.backend.get_user(self.candidate.pk)
+        self.assertTrue(cached.check_password('changed'))
+
+        self.backend.get_user(self.candidate.pk)
+        user.delete()
+        self.assertIsNone(self.backend.get_user(self.candidate.pk))
+
+    def test_entries_expire_after_the_timeout(self):
+        with mock.patch('exam_user.auth_backends.time.monotonic', return_value=1000.0) as monotonic:
+            self.backend.get_user(self.candidate.pk)
+            # Changed by another process, whose save cannot reach this cache
+            User.objects.filter(pk=self.candidate.pk).update(first_name='Renamed')
+            monotonic.return_value = 1029.0
+            with self.assertNumQueries(0):
+                self.assertEqual(self.backend.get_user(self.candidate.pk).first_name, '')
+            monotonic.return_value = 1030.0
+            with self.assertNumQueries(1):
+                self.assertEqual(self.backend.get_user(self.candidate.pk).first_name, 'Renamed')
+
+    def test_password_change_ends_other_sessions(self):
+        for engine in ('db', 'cached_db', 'signed_cookies'):
+            with self.subTest(engine=engine), self.settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{engine}'):
+                self.client.post(reverse('exam_user:login'), {'username': 'cached', 'password': 'secret'})
+                self.assertEqual(self.client.get(reverse('exam_user:index')).status_code, 200)
+                with self.assertNumQueries(0):
+                    # Loading the user again is a cache hit
+                    self.assertEqual(auth_backends.CachedModelBackend().get_user(self.candidate.pk), self.candidate)
+
+                user = User.objects.get(pk=self.candidate.pk)
+                user.set_password('changed')
+                user.save()
+                response = self.client.get(reverse('exam_user:index'))
+                self.assertRedirects(
+                    response, f"{settings.LOGIN_URL}?next={reverse('exam_user:index')}", fetch_redirect_response=False
+                )
+
+                user.set_password('secret')
+                user.save()
+                self.client.logout()
+
+    def test_demoted_admin_loses_access_to_other_results(self):
+        url = f"{reverse('exam_user:search_result')}?exam_id={self.attempt.attempt_id}"
+        self.client.force_login(self.admin, backend=CACHED_BACKEND)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        # Demoted by another process, so no signal reaches this cache
+        User.objects.filter(pk=self.admin.pk).update(is_admin=False)
+        self.assertRedirects(self.client.get(url), reverse('exam_user:index'), fetch_redirect_response=False)
+
+    def test_cached_candidate_promoted_to_admin_sees_other_results(self):
+        other = User.objects.create(username='other')
+        url = f"{reverse('exam_user:search_result')}?exam_id={self.attempt.attempt_id}"
+        self.client.force_login(other, backend=CACHED_BACKEND)
+        self.assertRedirects(self.client.get(url), reverse('exam_user:index'), fetch_redirect_response=False)
+
+        # The cached copy still says candidate, the view checks the database
+        User.objects.filter(pk=other.pk).update(is_admin=True)
+        self.assertFalse(auth_backends.CachedModelBackend().get_user(other.pk).is_admin)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class AnswerUpsertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.exam = Exam.objects.create(
+            category=Category.objects.create(name='Upsert'), name='Upsert', duration_minutes=30,
+            number_of_questions=4, start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1),
+        )
+        cls.questions = [
+            Question.objects.create(exam=cls.exam, question_text=f'Q{i}', correct_answer='ABCD'[i], marks=marks)
+            for i, marks in enumerate([1.0, 2.0, 0.5, 3.0])
+        ]
+        cls.paper = [question.id for question in cls.questions]
+
+    def start(self, username):
+        return ExamAttempt.objects.create(
+            user=User.objects.create(username=username), exam=self.exam, questions_data=self.paper, total_marks=6.5,
+        )
+
+    def paper_questions(self):
+        # Loaded as take_exam does
+        return Question.objects.filter(id__in=self.paper).only('id', 'correct_answer', 'marks')
+
+    def test_reanswering_updates_the_existing_row(self):
+        attempt = self.start('reanswer')
+        q0, q1 = self.paper[:2]
+        Answer.bulk_upsert(attempt, self.paper_questions(), {q0: 'B', q1: 'B'})
+        first = Answer.objects.get(attempt=attempt, question_id=q0)
+        self.assertEqual((first.is_correct, first.marks_obtained), (False, 0.0))
+
+        Answer.bulk_upsert(attempt, self.paper_questions(), {q0: 'A'})
+        self.assertEqual(attempt.answers.count(), 2)
+        answer = Answer.objects.get(attempt=attempt, question_id=q0)
+        self.assertEqual(answer.pk, first.pk)
+        self.assertEqual((answer.selected_answer, answer.is_correct, answer.marks_obtained), ('A', True, 1.0))
+        # Answers left out of the second save are kept
+        self.assertEqual(Answer.objects.get(attempt=attempt, question_id=q1).selected_answer, 'B')
+
+    def test_grading_matches_answer_grade(self):
+        attempt = self.start('grading')
+        for selected in 'ABCD':
+            saved = Answer.bulk_upsert(attempt, self.paper_questions(), dict.fromkeys(self.paper, selected))
+            self.assertEqual(len(saved), len(self.paper))
+            for question in self.questions:
+                expected = Answer(attempt=attempt, question=question, selected_answer=selected)
+                expected.grade(question)
+                stored = Answer.objects.get(attempt=attempt, question=question)
+                self.assertEqual(
+                    (stored.selected_answer, stored.is_correct, stored.marks_obtained),
+                    (selected, expected.is_correct, expected.marks_obtained),
+                )
+
+    def test_submitted_score_matches_per_row_saves(self):
+        rounds = [
+            {self.paper[0]: 'A', self.paper[1]: 'C', self.paper[3]: 'D'},
+            {self.paper[1]: 'B', self.paper[2]: 'A', self.paper[3]: 'A'},
+            {self.paper[3]: 'D'},
+        ]
+        per_row, bulk = self.start('per-row'), self.start('bulk')
+        for selections in rounds:
+            # One Answer.save() per answer, graded by save() as before bulk_upsert
+            for question in self.questions:
+                if question.id in selections:
+                    answer = per_row.answers.filter(question=question).first() or Answer(
+                        attempt=per_row, question=question
+                    )
+                    answer.selected_answer = selections[question.id]
+                    answer.save()
+            Answer.bulk_upsert(bulk, self.paper_questions(), selections)
+
+        fields = ('question_id', 'selected_answer', 'is_correct', 'marks_obtained')
+        self.assertEqual(
+            list(bulk.answers.order_by('question_id').values_list(*fields)),
+            list(per_row.answers.order_by('question_id').values_list(*fields)),
+        )
+        submitted = []
+        for attempt in (per_row, bulk):
+            self.client.force_login(attempt.user)
+            self.client.get(reverse('exam_user:submit_exam', args=[attempt.attempt_id]))
+            attempt.refresh_from_db()
+            submitted.append((attempt.score, attempt.percentage))
+        self.assertEqual(submitted[0], (6.0, 6.0 / 6.5 * 100))
+        self.assertEqual(submitted[1], submitted[0])
+
+
+class StartExamRaceTests(TestCase):
+    def test_concurrent_start_joins_the_open_attempt(self):
+        now = timezone.now()
+        exam = Exam.objects.create(
+            category=Category.objects.create(name='Race'), name='Race', duration_minutes=30,
+            number_of_questions=1, start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1),
+        )
+        question = Question.objects.create(exam=exam, question_text='Q', correct_answer='A')
+        user = User.objects.create(username='racer')
+        competing = []
+
+        def sample_paper(exam):
+            # The other request creates its attempt after this one looked for it
+            competing.append(ExamAttempt.objects.create(user=user, exam=exam, questions_data=[question.id]))
+            return [question.id], 1.0
+
+        self.client.force_login(user)
+        with mock.patch('exam_user.views.sample_paper', side_effect=sample_paper):
+            response = self.client.get(reverse('exam_user:start_exam', args=[exam.id]))
+        self.assertRedirects(
+            response, reverse('exam_user:take_exam', args=[competing[0].attempt_id]), fetch_redirect_response=False
+        )
+        self.assertEqual(ExamAttempt.objects.filter(user=user, exam=exam).count(), 1)
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Runs a data migration over rows created in the state before it."""
+    before = after = None
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+
+class OneOpenAttemptMigrationTests(MigrationTestCase):
+    before = [('exam_user', '0003_attempt_indexes')]
+    after = [('exam_user', '0004_one_open_attempt')]
+
+    def test_duplicate_open_attempts_are_closed(self):
+        apps = self.migrate(self.before)
+        Exam = apps.get_model('exam_user', 'Exam')
+        Question = apps.get_model('exam_user', 'Question')
+        ExamAttempt = apps.get_model('exam_user', 'ExamAttempt')
+        Answer = apps.get_model('exam_user', 'Answer')
+        now = timezone.now()
+        exam = Exam.objects.create(
+            category=apps.get_model('exam_user', 'Category').objects.create(name='Legacy'), name='Legacy',
+            duration_minutes=30, number_of_questions=1, start_date=now, end_date=now + timedelta(hours=1),
+        )
+        question = Question.objects.create(exam=exam, question_text='Q', correct_answer='A', marks=2.0)
+        user = apps.get_model('exam_user', 'User').objects.create(username='legacy')
+        older, newest = (
+            ExamAttempt.objects.create(
+                attempt_id=code, user=user, exam=exam, questions_data=[question.id], total_marks=2.0,
+            )
+            for code in ('OLDER001', 'NEWEST01')
+        )
+        Answer.objects.create(
+            attempt=older, question=question, selected_answer='A', is_correct=True, marks_obtained=2.0
+        )
+        ExamAttempt.objects.filter(id=older.id).update(start_time=now - timedelta(minutes=5))
+
+        apps = self.migrate(self.after)
+        ExamAttempt = apps.get_model('exam_user', 'ExamAttempt')
+        older = ExamAttempt.objects.get(id=older.id)
+        self.assertTrue(older.is_completed)
+        self.assertIsNotNone(older.end_time)
+        self.assertEqual((older.score, older.percentage), (2.0, 100.0))
+        self.assertFalse(ExamAttempt.objects.get(id=newest.id).is_completed)
+
+
+class OptimizeOptionImagesTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+    def test_converted_questions_render_the_new_image(self):
+        output = io.BytesIO()
+        Image.new('RGB', (40, 30), 'red').save(output, 'PNG')
+        legacy = default_storage.save('options/legacy.png', ContentFile(output.getvalue()))
+        now = timezone.now()
+        exam = Exam.objects.create(
+            category=Category.objects.create(name='Images'), name='Images', duration_minutes=30,
+            number_of_questions=1, start_date=now, end_date=now + timedelta(hours=1),
+        )
+        question = Question.objects.create(
+            exam=exam, question_text='Pictures', option_type='image', correct_answer='A', option_a_image=legacy,
+        )
+        version = question.updated_at
+        questions = Question.objects.filter(id=question.id).only(*VERSION_FIELDS)
+        self.assertIn(legacy, ''.join(get_fragments(list(questions))[question.id][::2]))
+
+        call_command('optimize_option_images', stdout=io.StringIO())
+        question.refresh_from_db()
+        self.assertNotEqual(question.option_a_image.name, legacy)
+        self.assertGreater(question.updated_at, version)
+        markup = ''.join(get_fragments(list(questions))[question.id][::2])
+        self.assertIn(question.option_a_image.name, markup)
+        self.assertNotIn(legacy, markup)
+
+
+class StatisticsBackfillMigrationTests(MigrationTestCase):
+    before = [('exam_user', '0011_attempt_id_sequence')]
+    after = [('exam_user', '0012_backfill_exam_statistics')]
+
+    def test_exams_without_statistics_are_counted(self):
+        apps = self.migrate(self.before)
+        Exam = apps.get_model('exam_user', 'Exam')
+        ExamAttempt = apps.get_model('exam_user', 'ExamAttempt')
+        now = timezone.now()
+        exam = Exam.objects.create(
+            category=apps.get_model('exam_user', 'Category').objects.create(name='Legacy'), name='Legacy',
+            duration_minutes=30, number_of_questions=1, start_date=now, end_date=now + timedelta(hours=1),
+            pass_percentage=50.0,
+        )
+        user = apps.get_model('exam_user', 'User').objects.create(username='legacy')
+        for code, score in (('LEGACY01', 1.0), ('LEGACY02', 2.0), ('LEGACY03', 2.0)):
+            ExamAttempt.objects.create(
+                attempt_id=code, user=user, exam=exam, is_completed=True, end_time=now,
+                score=score, total_marks=2.0, percentage=score * 50.0,
+            )
+
+        apps = self.migrate(self.after)
+        statistics = apps.get_model('exam_user', 'ExamStatistics').objects.get(exam_id=exam.id)
+        self.assertEqual((statistics.attempts_count, statistics.pass_count, statistics.score_sum), (3, 3, 5.0))
+        self.assertEqual(statistics.score_counts, [[1.0, 1], [2.0, 2]])
+        self.assertEqual(statistics.histogram, [0, 0, 0, 0, 0, 1, 0, 0, 0, 2])
+
+
+class ExamStatisticsTests(TestCase):
+    def test_first_recorded_attempt_counts_earlier_ones(self):
+        now = timezone.now()
+        exam = Exam.objects.create(
+            category=Category.objects.create(name='Stats'), name='Stats', duration_minutes=30,
+            number_of_questions=1, start_date=now, end_date=now + timedelta(hours=1), pass_percentage=50.0,
+        )
+        attempts = [
+            ExamAttempt.objects.create(
+                user=User.objects.create(username=f'earlier{i}'), exam=exam, is_completed=True, end_time=now,
+                score=float(i), total_marks=2.0, percentage=i * 50.0,
+            )
+            for i in range(3)
+        ]
+        self.assertFalse(ExamStatistics.objects.filter(exam=exam).exists())
+
+        statistics = record_completed_attempt(attempts[-1])
+        self.assertEqual((statistics.attempts_count, statistics.pass_count, statistics.score_sum), (3, 2, 3.0))
+        statistics = record_completed_attempt(ExamAttempt.objects.create(
+            user=User.objects.create(username='later'), exam=exam, is_completed=True, end_time=now,
+            score=2.0, total_marks=2.0, percentage=100.0,
+        ))
+        self.assertEqual((statistics.attempts_count, statistics.score_sum), (4, 5.0))
+        self.assertEqual(statistics.score_counts, [[0.0, 1], [1.0, 1], [2.0, 2]])
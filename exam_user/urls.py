@@ -11,6 +11,7 @@ urlpatterns = [
     path('category/<int:category_id>/', views.category_detail, name='category_detail'),
     path('exam/<int:exam_id>/start/', views.start_exam, name='start_exam'),
     path('exam/<str:attempt_id>/', views.take_exam, name='take_exam'),
+    path('exam/<str:attempt_id>/autosave/', views.autosave_answers, name='autosave_answers'),
     path('exam/<str:attempt_id>/submit/', views.submit_exam, name='submit_exam'),
     path('search/', views.search_result, name='search_result'),
 ]
\ No newline at end of file
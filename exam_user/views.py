@@ -4,11 +4,27 @@ from django.shortcuts import render
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.http import Http404, JsonResponse
+from django.urls import reverse
 from django.utils import timezone
-import random
-from .models import Category, Exam, Question, ExamAttempt, Answer
+from django.views.decorators.http import require_POST
+from django.views.static import serve
+from django.conf import settings
+import json
+from .models import ArchivedAttempt, Exam, Question, ExamAttempt, Answer
 from .models import User
+from .images import is_immutable
+from .exam_catalog import get_categories, get_category_exams
+from .leaderboard import rank_attempt
+from .question_bank import sample_paper
+from .question_fragments import VERSION_FIELDS, apply_answer, get_fragments
+from .counters import record_activity
+from .statistics import record_completed_attempt
+from . import metrics
 from django.contrib import messages
+from django.db import IntegrityError
+from django.db.models import Sum, Value
 
 
 def register(request):
@@ -61,26 +77,32 @@ def user_logout(request):
 
 @login_required
 def index(request):
-    categories = Category.objects.all()
-    return render(request, 'exam_user/index.html', {'categories': categories})
+    return render(request, 'exam_user/index.html', {'categories': get_categories()})
 
 @login_required
 def category_detail(request, category_id):
-    category = get_object_or_404(Category, id=category_id)
-    active_exams = category.exams.filter(start_date__lte=timezone.now(), end_date__gte=timezone.now())
-    
-    # Get exams this user has already completed
-    completed_exam_ids = ExamAttempt.objects.filter(
-        user=request.user,
-        exam__category=category,
-        is_completed=True
-    ).values_list('exam_id', flat=True)
-    
+    listing = get_category_exams(category_id)
+    if listing is None:
+        raise Http404('No Category matches the given query.')
+    category, active_exams = listing
+
+    # Exams this user has already completed, live or archived, in one query
+    completed_exam_ids = set()
+    if active_exams:
+        exam_ids = [exam.id for exam in active_exams]
+        completed_exam_ids = set(ExamAttempt.objects.filter(
+            user=request.user,
+            exam_id__in=exam_ids,
+            is_completed=True
+        ).order_by().values_list('exam_id', flat=True).union(
+            ArchivedAttempt.objects.filter(user=request.user, exam_id__in=exam_ids).values_list('exam_id', flat=True)
+        ))
+
     # Pass to template
     context = {
         'category': category,
         'exams': active_exams,
-        'user_completed_exams': active_exams.filter(id__in=completed_exam_ids)
+        'completed_exam_ids': completed_exam_ids,
     }
     return render(request, 'exam_user/category_detail.html', context)
 
@@ -91,70 +113,159 @@ def start_exam(request, exam_id):
         messages.error(request, "This exam is not currently active.")
         return redirect('exam_user:index')
 
-    # Check if user already attempted this exam
-    if ExamAttempt.objects.filter(user=request.user, exam=exam, is_completed=True).exists():
+    # One query answers both "already completed?" and "already started?",
+    # counting attempts archived before the exam was reopened as completed
+    existing = ExamAttempt.objects.filter(user=request.user, exam=exam).order_by()
+    existing = existing.values_list('attempt_id', 'is_completed')
+    archived = ArchivedAttempt.objects.filter(user=request.user, exam=exam).annotate(completed=Value(True))
+    existing = existing.union(archived.values_list('attempt_id', 'completed')).order_by('-is_completed').first()
+    if existing and existing[1]:
         messages.warning(request, "You have already completed this exam. You cannot take it again.")
         return redirect('exam_user:index')
 
     # If already started but not completed (e.g. page refresh), redirect to ongoing attempt
-    ongoing_attempt = ExamAttempt.objects.filter(user=request.user, exam=exam, is_completed=False).first()
-    if ongoing_attempt:
-        return redirect('exam_user:take_exam', attempt_id=ongoing_attempt.attempt_id)
+    if existing:
+        return redirect('exam_user:take_exam', attempt_id=existing[0])
 
-    # Create new attempt
-    attempt = ExamAttempt.objects.create(user=request.user, exam=exam)
-    
-    all_questions = list(exam.questions.all())
-    selected_questions = random.sample(all_questions, min(len(all_questions), exam.number_of_questions))
-    attempt.questions_data = [q.id for q in selected_questions]
-    attempt.total_marks = sum(q.marks for q in selected_questions)
-    attempt.save()
+    # Create new attempt. A concurrent start (e.g. double click) trips the
+    # one-open-attempt constraint, and then we join the attempt it created.
+    questions_data, total_marks = sample_paper(exam)
+    try:
+        attempt = ExamAttempt.objects.create(
+            user=request.user, exam=exam, questions_data=questions_data, total_marks=total_marks
+        )
+    except IntegrityError:
+        ongoing_attempt = ExamAttempt.objects.filter(user=request.user, exam=exam, is_completed=False).first()
+        if ongoing_attempt is None:
+            raise
+        return redirect('exam_user:take_exam', attempt_id=ongoing_attempt.attempt_id)
 
+    metrics.increment('exam_attempts_started_total')
+    record_activity(started=1)
     messages.success(request, f"Exam started! Attempt ID: {attempt.attempt_id}")
     return redirect('exam_user:take_exam', attempt_id=attempt.attempt_id)
 
 @login_required
 def take_exam(request, attempt_id):
-    attempt = get_object_or_404(ExamAttempt, attempt_id=attempt_id, user=request.user, is_completed=False)
+    attempt = get_object_or_404(
+        ExamAttempt.objects.select_related('exam'),
+        attempt_id=attempt_id, user=request.user, is_completed=False
+    )
 
     elapsed_seconds = (timezone.now() - attempt.start_time).total_seconds()
     if elapsed_seconds > attempt.exam.duration_minutes * 60:
         return redirect('exam_user:submit_exam', attempt_id=attempt_id)
 
-    questions = Question.objects.filter(id__in=attempt.questions_data)
+    # Paged exams only load, save and render the questions of one page
+    page = None
+    question_ids = attempt.questions_data
+    if attempt.exam.delivery_mode == Exam.DELIVERY_PAGED:
+        paginator = Paginator(sorted(attempt.questions_data), max(attempt.exam.questions_per_page, 1))
+        page = paginator.get_page(request.POST.get('page') or request.GET.get('page'))
+        question_ids = page.object_list
+
+    questions = Question.objects.filter(id__in=question_ids).only(*VERSION_FIELDS, 'correct_answer', 'marks')
     remaining_seconds = max(0, int(attempt.exam.duration_minutes * 60 - elapsed_seconds))
 
     if request.method == 'POST':
-        for question in questions:
-            selected = request.POST.get(f'question_{question.id}')
-            if selected:
-                Answer.objects.update_or_create(
-                    attempt=attempt,
-                    question=question,
-                    defaults={'selected_answer': selected}
-                )
+        selections = {
+            question.id: request.POST.get(f'question_{question.id}')
+            for question in questions
+        }
+        saved = Answer.bulk_upsert(attempt, questions, selections)
+        metrics.increment('exam_answers_written_total', len(saved))
         if 'submit' in request.POST or remaining_seconds <= 0:
             return redirect('exam_user:submit_exam', attempt_id=attempt_id)
+        if page is not None:
+            target = request.POST.get('goto', '')
+            target = int(target) if target.isdigit() else page.number
+            return redirect(f"{reverse('exam_user:take_exam', args=[attempt_id])}?page={target}")
 
-    existing_answers = {ans.question.id: ans.selected_answer for ans in attempt.answers.all()}
+    answers = attempt.answers.all()
+    if page is not None:
+        answers = answers.filter(question_id__in=question_ids)
+    existing_answers = dict(answers.values_list('question_id', 'selected_answer'))
+    fragments = get_fragments(questions)
+    paper = [
+        (question, apply_answer(fragments[question.id], existing_answers.get(question.id)))
+        for question in questions if question.id in fragments
+    ]
 
-    return render(request, 'exam_user/take_exam.html', {
+    context = {
         'attempt': attempt,
-        'questions': questions,
-        'existing_answers': existing_answers,
+        'paper': paper,
+        'page': page,
+        'question_count': len(attempt.questions_data),
         'remaining_seconds': remaining_seconds,
-    })
+    }
+    if page is not None and request.GET.get('partial'):
+        return render(request, 'exam_user/question_page.html', context)
+    return render(request, 'exam_user/take_exam.html', context)
+
+@login_required
+@require_POST
+def autosave_answers(request, attempt_id):
+    """Save only the answers that changed, sent as JSON by take_exam.html.
+
+    Expects a body like {"answers": {"<question id>": "A"}} and replies with
+    the number of saved answers and the remaining time.
+    """
+    attempt = get_object_or_404(
+        ExamAttempt.objects.select_related('exam'),
+        attempt_id=attempt_id, user=request.user, is_completed=False
+    )
+
+    elapsed_seconds = (timezone.now() - attempt.start_time).total_seconds()
+    remaining_seconds = max(0, int(attempt.exam.duration_minutes * 60 - elapsed_seconds))
+    if remaining_seconds <= 0:
+        return JsonResponse({
+            'error': 'Time is up.',
+            'redirect': reverse('exam_user:submit_exam', args=[attempt_id]),
+        }, status=403)
+
+    try:
+        answers = json.loads(request.body)['answers']
+        selections = {int(question_id): selected for question_id, selected in answers.items()}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Invalid request body.'}, status=400)
+
+    allowed_ids = set(attempt.questions_data)
+    if not selections.keys() <= allowed_ids:
+        return JsonResponse({'error': 'Question is not part of this attempt.'}, status=400)
+    options = [choice for choice, _ in Answer._meta.get_field('selected_answer').choices]
+    if not all(isinstance(selected, str) and selected in options for selected in selections.values()):
+        return JsonResponse({'error': f'Answers must be one of {", ".join(options)}.'}, status=400)
+
+    questions = Question.objects.filter(id__in=selections).only('id', 'correct_answer', 'marks')
+    saved = Answer.bulk_upsert(attempt, questions, selections)
+    metrics.increment('exam_autosaves_total')
+    metrics.increment('exam_answers_written_total', len(saved))
+    return JsonResponse({'saved': len(saved), 'remaining_seconds': remaining_seconds})
 
 @login_required
 def submit_exam(request, attempt_id):
-    attempt = get_object_or_404(ExamAttempt, attempt_id=attempt_id, user=request.user)
+    attempt = get_object_or_404(
+        ExamAttempt.objects.select_related('exam__category'), attempt_id=attempt_id, user=request.user
+    )
+    stats = None
     if not attempt.is_completed:
-        attempt.score = sum(ans.marks_obtained for ans in attempt.answers.all())
+        attempt.score = attempt.answers.aggregate(total=Sum('marks_obtained'))['total'] or 0.0
         attempt.percentage = (attempt.score / attempt.total_marks * 100) if attempt.total_marks > 0 else 0
         attempt.is_completed = True
         attempt.end_time = timezone.now()
-        attempt.save()
-    return render(request, 'exam_user/results.html', {'attempt': attempt})
+        # Only the request that actually completes the attempt counts it
+        completed = ExamAttempt.objects.filter(pk=attempt.pk, is_completed=False).update(
+            score=attempt.score, percentage=attempt.percentage,
+            is_completed=True, end_time=attempt.end_time,
+        )
+        if completed:
+            stats = record_completed_attempt(attempt)
+            metrics.increment('exam_attempts_submitted_total')
+            record_activity(submitted=1)
+    return render(request, 'exam_user/results.html', {
+        'attempt': attempt,
+        'ranking': rank_attempt(attempt, stats),
+    })
 
 @login_required
 def search_result(request):
@@ -166,15 +277,29 @@ def search_result(request):
     # attempt = get_object_or_404(ExamAttempt, id=exam_id)
 
     # CORRECT → Use the custom attempt_id field (the 8-char code)
-    attempt = get_object_or_404(ExamAttempt, attempt_id=exam_id)
+    attempt = ExamAttempt.objects.select_related('exam__category').filter(attempt_id=exam_id).first()
+    if attempt is None:
+        # Results of long-closed exams live in the archive
+        attempt = get_object_or_404(ArchivedAttempt.objects.select_related('exam__category'), attempt_id=exam_id)
     
-    # Security: Only allow the owner or admin to view
-    if attempt.user != request.user and not (request.user.is_admin or request.user.is_superuser):
-        return redirect('exam_user:index')
+    # Security: Only allow the owner or admin to view. The privilege flags are
+    # read from the database, request.user may come from the user cache.
+    if attempt.user_id != request.user.pk:
+        is_admin, is_superuser = User.objects.filter(pk=request.user.pk).values_list(
+            'is_admin', 'is_superuser'
+        ).get()
+        if not (is_admin or is_superuser):
+            return redirect('exam_user:index')
     
-    return render(request, 'exam_user/results.html', {'attempt': attempt})
-
-
-
+    return render(request, 'exam_user/results.html', {
+        'attempt': attempt,
+        'ranking': rank_attempt(attempt),
+    })
 
 
+def serve_media(request, path):
+    """Development media server that marks content-hashed images as immutable."""
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_immutable(path):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,172 @@
+"""
+Compare the development and production SQLite profiles on the exam flow.
+
+Reader threads repeat the queries behind a take_exam page (attempt, paper
+questions, saved answers), while writer threads repeat autosaves (upsert a
+few answers of an attempt in one transaction). Each profile runs against a
+fresh database file and the throughput, latency and "database is locked"
+errors of both are printed as JSON.
+
+    python scripts/benchmark_sqlite.py --readers 8 --writers 8 --seconds 10
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from exam_pjt.settings import SQLITE_PRODUCTION_PRAGMAS  # noqa: E402
+
+PROFILES = {
+    # Django's defaults: rollback journal, 5 s busy timeout, deferred BEGIN
+    'development': {'pragmas': [], 'timeout': 5, 'begin': 'BEGIN'},
+    'production': {'pragmas': SQLITE_PRODUCTION_PRAGMAS, 'timeout': 20, 'begin': 'BEGIN IMMEDIATE'},
+}
+
+SCHEMA = """
+CREATE TABLE question (id INTEGER PRIMARY KEY, exam_id INTEGER, question_text TEXT,
+    option_a TEXT, option_b TEXT, option_c TEXT, option_d TEXT, correct_answer TEXT, marks REAL);
+CREATE TABLE attempt (id INTEGER PRIMARY KEY, attempt_id TEXT UNIQUE, user_id INTEGER,
+    exam_id INTEGER, questions_data TEXT, is_completed INTEGER);
+CREATE TABLE answer (id INTEGER PRIMARY KEY, attempt_id INTEGER, question_id INTEGER,
+    selected_answer TEXT, is_correct INTEGER, marks_obtained REAL, UNIQUE (attempt_id, question_id));
+"""
+
+QUESTIONS = 200
+PAPER = 50
+ANSWERS_PER_SAVE = 5
+
+
+def connect(path, profile):
+    connection = sqlite3.connect(path, timeout=profile['timeout'], isolation_level=None, check_same_thread=False)
+    for pragma in profile['pragmas']:
+        connection.execute(pragma)
+    return connection
+
+
+def seed(path, attempts):
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.executescript(SCHEMA)
+    connection.execute('BEGIN')
+    connection.executemany(
+        'INSERT INTO question VALUES (?, 1, ?, ?, ?, ?, ?, ?, 1.0)',
+        [(i, 'Question text ' * 10, 'a' * 40, 'b' * 40, 'c' * 40, 'd' * 40, 'A') for i in range(1, QUESTIONS + 1)],
+    )
+    for i in range(1, attempts + 1):
+        paper = random.sample(range(1, QUESTIONS + 1), PAPER)
+        connection.execute('INSERT INTO attempt VALUES (?, ?, ?, 1, ?, 0)', (i, f'A{i:07d}', i, json.dumps(paper)))
+    connection.execute('COMMIT')
+    connection.close()
+
+
+def read_page(connection, attempt):
+    row = connection.execute(
+        'SELECT id, questions_data FROM attempt WHERE attempt_id = ?', (f'A{attempt:07d}',)
+    ).fetchone()
+    paper = json.loads(row[1])
+    connection.execute(
+        f'SELECT * FROM question WHERE id IN ({",".join("?" * len(paper))})', paper
+    ).fetchall()
+    connection.execute('SELECT question_id, selected_answer FROM answer WHERE attempt_id = ?', (row[0],)).fetchall()
+
+
+def autosave(connection, profile, attempt):
+    paper = json.loads(connection.execute('SELECT questions_data FROM attempt WHERE id = ?', (attempt,)).fetchone()[0])
+    rows = [(attempt, question, random.choice('ABCD')) for question in random.sample(paper, ANSWERS_PER_SAVE)]
+    connection.execute(profile['begin'])
+    try:
+        connection.executemany(
+            'INSERT INTO answer (attempt_id, question_id, selected_answer, is_correct, marks_obtained) '
+            'VALUES (?, ?, ?, 0, 0) ON CONFLICT (attempt_id, question_id) '
+            'DO UPDATE SET selected_answer = excluded.selected_answer',
+            rows,
+        )
+        connection.execute('COMMIT')
+    except sqlite3.OperationalError:
+        connection.execute('ROLLBACK')
+        raise
+
+
+def worker(kind, path, profile, attempts, deadline, results):
+    connection = connect(path, profile)
+    latencies, errors = [], 0
+    while time.perf_counter() < deadline:
+        attempt = random.randint(1, attempts)
+        started = time.perf_counter()
+        try:
+            if kind == 'read':
+                read_page(connection, attempt)
+            else:
+                autosave(connection, profile, attempt)
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    connection.close()
+    results.append((kind, latencies, errors))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 3)
+
+
+def run_profile(name, readers, writers, seconds, attempts):
+    profile = PROFILES[name]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite3')
+        seed(path, attempts)
+        connect(path, profile).close()  # switch journal mode before the workers start
+
+        results = []
+        deadline = time.perf_counter() + seconds
+        threads = [
+            threading.Thread(target=worker, args=(kind, path, profile, attempts, deadline, results))
+            for kind in ['read'] * readers + ['write'] * writers
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    summary = {}
+    for kind in ('read', 'write'):
+        latencies = [value for k, values, _ in results if k == kind for value in values]
+        errors = sum(e for k, _, e in results if k == kind)
+        summary[kind] = {
+            'ops_per_second': round(len(latencies) / seconds, 1),
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'locked_errors': errors,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--attempts', type=int, default=2000)
+    parser.add_argument('--profile', choices=sorted(PROFILES), action='append',
+                        help='Profile to run (repeatable). Defaults to all.')
+    args = parser.parse_args()
+
+    report = {
+        name: run_profile(name, args.readers, args.writers, args.seconds, args.attempts)
+        for name in (args.profile or PROFILES)
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+End-to-end load test of the candidate exam flow.
+
+By default this seeds a fresh SQLite database in a temporary directory,
+starts the project on it with runserver and drives N concurrent candidates
+through register -> category_detail -> start_exam -> take_exam -> repeated
+autosaves -> submit_exam. The JSON summary on stdout has overall
+throughput plus request count, p50/p95/p99 latency and error / "database
+is locked" rates per URL name, so runs of different builds can be diffed.
+
+    python scripts/loadtest.py --users 50 --autosaves 10
+    EXAM_DB_PROFILE=production python scripts/loadtest.py --users 200 --output run.json
+
+Use --url together with --category and --exam to target a server that is
+already running and seeded instead.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTION_RE = re.compile(r'name="question_(\d+)"')
+CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+# Server setup
+
+def seed_database(db_name, questions, paper):
+    """Migrate a fresh database and add one active exam, returns (category id, exam id)."""
+    os.environ['EXAM_DB_NAME'] = db_name
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'exam_pjt.settings')
+    sys.path.insert(0, BASE_DIR)
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.utils import timezone
+    from exam_user.models import Category, Exam, Question
+
+    call_command('migrate', verbosity=0)
+    category = Category.objects.create(name='Load test')
+    now = timezone.now()
+    exam = Exam.objects.create(
+        category=category, name='Load test exam', duration_minutes=120, number_of_questions=paper,
+        start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+    )
+    Question.objects.bulk_create([
+        Question(
+            exam=exam, question_text=f'Question {i}', option_a='Alpha', option_b='Beta',
+            option_c='Gamma', option_d='Delta', correct_answer=random.choice('ABCD'),
+        )
+        for i in range(questions)
+    ])
+    return category.id, exam.id
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_name, port):
+    env = dict(os.environ, EXAM_DB_NAME=db_name)
+    server = subprocess.Popen(
+        [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}'],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError('The development server did not start.')
+
+
+# Client
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.locked = defaultdict(int)
+
+    def add(self, name, seconds, ok, locked):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+            if locked:
+                self.locked[name] += 1
+
+
+class Candidate:
+    def __init__(self, base_url, recorder):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), NoRedirect)
+
+    def csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def request(self, name, path, data=None, json_body=None):
+        headers = {'Referer': self.base_url + path}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers.update({'Content-Type': 'application/json', 'X-CSRFToken': self.csrf_token()})
+        elif data is not None:
+            body = urllib.parse.urlencode(dict(data, csrfmiddlewaretoken=self.csrf_token()), doseq=True).encode()
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers)
+
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                status, location, content = response.status, None, response.read().decode(errors='replace')
+        except urllib.error.HTTPError as error:
+            status, location = error.code, error.headers.get('Location')
+            content = error.read().decode(errors='replace')
+        except OSError as error:
+            status, location, content = 0, None, str(error)
+        elapsed = time.perf_counter() - started
+
+        ok = 200 <= status < 400
+        self.recorder.add(name, elapsed, ok, 'database is locked' in content)
+        if not ok:
+            raise RuntimeError(f'{name} returned {status}')
+        return location, content
+
+    def run(self, category_id, exam_id, autosaves):
+        username = f'load-{uuid.uuid4().hex[:12]}'
+        self.request('register', '/register/')
+        self.request('register', '/register/', {
+            'username': username, 'password': 'load-test-pass', 'confirm_password': 'load-test-pass',
+        })
+        self.request('category_detail', f'/category/{category_id}/')
+
+        location, _ = self.request('start_exam', f'/exam/{exam_id}/start/')
+        take_path = urllib.parse.urlparse(location).path
+        _, page = self.request('take_exam', take_path)
+        question_ids = sorted(set(QUESTION_RE.findall(page)))
+
+        for _ in range(autosaves):
+            question_id = random.choice(question_ids)
+            self.request('autosave_answers', f'{take_path}autosave/',
+                         json_body={'answers': {question_id: random.choice('ABCD')}})
+
+        answers = {f'question_{question_id}': random.choice('ABCD') for question_id in question_ids}
+        location, _ = self.request('take_exam', take_path, dict(answers, submit='1'))
+        self.request('submit_exam', urllib.parse.urlparse(location).path)
+
+
+# Reporting
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 2)
+
+
+def summarize(recorder, seconds, users, completed):
+    total = sum(len(values) for values in recorder.latencies.values())
+    return {
+        'users': users,
+        'completed_flows': completed,
+        'duration_seconds': round(seconds, 2),
+        'requests_per_second': round(total / seconds, 2),
+        'flows_per_second': round(completed / seconds, 2),
+        'urls': {
+            name: {
+                'requests': len(values),
+                'p50_ms': percentile(values, 0.50),
+                'p95_ms': percentile(values, 0.95),
+                'p99_ms': percentile(values, 0.99),
+                'error_rate': round(recorder.errors[name] / len(values), 4),
+                'locked_rate': round(recorder.locked[name] / len(values), 4),
+            }
+            for name, values in sorted(recorder.latencies.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20, help='Concurrent candidates.')
+    parser.add_argument('--autosaves', type=int, default=10, help='Autosaves per candidate.')
+    parser.add_argument('--questions', type=int, default=200, help='Seeded question bank size.')
+    parser.add_argument('--paper', type=int, default=50, help='Questions per paper.')
+    parser.add_argument('--url', help='Target an already running server instead of starting one.')
+    parser.add_argument('--category', type=int, help='Category id to use with --url.')
+    parser.add_argument('--exam', type=int, help='Exam id to use with --url.')
+    parser.add_argument('--output', help='Also write the JSON summary to this file.')
+    args = parser.parse_args()
+
+    server = None
+    with tempfile.TemporaryDirectory() as directory:
+        if args.url:
+            if not (args.category and args.exam):
+                parser.error('--url needs --category and --exam')
+            base_url, category_id, exam_id = args.url, args.category, args.exam
+        else:
+            db_name = os.path.join(directory, 'loadtest.sqlite3')
+            category_id, exam_id = seed_database(db_name, args.questions, args.paper)
+            port = free_port()
+            server = start_server(db_name, port)
+            base_url = f'http://127.0.0.1:{port}'
+
+        recorder = Recorder()
+        completed = []
+
+        def flow():
+            try:
+                Candidate(base_url, recorder).run(category_id, exam_id, args.autosaves)
+                completed.append(1)
+            except RuntimeError:
+                pass
+
+        try:
+            started = time.perf_counter()
+            threads = [threading.Thread(target=flow) for _ in range(args.users)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+    summary = summarize(recorder, elapsed, args.users, len(completed))
+    output = json.dumps(summary, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as summary_file:
+            summary_file.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()